@@ -1,17 +1,45 @@
 import whisper
 import torch
 import webrtcvad
-from flask import Flask, request, jsonify
-from pydub import AudioSegment
+import numpy as np
+from flask import Flask, request, jsonify, g
 import tempfile
 import time
 import whisper.version
-from typing import List, Dict
+from typing import List, Dict, Optional
 import warnings
 import os
 import sys
 import threading
 import json
+import io
+import wave
+import subprocess
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import copy
+import itertools
+import uuid
+import hashlib
+import bisect
+import atexit
+import logging
+import logging.handlers
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+
+try:
+    import orjson  # optional: faster JSON for streamed responses
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # optional: MessagePack caption responses
+except ImportError:
+    msgpack = None
 
 APP_VERSION = "1.6.2"  # optimized: config.json + N-line captions + unified params
 
@@ -20,12 +48,15 @@ APP_VERSION = "1.6.2"  # optimized: config.json + N-line captions + unified para
 # ----------------------------------------------------------------------
 base_path = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__)
 
-model_cache_dir = os.path.join(
-    os.environ["PROGRAMDATA"],
-    "Antix Digital",
-    "AICS Service",
-    "model_cache"
-)
+
+def programdata_path(*parts: str) -> str:
+    """
+    Path under %PROGRAMDATA%\\Antix Digital\\AICS Service (caches, logs, jobs, state).
+    """
+    return os.path.join(os.environ["PROGRAMDATA"], "Antix Digital", "AICS Service", *parts)
+
+
+model_cache_dir = programdata_path("model_cache")
 
 os.environ["XDG_CACHE_HOME"] = model_cache_dir
 print("Loading Whisper model from:", os.environ.get("XDG_CACHE_HOME", "Default system cache"))
@@ -34,20 +65,13 @@ print("Loading Whisper model from:", os.environ.get("XDG_CACHE_HOME", "Default s
 CONFIG_PATH_PRIMARY = os.path.join(base_path, "config.json")
 
 # Fallback config in ProgramData\Antix Digital\AICS Service\config.json
-CONFIG_PATH_FALLBACK = os.path.join(
-    os.environ["PROGRAMDATA"],
-    "Antix Digital",
-    "AICS Service",
-    "config.json"
-)
+CONFIG_PATH_FALLBACK = programdata_path("config.json")
 
 warnings.filterwarnings("ignore")
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print("Using device:", device)
 
-model_lock = threading.Lock()
-
 available_models = {
     "tiny": "tiny",
     "tiny.en": "tiny.en",
@@ -64,7 +88,6 @@ available_models = {
     "large-v3-turbo": "large-v3-turbo"
 }
 
-model_cache = {}
 last_used_model = "large-v3-turbo"
 
 # ----------------------------------------------------------------------
@@ -80,25 +103,131 @@ DEFAULT_CONFIG: Dict = {
 
     "vad_aggressiveness": 2,
     "vad_voice_ratio_threshold": 0.1,
+    "vad_engine": "webrtc",   # "webrtc" (reference) or "energy" (vectorized NumPy)
     "min_text_length": 5,
     "wrap_length": 32,
 
     "enable_filtering": False,
     "enable_vad": True,
+    "skip_vad_silence": False,  # VAD-silent chunks return an empty result without running Whisper
     "enable_caps": True,      # CAPS ON by default (per customer request)
     "pretty_json": False,
+    "stream_response": False,  # emit the response incrementally, segment by segment
+    "exclude": "",            # comma list of response fields to drop: tokens, words, result
 
     "silence_threshold": 1.0,
-    "max_caption_lines": 2    # N-line support, default = 2 (Riadh’s required default)
+    "max_caption_lines": 2,   # N-line support, default = 2 (Riadh’s required default)
+
+    "in_memory_ingest": True,  # decode uploads from the request stream, no temp file
+
+    "model_pool_budget_mb": 0,  # RAM/VRAM budget for loaded models, 0 = unlimited
+    "model_replicas": 1,        # loaded copies per model (parallel decodes of the same model)
+    "cpu_threads_per_replica": 0,  # CPU only: torch threads per replica, 0 = cores / replicas
+    "inference_workers": 0,     # >0: run inference in N separate processes (worker mode):
+                                # one replica per worker, no micro-batching, result cache in front end only
+
+    # Whisper result cache for resent chunks (hash of PCM + model + decoding options)
+    "result_cache_entries": 256,  # in-memory LRU size, 0 = off
+    "result_cache_disk": False,   # also persist results under ProgramData
+    "result_cache_disk_max_entries": 10000,
+
+    # Async jobs (/jobs) for long files
+    "job_workers": 1,
+    "job_queue_size": 100,
+    "job_result_ttl_seconds": 3600,
+    "job_live_reserve": 1,      # replicas per model kept for live /transcribe traffic
+
+    # Micro-batching of concurrent short chunks (same model + options)
+    "enable_batching": False,
+    "batch_window_ms": 15,
+    "batch_max_size": 8,
+
+    # /stream raw PCM ingest: server-side segmentation
+    "stream_silence_ms": 500,
+    "stream_max_segment_seconds": 10.0,
+    "stream_overlap_seconds": 0.5,
+
+    # Structured logging (JSON lines; file rotates by size)
+    "log_level": "INFO",
+    "log_file": "",             # "" = ProgramData\Antix Digital\AICS Service\logs\aics.log
+    "log_max_bytes": 10485760,
+    "log_backup_count": 5,
+    "log_queue_size": 10000,    # records waiting for the writer; beyond that they are dropped
+    "log_console": True,
+
+    # Long-form mode: VAD-split shards transcribed in parallel, then stitched
+    "long_form": False,
+    "shard_max_seconds": 30.0,  # <= 30 keeps every shard a single Whisper window
+
+    # Per-stream language lock: pass language= once a stream's language is stable
+    "language_lock": False,           # opt-in: changes decoding for streams once locked
+    "language_lock_chunks": 3,        # consecutive confident detections that lock it
+    "language_lock_seconds": 600,     # re-detect after this long
+    "language_min_logprob": -1.0,     # mean segment avg_logprob counted as confident
+
+    # Latency-bounded temperature fallback for decodes that fail Whisper's quality checks
+    "max_fallbacks": 0,                 # extra decodes per chunk, 0 = single decode (no fallback)
+    "fallback_deadline_ms": 0,          # no further attempt unless it fits, 0 = no deadline
+    "fallback_temperature_step": 0.2,   # temperature added per attempt (capped at 1.0)
+
+    # Hot reload + named per-stream profiles
+    "config_reload_seconds": 5,  # config.json poll interval, 0 = no watcher
+    "profiles": {},              # name -> { per-request parameter overrides }
+    "stream_profiles": {},       # stream_id -> profile name (used when no 'profile' field is sent)
+
+    # Caption state per stream_id (least recently used streams beyond the cap are dropped)
+    "max_streams": 10000,
+
+    # Caption state snapshots (restored at startup, so restarts keep scrolling captions)
+    "stream_state_snapshot_seconds": 2,          # journal flush interval, 0 = no snapshots
+    "stream_state_journal_max_bytes": 16777216,  # compact the journal beyond this size
+
+    # /transcribe pipeline: more server threads than replicas, so one request's decode + VAD
+    # overlaps another's inference; the CPU stages are capped so they leave torch its cores
+    "server_threads": 16,        # waitress request threads
+    "pipeline_cpu_workers": 0,   # concurrent decode + VAD, 0 = half the CPU cores
+    "pipeline_post_workers": 0   # concurrent caption layout + serialization, 0 = half the CPU cores
 }
 
+# Sized / started once at startup: a reload logs a change but keeps the running value
+STARTUP_ONLY_KEYS = (
+    "model_pool_budget_mb", "model_replicas", "cpu_threads_per_replica", "inference_workers",
+    "result_cache_entries", "result_cache_disk", "result_cache_disk_max_entries",
+    "job_workers", "job_queue_size", "job_result_ttl_seconds", "job_live_reserve",
+    "batch_window_ms", "batch_max_size",
+    "log_file", "log_max_bytes", "log_backup_count", "log_queue_size", "log_console",
+    "config_reload_seconds", "max_streams", "stream_state_snapshot_seconds", "stream_state_journal_max_bytes",
+    "server_threads", "pipeline_cpu_workers", "pipeline_post_workers"
+)
+
+
+def config_type_errors(config: Dict) -> List[str]:
+    """
+    Keys whose value doesn't have the type of its DEFAULT_CONFIG entry
+    (any number is accepted where the default is numeric).
+    """
+    errors = []
+    for key, default in DEFAULT_CONFIG.items():
+        value = config[key]
+        if isinstance(default, bool):
+            ok = isinstance(value, bool)
+        elif isinstance(default, (int, float)):
+            ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            ok = isinstance(value, type(default))
+        if not ok:
+            errors.append(f"{key} must be {type(default).__name__}, got {json.dumps(value)}")
+    return errors
 
-def load_config() -> Dict:
+
+def load_config(strict: bool = False) -> Dict:
     """
     Load config.json from:
       1) Same folder as app.py / EXE (primary)
       2) ProgramData\Antix Digital\AICS Service\config.json (fallback)
     If missing or invalid, fall back to DEFAULT_CONFIG.
+    With strict=True (hot reload) an unreadable or mistyped file raises ValueError
+    instead, so the running config stays in place.
     """
     config = DEFAULT_CONFIG.copy()
 
@@ -117,18 +246,46 @@ def load_config() -> Dict:
                     used_path = path
                     break
                 else:
+                    if strict:
+                        raise ValueError(f"Config file at {path} is not a JSON object")
                     print(f"Config file at {path} is not a JSON object, ignoring.")
-            except Exception as e:
+            except (OSError, ValueError) as e:
+                if strict:
+                    raise ValueError(f"Failed to read config file at {path}: {e}")
                 print(f"Failed to read config file at {path}: {e}. Ignoring and trying next.")
 
-    if used_path:
-        print(f"Loaded configuration from: {used_path}")
-    else:
-        print("No config.json found, using built-in defaults.")
+    errors = config_type_errors(config)
+    if errors and strict:
+        raise ValueError("; ".join(errors))
+    for error in errors:
+        key = error.split(" ", 1)[0]
+        print(f"Invalid config value: {error}. Using default {json.dumps(DEFAULT_CONFIG[key])}.")
+        config[key] = DEFAULT_CONFIG[key]
+
+    if not strict:
+        if used_path:
+            print(f"Loaded configuration from: {used_path}")
+        else:
+            print("No config.json found, using built-in defaults.")
 
     return config
 
 
+def config_file_signature() -> tuple:
+    """
+    (path, mtime, size) of each config location; changes when a file is edited,
+    created or removed.
+    """
+    signature = []
+    for path in (CONFIG_PATH_PRIMARY, CONFIG_PATH_FALLBACK):
+        try:
+            st = os.stat(path)
+            signature.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
 BASE_CONFIG = load_config()
 
 # ----------------------------------------------------------------------
@@ -141,10 +298,284 @@ NO_SPEECH_FILTER = 8
 MIN_TEXT_FILTER = 16
 
 
+# ----------------------------------------------------------------------
+# Stage timing hooks (benchmark harness, metrics)
+# ----------------------------------------------------------------------
+PIPELINE_STAGES = ("upload", "decode", "vad", "inference", "captions", "serialize")
+
+# Callables (stage, seconds), invoked on the thread that ran the stage.
+# Nothing is timed while the list is empty.
+stage_observers: List = []
+
+
+@contextmanager
+def timed_stage(stage: str):
+    if not stage_observers:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        for observer in stage_observers:
+            observer(stage, elapsed)
+
+
+# ----------------------------------------------------------------------
+# Metrics (Prometheus text format on /metrics)
+# ----------------------------------------------------------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RTF_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+METRIC_INFO = {
+    "aics_requests_total": ("counter", "HTTP requests by endpoint, model and status code"),
+    "aics_request_seconds": ("histogram", "HTTP request latency by endpoint"),
+    "aics_stage_seconds": ("histogram", "Pipeline stage time (upload, decode, vad, inference, captions, serialize)"),
+    "aics_model_wait_seconds": ("histogram", "Time spent waiting for a free model replica"),
+    "aics_real_time_factor": ("histogram", "Inference seconds per second of audio"),
+    "aics_audio_seconds_total": ("counter", "Seconds of audio transcribed"),
+    "aics_audio_bytes_total": ("counter", "Bytes of uploaded audio received"),
+    "aics_decode_fallback_needed_total": ("counter", "Decodes that failed Whisper's compression / logprob checks"),
+    "aics_decode_fallbacks_total": ("counter", "Temperature-fallback re-decodes"),
+    "aics_decode_budget_exhausted_total": ("counter", "Fallbacks stopped by max_fallbacks or the deadline"),
+    "aics_active_streams": ("gauge", "Caption states held in stream_states"),
+    "aics_ingest_sessions": ("gauge", "Open /stream ingest sessions"),
+    "aics_model_resident_bytes": ("gauge", "Memory held by loaded model replicas"),
+    "aics_model_replicas_busy": ("gauge", "Replicas currently checked out"),
+    "aics_model_pool_budget_bytes": ("gauge", "Model pool budget (0 = unlimited)"),
+    "aics_result_cache_hits_total": ("counter", "Whisper result cache hits"),
+    "aics_result_cache_misses_total": ("counter", "Whisper result cache misses"),
+    "aics_job_queue_depth": ("gauge", "Async jobs waiting to run"),
+    "aics_pipeline_queue_depth": ("gauge", "/transcribe chunks waiting for a pipeline stage slot"),
+    "aics_log_dropped_total": ("counter", "Log records dropped because the log queue was full"),
+}
+
+
+class _MetricsShard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self) -> None:
+        self.counters: Dict[tuple, float] = {}
+        # key -> [per-bucket counts (last slot = +Inf), sum, buckets]
+        self.histograms: Dict[tuple, list] = {}
+
+
+class Metrics:
+    """
+    Counters + histograms with one shard per thread: a thread only ever writes its
+    own dicts, so the hot path takes no lock. /metrics sums all shards when scraped;
+    shards of finished threads are folded into a retired shard at that point.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._shards: List[tuple] = []    # (thread, shard)
+        self._retired = _MetricsShard()
+        self._lock = threading.Lock()
+
+    def _shard(self) -> _MetricsShard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _MetricsShard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+        return shard
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1.0) -> None:
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+        histograms = self._shard().histograms
+        key = (name, labels)
+        entry = histograms.get(key)
+        if entry is None:
+            entry = histograms[key] = [[0] * (len(buckets) + 1), 0.0, buckets]
+        entry[0][bisect.bisect_left(buckets, value)] += 1
+        entry[1] += value
+
+    @staticmethod
+    def _merge(into: _MetricsShard, shard: _MetricsShard) -> None:
+        # list(...) snapshots under the GIL while the owning thread keeps writing
+        for key, value in list(shard.counters.items()):
+            into.counters[key] = into.counters.get(key, 0.0) + value
+        for key, (counts, total, buckets) in list(shard.histograms.items()):
+            entry = into.histograms.get(key)
+            if entry is None:
+                entry = into.histograms[key] = [[0] * len(counts), 0.0, buckets]
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+
+    def snapshot(self) -> _MetricsShard:
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = alive
+            merged = _MetricsShard()
+            self._merge(merged, self._retired)
+            for _, shard in alive:
+                self._merge(merged, shard)
+        return merged
+
+    def render(self, gauges: List[tuple]) -> str:
+        """
+        Prometheus text exposition (format 0.0.4). `gauges` are (name, labels, value)
+        samples computed at scrape time.
+        """
+        snap = self.snapshot()
+        samples: Dict[str, List[str]] = {}
+
+        for (name, labels), value in sorted(snap.counters.items()):
+            samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name, labels, value in sorted(gauges):
+            samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (counts, total, buckets) in sorted(snap.histograms.items()):
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+        out: List[str] = []
+        for name in sorted(samples):
+            metric_type, help_text = METRIC_INFO.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {metric_type}")
+            out.extend(samples[name])
+        return "\n".join(out) + "\n"
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = (
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+metrics = Metrics()
+stage_observers.append(
+    lambda stage, seconds: metrics.observe("aics_stage_seconds", seconds, (("stage", stage),))
+)
+
+
+# ----------------------------------------------------------------------
+# Logging: JSON lines, bounded queue → background writer (stdout + rotating file)
+# ----------------------------------------------------------------------
+LOG_DIR = programdata_path("logs")
+LOG_FILE = os.path.join(LOG_DIR, "aics.log")
+
+
+class JsonLineFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, time, level, msg, plus any `extra={"fields": {...}}`.
+    Runs on the writer thread, never on the request thread.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "time": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "msg": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without ever blocking the caller:
+    when the bounded queue is full the record is dropped and counted.
+    Formatting is deferred to the writer (only %-args are merged here).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("aics_log_dropped_total")
+
+
+def setup_logging(config: Dict):
+    """
+    Console + size-rotated file handlers behind a QueueListener thread.
+    Inference worker processes log to their console only, so a single process
+    owns (and rotates) the log file. Returns (logger, listener).
+    """
+    log = logging.getLogger("aics")
+    log.setLevel(getattr(logging, str(config["log_level"]).upper(), logging.INFO))
+    log.propagate = False
+
+    formatter = JsonLineFormatter()
+    handlers: List[logging.Handler] = []
+    if config["log_console"]:
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(formatter)
+        handlers.append(console)
+
+    if multiprocessing.parent_process() is None:
+        log_file = config["log_file"] or LOG_FILE
+        try:
+            os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=int(config["log_max_bytes"]),
+                backupCount=int(config["log_backup_count"]),
+                encoding="utf-8",
+                delay=True
+            )
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        except OSError as e:
+            print(f"Logging: cannot open {log_file}: {e}. Console only.")
+
+    log_queue: "queue.Queue" = queue.Queue(maxsize=max(int(config["log_queue_size"]), 1))
+    log.addHandler(NonBlockingQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # flush what is queued on shutdown
+    return log, listener
+
+
+logger, log_listener = setup_logging(BASE_CONFIG)
+
+
 # ----------------------------------------------------------------------
 # Caption state per stream
 # ----------------------------------------------------------------------
 class StreamCaptionState:
+    __slots__ = (
+        "last_line", "last_lines", "is_first_caption", "prev_chunk_ended_with_silence", "last_update",
+        "language", "language_votes", "language_locked_at", "language_low_chunks"
+    )
+
     def __init__(self) -> None:
         # For backward compatibility, keep last_line,
         # but we now support N-line scrolling using last_lines.
@@ -154,340 +585,3019 @@ class StreamCaptionState:
         self.prev_chunk_ended_with_silence: bool = False
         self.last_update: float = time.time()   # timestamp for auto-expiry
 
+        # Language lock (see locked_language): candidate, agreeing detections, lock time (0 = unlocked)
+        self.language: Optional[str] = None
+        self.language_votes: int = 0
+        self.language_locked_at: float = 0.0
+        self.language_low_chunks: int = 0
+
+
+STREAM_TTL_SECONDS = 300   # Auto-delete after 5 minutes inactivity
+STREAM_STATE_STRIPES = 32
+
+
+class _StreamStripe:
+    __slots__ = ("lock", "states", "dirty")
+
+    def __init__(self) -> None:
+        # Reentrant: a caller holding lock_for() still goes through the store's methods
+        self.lock = threading.RLock()
+        # Least recently touched first: expiry and eviction only ever look at the head
+        self.states: "OrderedDict[str, StreamCaptionState]" = OrderedDict()
+        # stream_ids changed (or reset) since the last snapshot flush
+        self.dirty: set = set()
+
+
+def _state_record(stream_id: str, state: Optional[StreamCaptionState]) -> Dict:
+    if state is None:
+        return {"id": stream_id, "del": 1}
+    return {
+        "id": stream_id,
+        "t": state.last_update,
+        "l": list(state.last_lines),
+        "ll": state.last_line,
+        "f": state.is_first_caption,
+        "s": state.prev_chunk_ended_with_silence,
+        "g": state.language,
+        "gv": state.language_votes,
+        "gt": state.language_locked_at
+    }
+
+
+def _state_from_record(record: Dict) -> StreamCaptionState:
+    """
+    Inverse of _state_record. Raises ValueError / KeyError / TypeError on a
+    damaged record.
+    """
+    state = StreamCaptionState()
+    state.last_update = float(record["t"])
+    state.last_lines = [str(line) for line in record.get("l", [])]
+    state.last_line = str(record.get("ll", ""))
+    state.is_first_caption = bool(record.get("f", True))
+    state.prev_chunk_ended_with_silence = bool(record.get("s", False))
+    state.language = record.get("g")
+    state.language_votes = int(record.get("gv", 0))
+    state.language_locked_at = float(record.get("gt", 0.0))
+    return state
+
+
+class StreamStateStore:
+    """
+    Caption state per stream_id, split over lock stripes by hash(stream_id) so
+    streams on different stripes never contend. Each stripe is an LRU-ordered
+    OrderedDict: touch = move_to_end, expiry = pop from the head while the head
+    is older than the TTL, eviction above the cap = pop the head. All amortized O(1)
+    per touch; nothing scans or sorts the whole set. Every removal (reset, expiry,
+    eviction) is marked dirty, so the journal records a delete for it.
+    The cap is global: a new stream is admitted while fewer than `max_streams` are
+    held, otherwise the least recently used stream of its own stripe makes room,
+    so hash skew between stripes never lowers the number held. A new stream landing
+    on an empty stripe at the cap is still admitted (at most one extra per stripe).
+    Code that reads and then updates a stream's state holds lock_for(stream_id)
+    for the whole update, including its mark_dirty.
+    """
+
+    def __init__(self, ttl_seconds: float, max_streams: int, stripes: int = STREAM_STATE_STRIPES) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_streams = max(int(max_streams), 1)
+        self._stripes = [_StreamStripe() for _ in range(max(int(stripes), 1))]
+
+    def _stripe(self, stream_id: str) -> _StreamStripe:
+        return self._stripes[hash(stream_id) % len(self._stripes)]
+
+    def lock_for(self, stream_id: str) -> "threading.RLock":
+        """
+        The (reentrant) lock of the stripe holding `stream_id`.
+        """
+        return self._stripe(stream_id).lock
+
+    def _expire_head(self, stripe: _StreamStripe, now: float) -> int:
+        removed = 0
+        states = stripe.states
+        while states:
+            state = next(iter(states.values()))
+            if now - state.last_update <= self.ttl_seconds:
+                break
+            stream_id, _ = states.popitem(last=False)
+            stripe.dirty.add(stream_id)  # journals a delete record
+            removed += 1
+        return removed
+
+    def get_or_create(self, stream_id: str) -> StreamCaptionState:
+        """
+        Returns the stream's state (created if missing) and marks it most recently used.
+        """
+        stripe = self._stripe(stream_id)
+        now = time.time()
+        with stripe.lock:
+            state = stripe.states.get(stream_id)
+            if state is None:
+                self._expire_head(stripe, now)
+                self._make_room(stripe)
+                state = stripe.states[stream_id] = StreamCaptionState()
+            else:
+                stripe.states.move_to_end(stream_id)
+            state.last_update = now
+            return state
+
+    def _make_room(self, stripe: _StreamStripe) -> None:
+        # Caller holds stripe.lock. len(self) reads other stripes unlocked: an estimate
+        # under concurrent inserts, never off by more than the inserts in flight.
+        while stripe.states and len(self) >= self.max_streams:
+            stream_id, _ = stripe.states.popitem(last=False)
+            stripe.dirty.add(stream_id)  # journals a delete record
+
+    def get(self, stream_id: str) -> Optional[StreamCaptionState]:
+        stripe = self._stripe(stream_id)
+        with stripe.lock:
+            return stripe.states.get(stream_id)
+
+    def pop(self, stream_id: str, *default):
+        stripe = self._stripe(stream_id)
+        with stripe.lock:
+            if stream_id in stripe.states:
+                stripe.dirty.add(stream_id)  # journal the reset, or a restart would bring it back
+            return stripe.states.pop(stream_id, *default)
+
+    def mark_dirty(self, stream_id: str) -> None:
+        """
+        Queues the stream for the next snapshot flush; called once its update is complete.
+        """
+        stripe = self._stripe(stream_id)
+        with stripe.lock:
+            stripe.dirty.add(stream_id)
+
+    def drain_dirty(self) -> List[Dict]:
+        """
+        Journal records for every stream marked since the last call (a delete record
+        for streams no longer held), clearing the marks.
+        """
+        records: List[Dict] = []
+        for stripe in self._stripes:
+            with stripe.lock:
+                if not stripe.dirty:
+                    continue
+                dirty, stripe.dirty = stripe.dirty, set()
+                records.extend(_state_record(sid, stripe.states.get(sid)) for sid in dirty)
+        return records
+
+    def restore(self, stream_id: str, state: StreamCaptionState) -> None:
+        """
+        Inserts a restored state as most recently used, keeping its last_update.
+        """
+        stripe = self._stripe(stream_id)
+        with stripe.lock:
+            if stream_id not in stripe.states:
+                self._make_room(stripe)
+            stripe.states[stream_id] = state
+            stripe.states.move_to_end(stream_id)
+
+    def expire(self, now: float) -> int:
+        """
+        Drops streams idle for longer than the TTL; touches only expired entries
+        (plus one live head per stripe).
+        """
+        removed = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                removed += self._expire_head(stripe, now)
+        return removed
+
+    def items(self) -> List[tuple]:
+        """
+        Snapshot of (stream_id, state), least recently used first within each stripe.
+        """
+        snapshot: List[tuple] = []
+        for stripe in self._stripes:
+            with stripe.lock:
+                snapshot.extend(stripe.states.items())
+        return snapshot
+
+    def __len__(self) -> int:
+        return sum(len(stripe.states) for stripe in self._stripes)
+
+
+stream_states = StreamStateStore(STREAM_TTL_SECONDS, BASE_CONFIG["max_streams"])
+
+
+# ----------------------------------------------------------------------
+# Per-stream language lock: skip Whisper's language detection once a stream is known
+# ----------------------------------------------------------------------
+LANGUAGE_UNLOCK_LOW_CHUNKS = 2  # consecutive low-confidence chunks that drop a lock
+
+
+def locked_language(stream_id: Optional[str], parameters: Dict) -> Optional[str]:
+    """
+    Language to pass to Whisper for this stream's next chunk, or None to let
+    Whisper detect it (not locked yet, lock past language_lock_seconds, lock off,
+    or an English-only model, which never detects).
+    """
+    if not parameters["language_lock"] or not stream_id or parameters["model"].endswith(".en"):
+        return None
+    with stream_states.lock_for(stream_id):
+        state = stream_states.get(stream_id)
+        if state is None or not state.language_locked_at:
+            return None
+        if time.time() - state.language_locked_at > parameters["language_lock_seconds"]:
+            # Re-detect; a single agreeing chunk locks it again
+            state.language_locked_at = 0.0
+            state.language_votes = max(int(parameters["language_lock_chunks"]) - 1, 0)
+            stream_states.mark_dirty(stream_id)  # or a restart would restore the expired lock
+            return None
+        return state.language
+
+
+def update_stream_language(stream_id: Optional[str], parameters: Dict, result: Dict, forced: Optional[str]) -> Dict:
+    """
+    Feeds one chunk's result into the stream's language lock and returns the
+    antix language fields. Chunks without segments don't count. While unlocked,
+    `language_lock_chunks` consecutive confident detections of the same language
+    lock it; while locked, LANGUAGE_UNLOCK_LOW_CHUNKS consecutive chunks with a
+    mean avg_logprob below `language_min_logprob` unlock it.
+    """
+    language = forced or result.get("language")
+    if not parameters["language_lock"] or not stream_id:
+        return {"language": language, "language_locked": False}
+
+    segments = result.get("segments") or []
+    if segments:
+        mean_logprob = sum(float(seg.get("avg_logprob", 0.0)) for seg in segments) / len(segments)
+        confident = mean_logprob >= parameters["language_min_logprob"]
+        with stream_states.lock_for(stream_id):
+            state = stream_states.get_or_create(stream_id)
+            if forced is not None:
+                state.language_low_chunks = 0 if confident else state.language_low_chunks + 1
+                if state.language_low_chunks >= LANGUAGE_UNLOCK_LOW_CHUNKS:
+                    state.language_locked_at = 0.0
+                    state.language_votes = 0
+                    state.language_low_chunks = 0
+            elif confident and language:
+                if language == state.language:
+                    state.language_votes += 1
+                else:
+                    state.language = language
+                    state.language_votes = 1
+                if state.language_votes >= int(parameters["language_lock_chunks"]):
+                    state.language_locked_at = time.time()
+                    state.language_low_chunks = 0
+            stream_states.mark_dirty(stream_id)
+
+    return {"language": language, "language_locked": forced is not None}
+
 
-stream_states: Dict[str, StreamCaptionState] = {}
-stream_states_lock = threading.Lock()
+# ----------------------------------------------------------------------
+# Stream state snapshots: caption continuity across restarts
+# ----------------------------------------------------------------------
+STREAM_STATE_SNAPSHOT_PATH = programdata_path("stream_states.jsonl")
+
+
+class StreamStateJournal:
+    """
+    Append-only JSON-lines journal of StreamStateStore. Every flush appends one
+    record per stream changed since the previous flush (last record per stream_id
+    wins on restore). The file is only rewritten when compacted: after a restore
+    and when it grows past `max_bytes`.
+    """
+
+    def __init__(self, path: str, store: StreamStateStore, max_bytes: int) -> None:
+        self.path = path
+        self.store = store
+        self.max_bytes = max(int(max_bytes), 0)
+        self._lock = threading.Lock()
+
+    def restore(self, now: Optional[float] = None) -> int:
+        """
+        Loads the journal into the store, skipping streams past the TTL and any
+        record that doesn't parse (a torn last line from a crash, a damaged line),
+        then compacts. Returns the number of streams restored.
+        """
+        now = time.time() if now is None else now
+        latest: Dict[str, Optional[StreamCaptionState]] = {}
+        try:
+            with open(self.path, "rb") as f:
+                for line_no, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                        latest[str(record["id"])] = None if record.get("del") else _state_from_record(record)
+                    except (ValueError, KeyError, TypeError, AttributeError, OverflowError) as e:
+                        logger.warning(
+                            "stream state record skipped",
+                            extra={"fields": {"path": self.path, "line": line_no, "error": repr(e)}}
+                        )
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("stream state restore failed", extra={"fields": {"path": self.path, "error": str(e)}})
+            return 0
+
+        live = [
+            (sid, state) for sid, state in latest.items()
+            if state is not None and now - state.last_update <= self.store.ttl_seconds
+        ]
+        live.sort(key=lambda item: item[1].last_update)  # oldest first, so the cap keeps the newest
+        for sid, state in live:
+            self.store.restore(sid, state)
+
+        self.compact()
+        return len(live)
+
+    def flush(self) -> int:
+        """
+        Appends records for the streams changed since the last flush.
+        """
+        with self._lock:
+            records = self.store.drain_dirty()
+            if not records:
+                return 0
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "ab") as f:
+                    f.write(b"".join(json_bytes(r) + b"\n" for r in records))
+                    size = f.tell()
+            except OSError as e:
+                logger.warning("stream state snapshot failed", extra={"fields": {"path": self.path, "error": str(e)}})
+                return 0
+        if self.max_bytes and size > self.max_bytes:
+            self.compact()
+        return len(records)
+
+    def compact(self) -> None:
+        """
+        Rewrites the journal as one record per live stream.
+        """
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    for sid, state in self.store.items():
+                        f.write(json_bytes(_state_record(sid, state)) + b"\n")
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning("stream state compaction failed", extra={"fields": {"path": self.path, "error": str(e)}})
+
+    def run(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+    def start(self, interval: float) -> None:
+        threading.Thread(target=self.run, args=(interval,), daemon=True).start()
+        atexit.register(self.flush)
+
+
+stream_state_journal = StreamStateJournal(
+    STREAM_STATE_SNAPSHOT_PATH,
+    stream_states,
+    BASE_CONFIG["stream_state_journal_max_bytes"]
+)
 
 
 # ----------------------------------------------------------------------
 # Helpers for text splitting and audio duration
 # ----------------------------------------------------------------------
+def _wrap_lines(words: List[str], max_chars: int):
+    """
+    Caption layout core: yields (line, char_count) for `words` wrapped at max_chars,
+    char_count excluding spaces. A single pass over the words tracks each line as an
+    offset range into one space-joined string, so every line is a single slice.
+    A word longer than max_chars gets a line of its own.
+    """
+    joined = " ".join(words)
+    line_start = 0      # offset of the current line in `joined`
+    line_len = 0        # length of the current line (with spaces)
+    line_chars = 0      # length of the current line (without spaces)
+    pos = 0             # offset of the current word in `joined`
+
+    for word in words:
+        n = len(word)
+        if line_len and line_len + 1 + n > max_chars:
+            yield joined[line_start:line_start + line_len], line_chars
+            line_start = pos
+            line_len = n
+            line_chars = n
+        elif line_len:
+            line_len += 1 + n
+            line_chars += n
+        else:
+            line_len = n
+            line_chars = n
+        pos += n + 1
+
+    if line_len:
+        yield joined[line_start:line_start + line_len], line_chars
+
+
 def split_text_to_lines(text: str, max_chars: int = 32) -> List[str]:
     """
     Splits the input text into lines, breaking at the last space before max_chars.
     This returns individual lines (no '\\n' inside each line).
     """
-    words = text.strip().split()
-    lines: List[str] = []
-    current_line = ""
+    return [line for line, _ in _wrap_lines(text.split(), max_chars)]
 
-    for word in words:
-        limit = max_chars
-        additional_len = len(word) + (1 if current_line else 0)
-        if len(current_line) + additional_len <= limit:
-            current_line += (" " if current_line else "") + word
-        else:
-            if current_line:
-                lines.append(current_line)
-            current_line = word
 
-    if current_line:
-        lines.append(current_line)
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE  # 16 kHz, what both Whisper and webrtcvad expect
+
+
+def decode_audio(audio_path: str) -> np.ndarray:
+    """
+    Decodes the uploaded file ONCE into a 16 kHz mono float32 buffer.
+    The same buffer is shared by VAD, Whisper and the duration calculation,
+    so a request only pays for a single ffmpeg process.
+    """
+    try:
+        return whisper.load_audio(audio_path, sr=SAMPLE_RATE)
+    except FileNotFoundError as e:
+        raise RuntimeError("Failed to load audio: ffmpeg not found") from e
+
 
-    return lines
+RAW_PCM_EXTENSIONS = (".pcm", ".raw")
+RAW_PCM_MIMETYPES = ("audio/l16",)  # never octet-stream: that's what most clients send for MP3/OGG too
 
 
-def get_audio_duration_seconds(audio_path: str) -> float:
+def _pcm16_to_float(raw: bytes, channels: int = 1) -> np.ndarray:
     """
-    Returns audio duration in seconds using pydub.
+    Converts interleaved little-endian 16-bit PCM to a mono float32 [-1, 1] buffer.
     """
-    audio = AudioSegment.from_file(audio_path)
-    return len(audio) / 1000.0
+    samples = np.frombuffer(raw, dtype="<i2")
+    if channels > 1:
+        samples = samples[: len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples.astype(np.float32) / 32768.0
 
 
-def get_model(model_name: str):
-    if model_name not in model_cache:
-        model_cache[model_name] = whisper.load_model(model_name, device=device)
-    return model_cache[model_name]
+def _decode_wav_bytes(data: bytes):
+    """
+    Parses a 16-bit PCM WAV body directly.
+    Returns None when the WAV needs resampling or is not 16-bit PCM,
+    so the caller can hand it to ffmpeg instead.
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wf:
+            if wf.getsampwidth() != 2 or wf.getframerate() != SAMPLE_RATE:
+                return None
+            channels = wf.getnchannels()
+            raw = wf.readframes(wf.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    return _pcm16_to_float(raw, channels)
 
 
-def is_voice_present(
-    audio_path: str,
-    aggressiveness: int = 2,
-    voice_ratio_threshold: float = 0.1,
-    frame_duration: int = 30
-) -> bool:
+def _decode_with_ffmpeg_pipe(data: bytes) -> np.ndarray:
     """
-    Simple VAD-based check:
-    - Converts to 16k mono
-    - Splits into frames
-    - Checks ratio of voiced frames
+    Same conversion as whisper.load_audio, but the compressed body is piped to a
+    single ffmpeg process over stdin/stdout instead of being read from disk.
     """
-    audio = AudioSegment.from_file(audio_path).set_frame_rate(16000).set_channels(1).set_sample_width(2)
-    raw_audio = audio.raw_data
-    vad = webrtcvad.Vad(int(aggressiveness))
-    frame_size = int(16000 * frame_duration / 1000) * 2
-    frames = [raw_audio[i:i + frame_size] for i in range(0, len(raw_audio), frame_size)]
-    if not frames:
-        return False
-
-    num_voiced = sum(
-        1 for frame in frames
-        if len(frame) == frame_size and vad.is_speech(frame, 16000)
-    )
-    voice_ratio = num_voiced / len(frames)
-    return voice_ratio > voice_ratio_threshold
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE),
+        "pipe:1"
+    ]
+    try:
+        out = subprocess.run(cmd, input=data, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to load audio: {e.stderr.decode(errors='ignore')}") from e
+    except FileNotFoundError as e:
+        raise RuntimeError("Failed to load audio: ffmpeg not found") from e
+    return _pcm16_to_float(out)
 
 
-def parse_bool(value: str, param_name: str) -> bool:
+def decode_audio_bytes(data: bytes, filename: str = "", mimetype: str = "") -> np.ndarray:
     """
-    Strict boolean parser for 'true' / 'false'.
-    Raises ValueError for anything else.
+    In-memory variant of decode_audio:
+      - raw PCM (.pcm/.raw or audio/L16) → 16 kHz mono s16le, read as-is
+      - 16 kHz 16-bit WAV → parsed straight from the bytes
+      - anything else → one ffmpeg process over stdin/stdout
     """
-    val = value.lower()
-    if val not in ["true", "false"]:
-        raise ValueError(f"Invalid value for {param_name} (must be 'true' or 'false')")
-    return val == "true"
+    name = (filename or "").lower()
+    mime = (mimetype or "").lower().split(";")[0].strip()
+
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        audio = _decode_wav_bytes(data)
+        if audio is not None:
+            return audio
+    elif name.endswith(RAW_PCM_EXTENSIONS) or mime in RAW_PCM_MIMETYPES:
+        return _pcm16_to_float(data[: len(data) - len(data) % 2])
+
+    return _decode_with_ffmpeg_pipe(data)
+
+
+def audio_to_pcm16(audio: np.ndarray) -> bytes:
+    """
+    Converts a float32 [-1, 1] buffer to little-endian 16-bit PCM bytes (webrtcvad input).
+    """
+    return (np.clip(audio, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+def get_audio_duration_seconds(audio: np.ndarray) -> float:
+    """
+    Returns audio duration in seconds from the decoded 16 kHz buffer.
+    """
+    return len(audio) / float(SAMPLE_RATE)
 
 
 # ----------------------------------------------------------------------
-# Core: process segments with scrolling captions + silence + N-line support
+# Model pool: validated names, single-flight loads, LRU under a memory budget
 # ----------------------------------------------------------------------
-def process_segments_with_scrolling_captions(
-    segments: List[Dict],
-    audio_duration: float,
-    parameters: Dict,
-    is_vad_silence: bool,
-    stream_id: str
-) -> None:
+def model_size_bytes(model) -> int:
     """
-    Mutates each segment in `segments` by adding:
-      seg["antix"] = {
-          "filtered": <reason>,
-          "filtered_bin": "0bxxxxx",
-          "wrapped_text": [ { "text": "...", "start": ..., "end": ... }, ... ]
-      }
+    Resident size of a loaded model (parameters + buffers), RAM or VRAM.
+    """
+    total = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
 
-    Implements:
-    - N-line scrolling behaviour (default 2-line: previous line + new line)
-    - Single-line mode (with leading '\\n') after silence / first caption
-    - Silence detection at:
-        * start of chunk
-        * end of chunk
-        * gaps between segments
-    - For VAD-identified silence chunks:
-        * Treat as silence for caption STATE (reset next chunk)
-        * Do NOT delete Whisper text; we still build wrapped_text
-        * Do NOT update .last_lines or .is_first_caption from that chunk
-        * Set VAD_FILTER bit so 9000EX can ignore if desired
+
+def validate_model_name(name: str) -> None:
+    if name not in available_models:
+        raise ValueError(f"Unknown model '{name}' (must be one of {', '.join(available_models)})")
+
+
+class _ModelSlot:
+    """
+    One pool entry: N loaded replicas of the same model plus the free ones.
+    A replica is used by one request (or one batch) at a time.
+    Background work (async jobs) only gets a replica when no live request is
+    waiting and more than `live_reserve` replicas are free. The reserve is capped
+    at replicas - 1, so with one replica live requests rely on jobs checking it
+    back in between shards (jobs always run long-form).
     """
 
-    silence_threshold = float(parameters["silence_threshold"])
-    wrap_length = int(parameters["wrap_length"])
-    enable_filtering = parameters["enable_filtering"]
-    enable_caps = parameters["enable_caps"]
-    max_caption_lines = max(1, int(parameters.get("max_caption_lines", 2)))
+    def __init__(self, replicas: List, live_reserve: int = 0) -> None:
+        self.replicas = replicas
+        self.free: List = list(replicas)
+        self.cond = threading.Condition()
+        self.live_waiting = 0
+        self.live_reserve = min(max(int(live_reserve), 0), len(replicas) - 1)
+        self.bytes = model_size_bytes(replicas[0]) * len(replicas)
+
+    def checkout(self, background: bool = False):
+        with self.cond:
+            if background:
+                while self.live_waiting or len(self.free) <= self.live_reserve:
+                    self.cond.wait()
+            else:
+                self.live_waiting += 1
+                try:
+                    while not self.free:
+                        self.cond.wait()
+                finally:
+                    self.live_waiting -= 1
+            return self.free.pop()
 
-    # Get / create state for this stream
-    with stream_states_lock:
-        state = stream_states.get(stream_id)
-        if state is None:
-            state = StreamCaptionState()
-            stream_states[stream_id] = state
+    def checkin(self, replica) -> None:
+        with self.cond:
+            self.free.append(replica)
+            self.cond.notify_all()
 
-    num_segments = len(segments)
 
-    # Chunk considered "silence for state" if VAD says silence and duration >= threshold.
-    # For such chunks:
-    # - we still compute wrapped_text
-    # - we mark them as filtered (VAD_FILTER) if filtering is enabled
-    # - we DO NOT update state.last_lines / state.is_first_caption
-    # - we DO set state.prev_chunk_ended_with_silence = True
-    chunk_state_silent = is_vad_silence and (audio_duration >= silence_threshold)
+class ModelPool:
+    """
+    Replaces the unbounded model_cache dict and the single global model_lock:
+      - only names from available_models are accepted (ValueError otherwise)
+      - single-flight: concurrent first requests for a name share ONE load
+      - each model gets `replicas` copies; acquire() hands out a free one, so
+        different models (and copies of the same model) decode side by side
+      - least-recently-used models are evicted once the budget is exceeded
+        (the model being returned is never evicted, so one model always fits)
+    """
 
-    # Pure-silence chunk (no segments at all)
-    if num_segments == 0:
-        if audio_duration >= silence_threshold:
-            state.prev_chunk_ended_with_silence = True
-        # Nothing to attach; we return.
-        return
+    def __init__(self, budget_bytes: int, replicas: int = 1, cpu_threads: int = 0, live_reserve: int = 0) -> None:
+        self.budget_bytes = budget_bytes          # 0 = unlimited
+        self.replicas = max(int(replicas), 1)
+        self.live_reserve = live_reserve          # replicas background jobs may never take
+        # CPU-only: split cores across replicas so N decodes run without oversubscription
+        self.cpu_threads = int(cpu_threads) or max(1, (os.cpu_count() or 1) // self.replicas)
+        self._lock = threading.Lock()
+        self._models: "OrderedDict[str, _ModelSlot]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._loading: Dict[str, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name: str):
+        """
+        Returns the first replica of `name`, loading it if needed.
+        Use acquire() for inference; get() is for validation and warm-up.
+        Requests call get() once (ensure_model), so hits are counted here only.
+        """
+        return self._slot(name, count_hit=True).replicas[0]
+
+    def all_replicas(self, name: str) -> List:
+        return list(self._slot(name).replicas)
+
+    @contextmanager
+    def acquire(self, name: str, background: bool = False):
+        """
+        Checks out a free replica of `name` for exclusive use (per-model execution slot).
+        Blocks only while every replica of THIS model is busy; background callers
+        additionally wait behind live requests (see _ModelSlot).
+        """
+        slot = self._slot(name)
+        t0 = time.perf_counter()
+        replica = slot.checkout(background)
+        metrics.observe("aics_model_wait_seconds", time.perf_counter() - t0, (("model", name),))
+        try:
+            if device == "cpu":
+                # Under OpenMP this sets the intra-op thread count for the calling thread,
+                # so each concurrently running replica stays within its core share.
+                torch.set_num_threads(self.cpu_threads)
+            yield replica
+        finally:
+            slot.checkin(replica)
+
+    def _slot(self, name: str, count_hit: bool = False) -> _ModelSlot:
+        validate_model_name(name)
+
+        while True:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    self._last_used[name] = time.time()
+                    if count_hit:
+                        self.hits += 1
+                    return self._models[name]
+
+                event = self._loading.get(name)
+                leader = event is None
+                if leader:
+                    event = threading.Event()
+                    self._loading[name] = event
+                    self.misses += 1
+
+            if not leader:
+                # Someone else is loading it; wait, then re-check (retry if their load failed)
+                event.wait()
+                continue
 
-    # ACTIVE STATE SELECTION LOGIC
-    state.last_update = time.time()  # mark stream as active
+            try:
+                model = whisper.load_model(
+                    available_models[name],
+                    device=device,
+                    download_root=model_cache_dir
+                )
+                replicas = [model] + [copy.deepcopy(model) for _ in range(self.replicas - 1)]
+                slot = _ModelSlot(replicas, self.live_reserve)
+                with self._lock:
+                    self._models[name] = slot
+                    self._last_used[name] = time.time()
+                    self._evict(keep=name)
+                return slot
+            finally:
+                with self._lock:
+                    del self._loading[name]
+                event.set()
+
+    def _evict(self, keep: str) -> None:
+        """
+        Drops least-recently-used models until the pool fits the budget. Caller holds _lock.
+        In-flight requests keep their own reference, so eviction never breaks a decode.
+        """
+        if not self.budget_bytes:
+            return
+        evicted = False
+        for name in list(self._models):
+            if sum(slot.bytes for slot in self._models.values()) <= self.budget_bytes:
+                break
+            if name == keep:
+                continue
+            del self._models[name]
+            self._last_used.pop(name, None)
+            self.evictions += 1
+            evicted = True
+            logger.info("model evicted", extra={"fields": {"model": name, "budget_bytes": self.budget_bytes}})
+        if evicted and device == "cuda":
+            torch.cuda.empty_cache()
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "device": device,
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": sum(slot.bytes for slot in self._models.values()),
+                "replicas_per_model": self.replicas,
+                "cpu_threads_per_replica": self.cpu_threads if device == "cpu" else None,
+                "models": [
+                    {
+                        "name": name,
+                        "bytes": slot.bytes,
+                        "replicas": len(slot.replicas),
+                        "busy": len(slot.replicas) - len(slot.free),
+                        "last_used": self._last_used.get(name)
+                    }
+                    for name, slot in reversed(self._models.items())
+                ],
+                "loading": list(self._loading),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
 
-    if chunk_state_silent:
-        # A full-silence chunk → reset scrolling state
-        active_state = StreamCaptionState()
 
-        # Silence chunk NEVER scrolls previous lines
-        active_state.last_lines = []
-        active_state.last_line = ""
+model_pool = ModelPool(
+    int(float(BASE_CONFIG["model_pool_budget_mb"]) * 1024 * 1024),
+    replicas=BASE_CONFIG["model_replicas"],
+    cpu_threads=BASE_CONFIG["cpu_threads_per_replica"],
+    live_reserve=BASE_CONFIG["job_live_reserve"]
+)
 
-        # Preserve high-level continuity
-        active_state.is_first_caption = state.is_first_caption
-        active_state.prev_chunk_ended_with_silence = True  # IMPORTANT
-    else:
-        # Normal chunk → use the global stream state
-        active_state = state
 
-    # Silence at start / end of (non-silent) chunk using timing
-    leading_silence = False
-    trailing_silence = False
+def get_model(model_name: str):
+    return model_pool.get(model_name)
 
-    if not chunk_state_silent:
-        if num_segments > 0:
-            first_seg_start = float(segments[0].get("start", 0.0))
-            if first_seg_start >= silence_threshold:
-                leading_silence = True
 
-            last_seg_end = float(segments[-1].get("end", 0.0))
-            end_silence = audio_duration - last_seg_end
-            if end_silence >= silence_threshold:
-                trailing_silence = True
-        else:
-            if audio_duration >= silence_threshold:
-                trailing_silence = True
+def ensure_model(model_name: str) -> None:
+    """
+    Validates the name and makes sure the model is loaded wherever inference runs:
+    in worker mode the workers load on demand, so the front end only validates.
+    """
+    if inference_workers is not None:
+        validate_model_name(model_name)
     else:
-        # For VAD-silence chunks, we treat as trailing silence for the next chunk.
-        trailing_silence = audio_duration >= silence_threshold
+        get_model(model_name)
 
-    # Single-line condition for the first segment in this chunk:
-    # - first caption for this stream
-    # - OR previous chunk ended with silence
-    # - OR leading silence at start of this chunk
-    next_segment_force_single_line = (
+
+# ----------------------------------------------------------------------
+# VAD engines: webrtcvad (reference) + vectorized NumPy energy/spectral
+# ----------------------------------------------------------------------
+VAD_ENGINES = ("webrtc", "energy")
+
+# energy engine tuning per aggressiveness (0..3, same scale as webrtcvad):
+# dB above the estimated noise floor, and max spectral flatness for speech
+ENERGY_VAD_MARGIN_DB = (6.0, 9.0, 12.0, 15.0)
+ENERGY_VAD_MAX_FLATNESS = (0.6, 0.5, 0.4, 0.3)
+ENERGY_VAD_FLOOR_DBFS = -50.0
+
+
+class VadResult:
+    """
+    Per-frame VAD output for one chunk.
+    `voiced` holds one flag per FULL frame; `num_frames` also counts a trailing
+    partial frame (never voiced), matching the original ratio calculation.
+    """
+
+    def __init__(self, voiced: np.ndarray, num_frames: int, frame_duration: float) -> None:
+        self.voiced = voiced
+        self.num_frames = num_frames
+        self.frame_duration = frame_duration  # seconds
+
+    def voice_ratio(self) -> float:
+        if self.num_frames == 0:
+            return 0.0
+        return int(np.count_nonzero(self.voiced)) / self.num_frames
+
+    def speech_regions(self) -> List[tuple]:
+        """
+        Contiguous voiced runs as (start_sec, end_sec) tuples.
+        """
+        edges = np.diff(np.concatenate(([0], self.voiced.view(np.int8), [0])))
+        starts = np.round(np.flatnonzero(edges == 1) * self.frame_duration, 3)
+        ends = np.round(np.flatnonzero(edges == -1) * self.frame_duration, 3)
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    def segment_voice_ratios(self, segments: List[Dict]) -> np.ndarray:
+        """
+        Voiced-frame ratio inside each segment's [start, end), computed for all
+        segments at once from a prefix sum over the voiced timeline.
+        """
+        n = len(segments)
+        starts = np.fromiter((float(seg.get("start", 0.0)) for seg in segments), dtype=np.float64, count=n)
+        ends = np.fromiter((float(seg.get("end", 0.0)) for seg in segments), dtype=np.float64, count=n)
+
+        total = len(self.voiced)
+        prefix = np.concatenate(([0], np.cumsum(self.voiced, dtype=np.int64)))
+        first = np.clip(np.floor(starts / self.frame_duration).astype(np.int64), 0, total)
+        last = np.clip(np.ceil(ends / self.frame_duration).astype(np.int64), 0, total)
+        span = last - first
+        return np.where(span > 0, (prefix[last] - prefix[first]) / np.maximum(span, 1), 0.0)
+
+
+def _frame_view(audio: np.ndarray, frame_len: int) -> np.ndarray:
+    """
+    (n_frames, frame_len) view over the buffer — no per-frame slices or copies.
+    """
+    n_full = len(audio) // frame_len
+    return np.lib.stride_tricks.as_strided(
+        audio,
+        shape=(n_full, frame_len),
+        strides=(audio.strides[0] * frame_len, audio.strides[0]),
+        writeable=False
+    )
+
+
+def _webrtc_vad(audio: np.ndarray, aggressiveness: int, frame_len: int) -> np.ndarray:
+    vad = webrtcvad.Vad(int(aggressiveness))
+    pcm = memoryview(audio_to_pcm16(audio))
+    frame_bytes = frame_len * 2
+    n_full = len(pcm) // frame_bytes
+    return np.fromiter(
+        (vad.is_speech(pcm[i * frame_bytes:(i + 1) * frame_bytes], SAMPLE_RATE) for i in range(n_full)),
+        dtype=bool,
+        count=n_full
+    )
+
+
+def _energy_vad(audio: np.ndarray, aggressiveness: int, frame_len: int) -> np.ndarray:
+    """
+    Vectorized VAD over all frames at once:
+      - frame log-energy (dBFS) against an adaptive noise floor (10th percentile)
+      - spectral flatness (noise is flat, voiced speech is peaky)
+    """
+    frames = _frame_view(np.ascontiguousarray(audio, dtype=np.float32), frame_len)
+    if len(frames) == 0:
+        return np.zeros(0, dtype=bool)
+
+    level = min(max(int(aggressiveness), 0), 3)
+
+    energy = np.einsum("ij,ij->i", frames, frames) / frame_len
+    energy_db = 10.0 * np.log10(energy + 1e-10)
+    noise_floor = np.percentile(energy_db, 10)
+    loud = energy_db > max(noise_floor + ENERGY_VAD_MARGIN_DB[level], ENERGY_VAD_FLOOR_DBFS)
+
+    power = np.abs(np.fft.rfft(frames * np.hanning(frame_len).astype(np.float32), axis=1)) ** 2 + 1e-12
+    flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+
+    return loud & (flatness < ENERGY_VAD_MAX_FLATNESS[level])
+
+
+def run_vad(
+    audio: np.ndarray,
+    aggressiveness: int = 2,
+    frame_duration: int = 30,
+    engine: str = "webrtc"
+) -> VadResult:
+    """
+    Runs the selected VAD engine over the decoded 16k mono buffer and returns
+    per-frame voiced flags (see VadResult).
+    """
+    frame_len = int(SAMPLE_RATE * frame_duration / 1000)
+    num_frames = -(-len(audio) // frame_len)
+
+    if engine == "energy":
+        voiced = _energy_vad(audio, aggressiveness, frame_len)
+    else:
+        voiced = _webrtc_vad(audio, aggressiveness, frame_len)
+
+    return VadResult(voiced, num_frames, frame_duration / 1000.0)
+
+
+def is_voice_present(
+    audio: np.ndarray,
+    aggressiveness: int = 2,
+    voice_ratio_threshold: float = 0.1,
+    frame_duration: int = 30,
+    engine: str = "webrtc"
+) -> bool:
+    """
+    Simple VAD-based check:
+    - Takes the already decoded 16k mono buffer
+    - Runs the selected engine frame by frame
+    - Checks ratio of voiced frames
+    """
+    return run_vad(audio, aggressiveness, frame_duration, engine).voice_ratio() > voice_ratio_threshold
+
+
+def parse_bool(value: str, param_name: str) -> bool:
+    """
+    Strict boolean parser for 'true' / 'false'.
+    Raises ValueError for anything else.
+    """
+    val = value.lower()
+    if val not in ["true", "false"]:
+        raise ValueError(f"Invalid value for {param_name} (must be 'true' or 'false')")
+    return val == "true"
+
+
+RESPONSE_EXCLUDABLE = ("tokens", "words", "result")
+
+
+def parse_exclude(value: str) -> str:
+    """
+    Normalizes the 'exclude' field list ("tokens,words") and rejects unknown names.
+    """
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    for name in names:
+        if name not in RESPONSE_EXCLUDABLE:
+            raise ValueError(f"Invalid value for exclude (allowed: {', '.join(RESPONSE_EXCLUDABLE)})")
+    return ",".join(names)
+
+
+def apply_request_parameters(parameters: Dict, values) -> None:
+    """
+    Overrides `parameters` in place with any fields present in `values`
+    (request.form for /transcribe, request.args for /stream).
+    Raises ValueError for malformed values.
+    """
+    # --------------------------
+    # MODEL NAME
+    # --------------------------
+    if "model" in values:
+        parameters["model"] = values.get("model", parameters["model"])
+
+    # --------------------------
+    # NUMERIC PARAMETERS
+    # --------------------------
+    if "avg_logprob_threshold" in values:
+        parameters["avg_logprob_threshold"] = float(values["avg_logprob_threshold"])
+
+    if "compression_ratio_threshold" in values:
+        parameters["compression_ratio_threshold"] = float(values["compression_ratio_threshold"])
+
+    if "no_speech_prob_threshold" in values:
+        parameters["no_speech_prob_threshold"] = float(values["no_speech_prob_threshold"])
+
+    if "temperature" in values:
+        parameters["temperature"] = float(values["temperature"])
+
+    if "vad_aggressiveness" in values:
+        parameters["vad_aggressiveness"] = int(values["vad_aggressiveness"])
+
+    if "vad_voice_ratio_threshold" in values:
+        parameters["vad_voice_ratio_threshold"] = float(values["vad_voice_ratio_threshold"])
+
+    if "vad_engine" in values:
+        if values["vad_engine"] not in VAD_ENGINES:
+            raise ValueError(f"Invalid value for vad_engine (must be one of {', '.join(VAD_ENGINES)})")
+        parameters["vad_engine"] = values["vad_engine"]
+
+    if "min_text_length" in values:
+        parameters["min_text_length"] = int(values["min_text_length"])
+
+    if "wrap_length" in values:
+        parameters["wrap_length"] = int(values["wrap_length"])
+
+    if "silence_threshold" in values:
+        parameters["silence_threshold"] = float(values["silence_threshold"])
+
+    if "max_caption_lines" in values:
+        parameters["max_caption_lines"] = int(values["max_caption_lines"])
+
+    if "max_fallbacks" in values:
+        parameters["max_fallbacks"] = int(values["max_fallbacks"])
+        if parameters["max_fallbacks"] < 0:
+            raise ValueError("max_fallbacks must not be negative")
+
+    if "fallback_deadline_ms" in values:
+        parameters["fallback_deadline_ms"] = float(values["fallback_deadline_ms"])
+        if parameters["fallback_deadline_ms"] < 0:
+            raise ValueError("fallback_deadline_ms must not be negative")
+
+    if "shard_max_seconds" in values:
+        parameters["shard_max_seconds"] = float(values["shard_max_seconds"])
+        if parameters["shard_max_seconds"] <= 0:
+            raise ValueError("shard_max_seconds must be positive")
+
+    # --------------------------
+    # BOOLEAN PARAMETERS
+    # --------------------------
+    if "enable_filtering" in values:
+        parameters["enable_filtering"] = parse_bool(values["enable_filtering"], "enable_filtering")
+
+    if "enable_caps" in values:
+        parameters["enable_caps"] = parse_bool(values["enable_caps"], "enable_caps")
+
+    if "enable_vad" in values:
+        parameters["enable_vad"] = parse_bool(values["enable_vad"], "enable_vad")
+
+    if "skip_vad_silence" in values:
+        parameters["skip_vad_silence"] = parse_bool(values["skip_vad_silence"], "skip_vad_silence")
+
+    if "pretty_json" in values:
+        parameters["pretty_json"] = parse_bool(values["pretty_json"], "pretty_json")
+
+    if "stream_response" in values:
+        parameters["stream_response"] = parse_bool(values["stream_response"], "stream_response")
+
+    if "exclude" in values:
+        parameters["exclude"] = parse_exclude(values["exclude"])
+
+    if "long_form" in values:
+        parameters["long_form"] = parse_bool(values["long_form"], "long_form")
+
+    if "language_lock" in values:
+        parameters["language_lock"] = parse_bool(values["language_lock"], "language_lock")
+
+
+# ----------------------------------------------------------------------
+# Per-stream profiles + config hot reload
+# ----------------------------------------------------------------------
+# Fields apply_request_parameters understands; the only keys a profile may set
+PROFILE_KEYS = (
+    "model", "avg_logprob_threshold", "compression_ratio_threshold", "no_speech_prob_threshold",
+    "temperature", "vad_aggressiveness", "vad_voice_ratio_threshold", "vad_engine",
+    "min_text_length", "wrap_length", "silence_threshold", "max_caption_lines", "shard_max_seconds",
+    "max_fallbacks", "fallback_deadline_ms",
+    "enable_filtering", "enable_caps", "enable_vad", "skip_vad_silence", "pretty_json",
+    "long_form", "stream_response", "exclude", "language_lock"
+)
+
+
+def _as_form_values(values: Dict) -> Dict[str, str]:
+    return {
+        key: ("true" if value else "false") if isinstance(value, bool) else str(value)
+        for key, value in values.items()
+    }
+
+
+def compile_profiles(config: Dict) -> Dict[str, Dict]:
+    """
+    Validates `config` the way a request would be validated and pre-merges every
+    profile into a complete parameter dict, so a request using a profile starts
+    from a ready copy instead of parsing a dozen form fields.
+    Raises ValueError naming the offending profile / key.
+    """
+    apply_request_parameters(config.copy(), _as_form_values({key: config[key] for key in PROFILE_KEYS}))
+    validate_model_name(config["model"])
+
+    compiled: Dict[str, Dict] = {}
+    for name, overrides in config["profiles"].items():
+        if not isinstance(overrides, dict):
+            raise ValueError(f"profile '{name}' must be a JSON object")
+        unknown = sorted(set(overrides) - set(PROFILE_KEYS))
+        if unknown:
+            raise ValueError(f"profile '{name}': unsupported keys {', '.join(unknown)}")
+        params = config.copy()
+        try:
+            apply_request_parameters(params, _as_form_values(overrides))
+            validate_model_name(params["model"])
+        except ValueError as e:
+            raise ValueError(f"profile '{name}': {e}")
+        params["profile"] = name
+        compiled[name] = params
+
+    for stream_id, name in config["stream_profiles"].items():
+        if name not in compiled:
+            raise ValueError(f"stream_profiles['{stream_id}'] refers to unknown profile '{name}'")
+    return compiled
+
+
+try:
+    PROFILE_CONFIGS = compile_profiles(BASE_CONFIG)
+except ValueError as e:
+    print(f"Invalid config: {e}. Profiles disabled.")
+    PROFILE_CONFIGS = {}
+
+# (config, compiled profiles) replaced as ONE reference on reload, so a request
+# always sees a matching pair
+active_config = (BASE_CONFIG, PROFILE_CONFIGS)
+
+
+def request_base_parameters(values, stream_id: Optional[str] = None) -> Dict:
+    """
+    Fresh parameter dict for one request: the named 'profile' if sent, else the
+    profile bound to this stream_id, else the base config.
+    Raises ValueError for an unknown profile.
+    """
+    base, profiles = active_config
+    name = values.get("profile") or base["stream_profiles"].get(stream_id or "")
+    if not name:
+        return base.copy()
+    if name not in profiles:
+        raise ValueError(f"Unknown profile '{name}'")
+    return profiles[name].copy()
+
+
+def reload_config() -> Dict:
+    """
+    Re-reads config.json, validates it (types, request rules, profiles) and swaps it
+    in. An invalid file is rejected as a whole; startup-only keys keep their running
+    values. Returns a short report.
+    """
+    global BASE_CONFIG, PROFILE_CONFIGS, active_config
+
+    try:
+        new_config = load_config(strict=True)
+        profiles = compile_profiles(new_config)
+    except ValueError as e:
+        logger.error("config reload rejected", extra={"fields": {"error": str(e)}})
+        return {"reloaded": False, "error": str(e)}
+
+    current = BASE_CONFIG
+    changed = sorted(key for key in DEFAULT_CONFIG if new_config[key] != current[key])
+    restart_required = [key for key in changed if key in STARTUP_ONLY_KEYS]
+    for key in restart_required:
+        new_config[key] = current[key]
+    if restart_required:
+        # Profiles were merged from the file's values; rebuild them on the kept ones
+        profiles = compile_profiles(new_config)
+
+    active_config = (new_config, profiles)
+    BASE_CONFIG, PROFILE_CONFIGS = new_config, profiles
+    logger.setLevel(getattr(logging, str(new_config["log_level"]).upper(), logging.INFO))
+
+    applied = [key for key in changed if key not in STARTUP_ONLY_KEYS]
+    logger.info("config reloaded", extra={"fields": {"applied": applied, "restart_required": restart_required}})
+    return {"reloaded": True, "applied": applied, "restart_required": restart_required}
+
+
+def watch_config(interval: float) -> None:
+    signature = config_file_signature()
+    while True:
+        time.sleep(interval)
+        current = config_file_signature()
+        if current != signature:
+            signature = current
+            reload_config()
+
+
+if BASE_CONFIG["config_reload_seconds"] > 0 and multiprocessing.parent_process() is None:
+    threading.Thread(
+        target=watch_config,
+        args=(float(BASE_CONFIG["config_reload_seconds"]),),
+        daemon=True
+    ).start()
+
+
+# ----------------------------------------------------------------------
+# Core: process segments with scrolling captions + silence + N-line support
+# ----------------------------------------------------------------------
+def process_segments_with_scrolling_captions(
+    segments: List[Dict],
+    audio_duration: float,
+    parameters: Dict,
+    is_vad_silence: bool,
+    stream_id: str,
+    segment_voice_ratios: Optional[np.ndarray] = None
+) -> None:
+    """
+    Mutates each segment in `segments` by adding:
+      seg["antix"] = {
+          "filtered": <reason>,
+          "filtered_bin": "0bxxxxx",
+          "wrapped_text": [ { "text": "...", "start": ..., "end": ... }, ... ]
+          "voice_ratio": <float>   (only when segment_voice_ratios is given)
+      }
+
+    Implements:
+    - N-line scrolling behaviour (default 2-line: previous line + new line)
+    - Single-line mode (with leading '\\n') after silence / first caption
+    - Silence detection at:
+        * start of chunk
+        * end of chunk
+        * gaps between segments
+    - For VAD-identified silence chunks:
+        * Treat as silence for caption STATE (reset next chunk)
+        * Do NOT delete Whisper text; we still build wrapped_text
+        * Do NOT update .last_lines or .is_first_caption from that chunk
+        * Set VAD_FILTER bit so 9000EX can ignore if desired
+    - Per-segment VAD (segment_voice_ratios from VadResult):
+        * Segments at or below vad_voice_ratio_threshold get VAD_FILTER on their own
+        * Silence gaps / leading / trailing silence are measured between VOICED segments
+    """
+    # One stream's caption state is read and rewritten as a whole: hold its stripe lock
+    with stream_states.lock_for(stream_id):
+        _scroll_captions(segments, audio_duration, parameters, is_vad_silence, stream_id, segment_voice_ratios)
+
+
+def _scroll_captions(
+    segments: List[Dict],
+    audio_duration: float,
+    parameters: Dict,
+    is_vad_silence: bool,
+    stream_id: str,
+    segment_voice_ratios: Optional[np.ndarray]
+) -> None:
+    """
+    Body of process_segments_with_scrolling_captions; caller holds lock_for(stream_id).
+    """
+
+    silence_threshold = float(parameters["silence_threshold"])
+    wrap_length = int(parameters["wrap_length"])
+    enable_filtering = parameters["enable_filtering"]
+    enable_caps = parameters["enable_caps"]
+    max_caption_lines = max(1, int(parameters.get("max_caption_lines", 2)))
+
+    # Get / create state for this stream (marks it most recently used)
+    state = stream_states.get_or_create(stream_id)
+
+    num_segments = len(segments)
+
+    # Chunk considered "silence for state" if VAD says silence and duration >= threshold.
+    # For such chunks:
+    # - we still compute wrapped_text
+    # - we mark them as filtered (VAD_FILTER) if filtering is enabled
+    # - we DO NOT update state.last_lines / state.is_first_caption
+    # - we DO set state.prev_chunk_ended_with_silence = True
+    chunk_state_silent = is_vad_silence and (audio_duration >= silence_threshold)
+
+    # Pure-silence chunk (no segments at all)
+    if num_segments == 0:
+        state.last_update = time.time()  # silence still keeps the stream alive
+        if audio_duration >= silence_threshold:
+            state.prev_chunk_ended_with_silence = True
+        if chunk_state_silent:
+            # Same state reset as a VAD-silence chunk that has segments
+            # (this is the path taken when skip_vad_silence skips Whisper)
+            state.last_lines = []
+            state.last_line = ""
+        # Nothing to attach; we return.
+        stream_states.mark_dirty(stream_id)
+        return
+
+    # ACTIVE STATE SELECTION LOGIC
+    state.last_update = time.time()  # mark stream as active
+
+    if chunk_state_silent:
+        # A full-silence chunk → reset scrolling state
+        active_state = StreamCaptionState()
+
+        # Silence chunk NEVER scrolls previous lines
+        active_state.last_lines = []
+        active_state.last_line = ""
+
+        # Preserve high-level continuity
+        active_state.is_first_caption = state.is_first_caption
+        active_state.prev_chunk_ended_with_silence = True  # IMPORTANT
+    else:
+        # Normal chunk → use the global stream state
+        active_state = state
+
+    # Per-segment voiced flags (all True when no frame-level VAD was passed in)
+    if segment_voice_ratios is not None:
+        segment_voiced = (segment_voice_ratios > float(parameters["vad_voice_ratio_threshold"])).tolist()
+    else:
+        segment_voiced = [True] * num_segments
+    voiced_indices = [i for i, v in enumerate(segment_voiced) if v] or list(range(num_segments))
+
+    # Silence at start / end of (non-silent) chunk using timing
+    leading_silence = False
+    trailing_silence = False
+
+    if not chunk_state_silent:
+        if num_segments > 0:
+            first_seg_start = float(segments[voiced_indices[0]].get("start", 0.0))
+            if first_seg_start >= silence_threshold:
+                leading_silence = True
+
+            last_seg_end = float(segments[voiced_indices[-1]].get("end", 0.0))
+            end_silence = audio_duration - last_seg_end
+            if end_silence >= silence_threshold:
+                trailing_silence = True
+        else:
+            if audio_duration >= silence_threshold:
+                trailing_silence = True
+    else:
+        # For VAD-silence chunks, we treat as trailing silence for the next chunk.
+        trailing_silence = audio_duration >= silence_threshold
+
+    # Single-line condition for the first segment in this chunk:
+    # - first caption for this stream
+    # - OR previous chunk ended with silence
+    # - OR leading silence at start of this chunk
+    next_segment_force_single_line = (
         active_state.is_first_caption
         or active_state.prev_chunk_ended_with_silence
         or leading_silence
     )
 
-    prev_seg_end = None
+    # N-line history window: the last max_caption_lines-1 lines, bounded by the deque.
+    # VAD-silence chunks start from an empty window and never write it back.
+    history: "deque[str]" = deque(active_state.last_lines, maxlen=max_caption_lines - 1)
+    history_changed = False
+
+    prev_seg_end = None
+
+    for idx, seg in enumerate(segments):
+        text = seg.get("text", "").strip()
+        seg_start = float(seg.get("start", 0.0))
+        seg_end = float(seg.get("end", 0.0))
+        seg_duration = max(seg_end - seg_start, 0.0)
+
+        # Determine filtering reason
+        reason = 0
+        if enable_filtering:
+            if is_vad_silence or not segment_voiced[idx]:
+                reason |= VAD_FILTER
+            if seg.get("avg_logprob", -1.0) < parameters["avg_logprob_threshold"]:
+                reason |= LOGPROB_FILTER
+            if seg.get("compression_ratio", 2.4) > parameters["compression_ratio_threshold"]:
+                reason |= COMP_RATIO_FILTER
+            if seg.get("no_speech_prob", 0.6) > parameters["no_speech_prob_threshold"]:
+                reason |= NO_SPEECH_FILTER
+            if len(text.strip()) < parameters["min_text_length"]:
+                reason |= MIN_TEXT_FILTER
+
+        # Nothing to display for this segment timing-wise
+        if not text or seg_duration <= 0:
+            seg["antix"] = {
+                "filtered": reason,
+                "filtered_bin": f"0b{reason:05b}",
+                "wrapped_text": []
+            }
+            if segment_voice_ratios is not None:
+                seg["antix"]["voice_ratio"] = round(float(segment_voice_ratios[idx]), 3)
+            if segment_voiced[idx]:
+                prev_seg_end = seg_end
+            continue
+
+        if enable_caps:
+            text = text.upper()
+
+        # Internal gap-based silence detection:
+        # If there's a gap >= threshold from previous segment, the FIRST line of this segment is single-line.
+        if idx > 0 and prev_seg_end is not None:
+            gap = seg_start - prev_seg_end
+            if gap >= silence_threshold:
+                next_segment_force_single_line = True
+
+        segment_force_single_line = next_segment_force_single_line
+
+        # Wrap + time in one pass: lines come out of the layout generator already
+        # carrying their non-space char count; the total is known from the words
+        words = text.split()
+        total_chars = sum(map(len, words)) or 1
+        current_time = seg_start
+
+        wrapped_entries: List[Dict] = []
+        first_line_in_segment = True
+
+        for line, chars in _wrap_lines(words, wrap_length):
+            # Proportionally distribute segment time across lines by character count (excluding spaces)
+            duration = seg_duration * (chars / total_chars)
+            line_start = current_time
+            line_end = current_time + duration
+            current_time = line_end
+
+            # Decide whether this line should be single-line or N-line scrolling
+            if first_line_in_segment and segment_force_single_line:
+                # Single-line mode (bottom-aligned)
+                block_text = "\n" + line
+                segment_force_single_line = False
+            elif history:
+                # N-line scrolling: up to max_caption_lines-1 previous lines + current line
+                block_text = "\n".join(history) + "\n" + line
+            else:
+                block_text = "\n" + line
+
+            if not chunk_state_silent:
+                active_state.is_first_caption = False
+
+            wrapped_entries.append({
+                "text": block_text,
+                "start": line_start,
+                "end": line_end
+            })
+
+            # Update scrolling state only if this is not a VAD-silence chunk
+            if not chunk_state_silent:
+                history.append(line)   # deque drops the oldest line by itself
+                history_changed = True
+                active_state.last_line = line
+
+            first_line_in_segment = False
+
+        # After first segment in the chunk is processed, subsequent segments
+        # will only use internal-gap silence rules (set at the top of loop)
+        next_segment_force_single_line = False
+
+        seg["antix"] = {
+            "filtered": reason,
+            "filtered_bin": f"0b{reason:05b}",
+            "wrapped_text": wrapped_entries
+        }
+        if segment_voice_ratios is not None:
+            seg["antix"]["voice_ratio"] = round(float(segment_voice_ratios[idx]), 3)
+
+        # Unvoiced segments don't end a silence gap; the next voiced one measures from the last speech
+        if segment_voiced[idx]:
+            prev_seg_end = seg_end
+
+    # Propagate state changes:
+    if chunk_state_silent:
+        # Do NOT propagate last_lines / is_first_caption from this chunk,
+        # but let next chunk know that we ended with silence.
+        state.prev_chunk_ended_with_silence = True
+        state.last_lines = []
+        state.last_line = ""
+    else:
+        # active_state is 'state' itself in this branch, so we just update trailing_silence.
+        state.prev_chunk_ended_with_silence = trailing_silence
+
+    if not chunk_state_silent:
+        if history_changed:
+            state.last_lines = list(history)
+        state.last_line = active_state.last_line
+        state.is_first_caption = active_state.is_first_caption
+
+    stream_states.mark_dirty(stream_id)
+
+
+# ----------------------------------------------------------------------
+# Micro-batching: several short chunks → one encoder/decoder pass
+# ----------------------------------------------------------------------
+# Whisper's own transcribe() defaults, mirrored so batched results match it
+WHISPER_LOGPROB_THRESHOLD = -1.0
+WHISPER_NO_SPEECH_THRESHOLD = 0.6
+WHISPER_COMPRESSION_RATIO_THRESHOLD = 2.4
+
+
+def _segments_from_decoding(result, tokenizer, content_frames: int):
+    """
+    Splits one DecodingResult into Whisper-style segments using timestamp tokens
+    (same rules as whisper.transcribe for the first 30 s window, including
+    instantaneous / empty segments, which are kept with text and tokens cleared).
+    Returns None when transcribe() would have needed another window (seek < content),
+    so the caller can fall back to the regular path for that chunk.
+    """
+    tokens = list(result.tokens)
+    ts_begin = tokenizer.timestamp_begin
+    time_precision = whisper.audio.HOP_LENGTH * 2 / SAMPLE_RATE
+    input_stride = 2  # mel frames per output token
+    segment_size = min(whisper.audio.N_FRAMES, content_frames)
+
+    is_ts = [t >= ts_begin for t in tokens]
+    single_timestamp_ending = is_ts[-2:] == [False, True]
+    consecutive = [i + 1 for i in range(len(tokens) - 1) if is_ts[i] and is_ts[i + 1]]
+
+    def make_segment(start: float, end: float, seg_tokens: List[int]) -> Dict:
+        return {
+            "seek": 0,
+            "start": start,
+            "end": end,
+            "text": tokenizer.decode([t for t in seg_tokens if t < tokenizer.eot]),
+            "tokens": seg_tokens,
+            "temperature": result.temperature,
+            "avg_logprob": result.avg_logprob,
+            "compression_ratio": result.compression_ratio,
+            "no_speech_prob": result.no_speech_prob,
+        }
+
+    segments: List[Dict] = []
+    if consecutive:
+        slices = list(consecutive)
+        if single_timestamp_ending:
+            slices.append(len(tokens))
+        last_slice = 0
+        for current_slice in slices:
+            sliced = tokens[last_slice:current_slice]
+            start_pos = sliced[0] - ts_begin
+            end_pos = sliced[-1] - ts_begin
+            segments.append(make_segment(0.0 + start_pos * time_precision, 0.0 + end_pos * time_precision, sliced))
+            last_slice = current_slice
+
+        if not single_timestamp_ending:
+            last_ts_pos = tokens[last_slice - 1] - ts_begin
+            if last_ts_pos * input_stride < content_frames:
+                return None
+    else:
+        duration = segment_size * whisper.audio.HOP_LENGTH / SAMPLE_RATE
+        timestamps = [t for t in tokens if t >= ts_begin]
+        if timestamps and timestamps[-1] != ts_begin:
+            duration = (timestamps[-1] - ts_begin) * time_precision
+        segments.append(make_segment(0.0, 0.0 + duration, tokens))
+
+    for seg in segments:
+        if seg["start"] == seg["end"] or seg["text"].strip() == "":
+            seg["text"] = ""
+            seg["tokens"] = []
+            seg["words"] = []
+    return [{"id": i, **seg} for i, seg in enumerate(segments)]
+
+
+def transcribe_batch(model, audios: List[np.ndarray], options: Dict) -> List[Dict]:
+    """
+    Runs up to 30 s chunks through the encoder and decoder as ONE batch and
+    returns one transcribe()-shaped result dict per chunk.
+    Uses a single temperature (no fallback loop), exactly like the current
+    transcribe() call. Mels, language detection and segment splitting follow
+    transcribe() step by step; chunks that would need a second 30 s window (seek)
+    are re-run individually with model.transcribe so the output stays equivalent.
+    """
+    N_FRAMES = whisper.audio.N_FRAMES
+    fp16 = device == "cuda"
+    dtype = torch.float16 if fp16 else torch.float32
+
+    padded_mels = []
+    windows = []
+    content_frames = []
+    for audio in audios:
+        # 30 s of silence appended before the STFT, as transcribe() does; its first
+        # window holds only the content frames, zero-padded to N_FRAMES
+        mel = whisper.log_mel_spectrogram(audio, model.dims.n_mels, padding=whisper.audio.N_SAMPLES)
+        frames = mel.shape[-1] - N_FRAMES
+        padded_mels.append(mel)
+        content_frames.append(frames)
+        windows.append(whisper.pad_or_trim(mel[:, :min(N_FRAMES, frames)], N_FRAMES))
+    mel_batch = torch.stack(windows).to(model.device).to(dtype)
+
+    language = options.get("language")
+    if language is None and not model.is_multilingual:
+        language = "en"
+    if language is not None:
+        languages = [language] * len(audios)
+    else:
+        # transcribe() detects on the first N_FRAMES of the silence-padded mel
+        detect_batch = torch.stack([whisper.pad_or_trim(mel, N_FRAMES) for mel in padded_mels])
+        _, probs = model.detect_language(detect_batch.to(model.device).to(dtype))
+        languages = [max(p, key=p.get) for p in probs]
+
+    # One decoder pass per language in the batch (almost always exactly one)
+    decoded = [None] * len(audios)
+    for lang in dict.fromkeys(languages):
+        indices = [i for i, item_lang in enumerate(languages) if item_lang == lang]
+        decode_options = whisper.DecodingOptions(
+            task="transcribe",
+            language=lang,
+            temperature=options.get("temperature", 0.0),
+            fp16=fp16,
+        )
+        for i, dec in zip(indices, whisper.decode(model, mel_batch[indices], decode_options)):
+            decoded[i] = dec
+
+    results: List[Dict] = []
+    for audio, dec, frames, lang in zip(audios, decoded, content_frames, languages):
+        # transcribe() drops the window when it's most likely silence
+        if dec.no_speech_prob > WHISPER_NO_SPEECH_THRESHOLD and dec.avg_logprob <= WHISPER_LOGPROB_THRESHOLD:
+            results.append({"text": "", "segments": [], "language": lang})
+            continue
+
+        tokenizer = whisper.tokenizer.get_tokenizer(
+            model.is_multilingual,
+            num_languages=model.num_languages,
+            language=lang,
+            task="transcribe",
+        )
+        segments = _segments_from_decoding(dec, tokenizer, frames)
+
+        if segments is None:
+            # Needs more than one window: let Whisper handle this chunk the usual way
+            results.append(model.transcribe(audio, **options))
+            continue
+
+        results.append({
+            "text": tokenizer.decode([t for seg in segments for t in seg["tokens"]]),
+            "segments": segments,
+            "language": lang,
+        })
+    return results
+
+
+class _BatchItem:
+    def __init__(self, audio: np.ndarray) -> None:
+        self.audio = audio
+        self.future: Future = Future()
+        self.enqueued_at: float = time.time()
+
+
+class BatchScheduler:
+    """
+    Collects pending /transcribe chunks for the same model + decoding options
+    within a short time window (or until max_size) and decodes them as one batch.
+    Each waiting request gets its own result back through a Future, so caption
+    state and antix metadata are still built per request.
+    """
+
+    def __init__(self, window_ms: float, max_size: int, workers: int = 1) -> None:
+        self.window = max(float(window_ms), 0.0) / 1000.0
+        self.max_size = max(int(max_size), 1)
+        self._cond = threading.Condition()
+        self._pending: Dict[tuple, List[_BatchItem]] = {}
+        # One in-flight batch per replica OF EACH MODEL (one semaphore per model slot);
+        # while a model's replicas are all busy its batches keep filling up, other models still run
+        self.workers = max(int(workers), 1)
+        self._free_workers: Dict[str, threading.Semaphore] = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.workers * len(available_models))
+        self._thread = None
+
+    def submit(self, model_name: str, audio: np.ndarray, options: Dict) -> Future:
+        key = (model_name, tuple(sorted(options.items())))
+        item = _BatchItem(audio)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._pending.setdefault(key, []).append(item)
+            self._cond.notify()
+        return item.future
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                # Oldest waiting key whose model has a free replica, so no model/option group starves
+                key = None
+                for k in sorted(self._pending, key=lambda k: self._pending[k][0].enqueued_at):
+                    if self._model_slot(k[0]).acquire(blocking=False):
+                        key = k
+                        break
+                if key is not None:
+                    break
+                self._cond.wait()
+
+            deadline = self._pending[key][0].enqueued_at + self.window
+            while len(self._pending[key]) < self.max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            items = self._pending[key][:self.max_size]
+            rest = self._pending[key][self.max_size:]
+            if rest:
+                self._pending[key] = rest
+            else:
+                del self._pending[key]
+            return key, items
+
+    def _model_slot(self, model_name: str) -> threading.Semaphore:
+        # Caller holds _cond
+        if model_name not in self._free_workers:
+            self._free_workers[model_name] = threading.Semaphore(self.workers)
+        return self._free_workers[model_name]
+
+    def _run(self) -> None:
+        while True:
+            key, items = self._next_batch()
+            self._executor.submit(self._execute, key, items)
+
+    def _execute(self, key: tuple, items: List[_BatchItem]) -> None:
+        model_name, options = key[0], dict(key[1])
+        try:
+            with model_pool.acquire(model_name) as model:
+                results = transcribe_batch(model, [it.audio for it in items], options)
+            for it, res in zip(items, results):
+                it.future.set_result(res)
+        except Exception as e:
+            for it in items:
+                if not it.future.done():
+                    it.future.set_exception(e)
+        finally:
+            with self._cond:
+                self._free_workers[model_name].release()
+                self._cond.notify()
+
+
+batch_scheduler = BatchScheduler(
+    BASE_CONFIG["batch_window_ms"],
+    BASE_CONFIG["batch_max_size"],
+    workers=BASE_CONFIG["model_replicas"]
+)
+
+
+# ----------------------------------------------------------------------
+# Result cache: identical PCM + decoding options → reuse the Whisper result
+# ----------------------------------------------------------------------
+RESULT_CACHE_DIR = programdata_path("result_cache")
+
+
+class ResultCache:
+    """
+    Raw Whisper results keyed by a hash of the decoded PCM plus model and decoding
+    options. Memory tier is an LRU of `max_entries`; the optional disk tier keeps
+    one JSON file per key (pruned to `disk_max_entries`, oldest first).
+    Copies go in and out, because caption post-processing mutates the segments
+    per stream_id — only the raw transcription is shared.
+    """
+
+    def __init__(self, max_entries: int, disk_dir: Optional[str] = None, disk_max_entries: int = 0) -> None:
+        self.max_entries = max(int(max_entries), 0)
+        self.disk_dir = disk_dir
+        self.disk_max_entries = max(int(disk_max_entries), 0)
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self.disk_dir is not None
+
+    @staticmethod
+    def make_key(model_name: str, audio: np.ndarray, options: Dict) -> str:
+        h = hashlib.blake2b(digest_size=20)
+        h.update(json.dumps([model_name, sorted(options.items())]).encode("utf-8"))
+        h.update(np.ascontiguousarray(audio, dtype=np.float32).data)
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.inc("aics_result_cache_hits_total")
+                return copy.deepcopy(result)
+
+        if self.disk_dir is not None:
+            try:
+                with open(os.path.join(self.disk_dir, key + ".json"), "r", encoding="utf-8") as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                result = None
+            if result is not None:
+                self._remember(key, result)
+                with self._lock:
+                    self.hits += 1
+                metrics.inc("aics_result_cache_hits_total")
+                return copy.deepcopy(result)
+
+        with self._lock:
+            self.misses += 1
+        metrics.inc("aics_result_cache_misses_total")
+        return None
+
+    def put(self, key: str, result: Dict) -> None:
+        result = copy.deepcopy(result)
+        self._remember(key, result)
+
+        if self.disk_dir is not None:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                path = os.path.join(self.disk_dir, key + ".json")
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(result, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("result cache write failed", extra={"fields": {"key": key, "error": str(e)}})
+
+    def _remember(self, key: str, result: Dict) -> None:
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def prune_disk(self) -> None:
+        """
+        Keeps the newest `disk_max_entries` files of the disk tier (0 = unbounded).
+        """
+        if self.disk_dir is None or self.disk_max_entries == 0 or not os.path.isdir(self.disk_dir):
+            return
+        files = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        files.sort()
+        for _, path in files[:max(len(files) - self.disk_max_entries, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk": self.disk_dir is not None,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+result_cache = ResultCache(
+    BASE_CONFIG["result_cache_entries"],
+    RESULT_CACHE_DIR if BASE_CONFIG["result_cache_disk"] else None,
+    BASE_CONFIG["result_cache_disk_max_entries"]
+)
+
+
+def run_whisper(
+    model_name: str,
+    audio: np.ndarray,
+    options: Dict,
+    parameters: Dict,
+    background: bool = False
+) -> Dict:
+    """
+    Single entry point for inference. In worker mode the chunk is handed to an
+    inference process. Otherwise short live chunks go through the micro-batching
+    scheduler when enabled, and everything else runs on a free replica of the model
+    (background = async job: waits behind live requests for a replica).
+    Repeated chunks (same PCM, model and options) are answered from the result cache.
+    Only greedy (temperature 0) decodes are cached: a sampled fallback decode
+    is a random draw, not the answer for that chunk.
+    """
+    key = None
+    if result_cache.enabled and not float(options.get("temperature", 0.0)):
+        key = result_cache.make_key(model_name, audio, options)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
+    if inference_workers is not None:
+        result = inference_workers.transcribe(model_name, audio, options, parameters)
+    elif parameters["enable_batching"] and not background and len(audio) <= whisper.audio.N_SAMPLES:
+        result = batch_scheduler.submit(model_name, audio, options).result()
+    else:
+        with model_pool.acquire(model_name, background) as model:
+            result = model.transcribe(audio, **options)
+
+    if key is not None:
+        result_cache.put(key, result)
+    return result
+
+
+def needs_fallback(result: Dict) -> bool:
+    """
+    Whisper's own temperature-fallback test, applied to a whole chunk: a decode is
+    redone when it looks repetitive (compression ratio) or unlikely (avg logprob),
+    unless the window is probably silence.
+    """
+    for seg in result.get("segments", []):
+        avg_logprob = float(seg.get("avg_logprob", 0.0))
+        if float(seg.get("no_speech_prob", 0.0)) > WHISPER_NO_SPEECH_THRESHOLD and avg_logprob < WHISPER_LOGPROB_THRESHOLD:
+            continue
+        if float(seg.get("compression_ratio", 0.0)) > WHISPER_COMPRESSION_RATIO_THRESHOLD:
+            return True
+        if avg_logprob < WHISPER_LOGPROB_THRESHOLD:
+            return True
+    return False
+
+
+def _hypothesis_score(result: Dict) -> tuple:
+    # Not repetitive first, then the higher mean avg_logprob
+    segments = result.get("segments") or []
+    if not segments:
+        return (True, 0.0)
+    return (
+        max(float(seg.get("compression_ratio", 0.0)) for seg in segments) <= WHISPER_COMPRESSION_RATIO_THRESHOLD,
+        sum(float(seg.get("avg_logprob", 0.0)) for seg in segments) / len(segments)
+    )
+
+
+def run_whisper_budgeted(
+    model_name: str,
+    audio: np.ndarray,
+    options: Dict,
+    parameters: Dict,
+    background: bool = False,
+    started: Optional[float] = None
+):
+    """
+    run_whisper with a bounded temperature fallback. A decode that fails
+    needs_fallback() is redone at the next temperature (+fallback_temperature_step,
+    up to 1.0), at most `max_fallbacks` times, and only while one more attempt
+    (estimated as the mean attempt so far) still fits in `fallback_deadline_ms`
+    (0 = no deadline). The deadline counts from `started` (time.perf_counter()
+    when the request arrived), so upload, decode and queueing use it up too;
+    without it, from this call. When the budget runs out, the best hypothesis
+    so far is returned. Returns (result, info) for antix.
+    """
+    t0 = time.perf_counter()
+    started = t0 if started is None else started
+    temperature = float(options.get("temperature", 0.0))
+    result = run_whisper(model_name, audio, options, parameters, background=background)
+    labels = (("model", model_name),)
+
+    max_fallbacks = int(parameters["max_fallbacks"])
+    deadline = float(parameters["fallback_deadline_ms"]) / 1000.0
+    step = float(parameters["fallback_temperature_step"])
+    best, best_temperature = result, temperature
+    fallbacks = 0
+    exhausted = None
+
+    if needs_fallback(result):
+        metrics.inc("aics_decode_fallback_needed_total", labels)
+        while max_fallbacks > 0:
+            if fallbacks >= max_fallbacks or temperature >= 1.0 or step <= 0:
+                exhausted = "attempts"
+                break
+            now = time.perf_counter()
+            if deadline > 0 and now - started + (now - t0) / (fallbacks + 1) > deadline:
+                exhausted = "deadline"
+                break
+            temperature = round(min(temperature + step, 1.0), 3)
+            fallbacks += 1
+            result = run_whisper(model_name, audio, dict(options, temperature=temperature), parameters, background=background)
+            if not needs_fallback(result):
+                best, best_temperature = result, temperature
+                break
+            if _hypothesis_score(result) > _hypothesis_score(best):
+                best, best_temperature = result, temperature
+
+    if fallbacks:
+        metrics.inc("aics_decode_fallbacks_total", labels, fallbacks)
+    if exhausted is not None:
+        metrics.inc("aics_decode_budget_exhausted_total", labels + (("reason", exhausted),))
+    return best, {
+        "fallback_attempts": fallbacks,
+        "fallback_exhausted": exhausted is not None,
+        "decode_temperature": best_temperature
+    }
+
+
+# ----------------------------------------------------------------------
+# Worker mode: inference in N separate processes (own GIL, own model)
+# ----------------------------------------------------------------------
+def _inference_worker_main(worker_id: int, model_name: str, threads: int, tasks, results) -> None:
+    """
+    Child process loop: preload + warm up its own model, then take jobs from its
+    task queue. Audio arrives as a shared-memory block name, not pickled bytes.
+    The worker IS the replica: it loads one copy per model (model_replicas is
+    ignored), decodes one chunk at a time and never micro-batches. Result caching
+    stays in the front end, before the chunk is dispatched.
+    """
+    global model_pool
+    if device == "cpu":
+        torch.set_num_threads(threads)
+    model_pool = ModelPool(
+        int(float(BASE_CONFIG["model_pool_budget_mb"]) * 1024 * 1024),
+        replicas=1,
+        cpu_threads=threads
+    )
+    warm_up(model_pool.get(model_name))
+    results.put(("ready", None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        job_id, shm_name, n_samples, job_model, options, parameters = task
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                audio = np.ndarray((n_samples,), dtype=np.float32, buffer=shm.buf).copy()
+            finally:
+                shm.close()
+            with model_pool.acquire(job_model) as model:
+                result = model.transcribe(audio, **options)
+            results.put(("ok", job_id, result))
+        except Exception as e:
+            results.put(("error", job_id, f"{type(e).__name__}: {e}"))
+
+
+class _InferenceWorker:
+    def __init__(self, ctx, worker_id: int, model_name: str, threads: int) -> None:
+        self.worker_id = worker_id
+        # Queues are per worker: a worker killed inside get()/put() can't wedge the others
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.inflight: Dict[int, Future] = {}
+        self.completed = 0
+        self.failed = 0
+        self.ready = False
+        self.process = ctx.Process(
+            target=_inference_worker_main,
+            args=(worker_id, model_name, threads, self.tasks, self.results),
+            daemon=True
+        )
+        self.process.start()
+
+
+class InferenceWorkerPool:
+    """
+    Front-end side of worker mode. The waitress process only parses, enqueues and
+    serializes; each job goes to the worker with the fewest jobs in flight.
+    A dead worker fails the jobs it held (instead of hanging them) and is respawned.
+    """
+
+    def __init__(self, num_workers: int, model_name: str) -> None:
+        self._ctx = multiprocessing.get_context("spawn")
+        self.num_workers = num_workers
+        self.model_name = model_name
+        self.threads = max(1, (os.cpu_count() or 1) // num_workers)
+        self._workers: List[_InferenceWorker] = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self.restarts = 0
+
+    def _wait_ready(self, worker: _InferenceWorker) -> None:
+        while True:
+            try:
+                kind, _, _ = worker.results.get(timeout=1.0)
+            except queue.Empty:
+                if not worker.process.is_alive():
+                    raise RuntimeError(f"Inference worker {worker.worker_id} exited during startup")
+                continue
+            if kind == "ready":
+                worker.ready = True
+                logger.info("inference worker ready", extra={"fields": {"worker": worker.worker_id}})
+                return
+
+    def start(self) -> None:
+        self._workers = [
+            _InferenceWorker(self._ctx, worker_id, self.model_name, self.threads)
+            for worker_id in range(self.num_workers)
+        ]
+        for worker in self._workers:
+            self._wait_ready(worker)
+            threading.Thread(target=self._collect, args=(worker,), daemon=True).start()
+
+    def _collect(self, worker: _InferenceWorker) -> None:
+        while True:
+            try:
+                kind, job_id, payload = worker.results.get(timeout=1.0)
+            except queue.Empty:
+                if worker.process.is_alive():
+                    continue
+                self._restart(worker)
+                return
+
+            with self._lock:
+                future = worker.inflight.pop(job_id, None)
+                if kind == "ok":
+                    worker.completed += 1
+                else:
+                    worker.failed += 1
+            if future is None:
+                continue
+            if kind == "ok":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _restart(self, worker: _InferenceWorker) -> None:
+        logger.warning(
+            "inference worker exited, restarting",
+            extra={"fields": {"worker": worker.worker_id, "exitcode": worker.process.exitcode}}
+        )
+        replacement = _InferenceWorker(self._ctx, worker.worker_id, self.model_name, self.threads)
+        with self._lock:
+            self._workers[worker.worker_id] = replacement
+            self.restarts += 1
+            lost = list(worker.inflight.values())
+            worker.inflight.clear()
+        for future in lost:
+            future.set_exception(RuntimeError(f"Inference worker {worker.worker_id} died"))
+        try:
+            self._wait_ready(replacement)
+        except RuntimeError as e:
+            logger.error(str(e))
+        threading.Thread(target=self._collect, args=(replacement,), daemon=True).start()
+
+    def transcribe(self, model_name: str, audio: np.ndarray, options: Dict, parameters: Dict) -> Dict:
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        shm = shared_memory.SharedMemory(create=True, size=max(audio.nbytes, 1))
+        try:
+            np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[:] = audio
+            future: Future = Future()
+            job_id = next(self._ids)
+            with self._lock:
+                worker = min(self._workers, key=lambda w: len(w.inflight))
+                worker.inflight[job_id] = future
+            worker.tasks.put((job_id, shm.name, len(audio), model_name, options, parameters))
+            return future.result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "threads_per_worker": self.threads if device == "cpu" else None,
+                "restarts": self.restarts,
+                "processes": [
+                    {
+                        "worker": w.worker_id,
+                        "pid": w.process.pid,
+                        "alive": w.process.is_alive(),
+                        "ready": w.ready,
+                        "inflight": len(w.inflight),
+                        "completed": w.completed,
+                        "failed": w.failed
+                    }
+                    for w in self._workers
+                ]
+            }
+
+    def stop(self) -> None:
+        for worker in self._workers:
+            worker.tasks.put(None)
+
+
+# Set in __main__ when inference_workers > 0; stays None inside the workers themselves
+inference_workers = None
+
+
+# ----------------------------------------------------------------------
+# Raw PCM streaming ingest (server-side VAD segmentation)
+# ----------------------------------------------------------------------
+STREAM_FRAME_MS = 30
+STREAM_EVENT_QUEUE_SIZE = 1000
+
+
+class StreamIngestSession:
+    """
+    Rolling 16 kHz mono s16le buffer for one stream_id.
+    Pushed PCM is run through webrtcvad frame by frame (only new frames are scanned).
+    A segment is cut when speech is followed by `stream_silence_ms` of silence, or when
+    the buffer reaches `stream_max_segment_seconds`. The last `stream_overlap_seconds`
+    are carried into the next segment as context; Whisper segments that end inside
+    that overlap are dropped so nothing is captioned twice.
+    Segments are transcribed in order on a per-session worker thread and the
+    resulting caption blocks are queued for the /captions feed.
+    """
+
+    def __init__(self, stream_id: str, parameters: Dict) -> None:
+        self.stream_id = stream_id
+        self.parameters = parameters
+        self.vad = webrtcvad.Vad(int(parameters["vad_aggressiveness"]))
+        self.frame_bytes = int(SAMPLE_RATE * STREAM_FRAME_MS / 1000) * 2
+        self.buffer = bytearray()
+        self.buffer_start: float = 0.0   # stream time (s) of buffer[0]
+        self.overlap_bytes = 0            # leading bytes already sent with the previous segment
+        self.scan_pos = 0                 # bytes of buffer already run through VAD
+        self.speech_frames = 0
+        self.silence_run = 0
+        self.lock = threading.Lock()
+        self.segments: "queue.Queue" = queue.Queue()
+        self.events: "queue.Queue" = queue.Queue(maxsize=STREAM_EVENT_QUEUE_SIZE)
+        self.closed = False
+        self.last_activity: float = time.time()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    # ---------------- ingest side ----------------
+    def push(self, data: bytes) -> None:
+        with self.lock:
+            self.last_activity = time.time()
+            self.buffer += data
+
+            fb = self.frame_bytes
+            silence_frames_needed = max(1, int(self.parameters["stream_silence_ms"] / STREAM_FRAME_MS))
+            idle_frames_needed = max(1, int(self.parameters["silence_threshold"] * 1000 / STREAM_FRAME_MS))
+            max_bytes = int(self.parameters["stream_max_segment_seconds"] * SAMPLE_RATE) * 2
+
+            view = memoryview(self.buffer)
+            try:
+                while self.scan_pos + fb <= len(self.buffer):
+                    is_speech = self.vad.is_speech(view[self.scan_pos:self.scan_pos + fb], SAMPLE_RATE)
+                    self.scan_pos += fb
+                    if is_speech:
+                        self.speech_frames += 1
+                        self.silence_run = 0
+                    else:
+                        self.silence_run += 1
+
+                    if self.speech_frames and (self.silence_run >= silence_frames_needed or self.scan_pos >= max_bytes):
+                        view.release()
+                        self._cut(self.scan_pos, silent=False)
+                        view = memoryview(self.buffer)
+                    elif not self.speech_frames and self.silence_run >= idle_frames_needed:
+                        # Only silence so far: tell caption state, drop the audio
+                        view.release()
+                        self._cut(self.scan_pos, silent=True)
+                        view = memoryview(self.buffer)
+            finally:
+                view.release()
+
+    def _cut(self, end: int, silent: bool) -> None:
+        overlap = self.overlap_bytes / 2.0 / SAMPLE_RATE
+        self.segments.put((None if silent else bytes(self.buffer[:end]), self.buffer_start, overlap, end))
+
+        keep = min(int(self.parameters["stream_overlap_seconds"] * SAMPLE_RATE) * 2, end)
+        del self.buffer[:end - keep]
+        self.buffer_start += (end - keep) / 2.0 / SAMPLE_RATE
+        self.overlap_bytes = keep
+        self.scan_pos = keep
+        self.speech_frames = 0
+        self.silence_run = 0
+
+    def close(self) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.speech_frames:
+                end = len(self.buffer) - len(self.buffer) % 2
+                self._cut(end, silent=False)
+            self.segments.put(None)
+
+    # ---------------- output side ----------------
+    def _emit(self, event: Dict) -> None:
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                # Slow / absent consumer: drop the oldest block, never block ingest
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _worker(self) -> None:
+        while True:
+            item = self.segments.get()
+            if item is None:
+                self._emit({"type": "end", "stream_id": self.stream_id})
+                return
+            try:
+                self._process_segment(*item)
+            except Exception as e:
+                self._emit({"type": "error", "stream_id": self.stream_id, "error": str(e)})
+
+    def _process_segment(self, pcm, offset: float, overlap: float, n_bytes: int) -> None:
+        params = self.parameters
+        duration = n_bytes / 2.0 / SAMPLE_RATE
+
+        if pcm is None:
+            process_segments_with_scrolling_captions([], duration, params, True, self.stream_id)
+            return
+
+        audio = _pcm16_to_float(pcm)
+        model_name = params["model"]
+        options = {"temperature": params["temperature"]}
+        language = locked_language(self.stream_id, params)
+        if language is not None:
+            options["language"] = language
+        result, _ = run_whisper_budgeted(model_name, audio, options, params)
+        update_stream_language(self.stream_id, params, result, language)
+
+        segments = [s for s in result.get("segments", []) if float(s.get("end", 0.0)) > overlap]
+        process_segments_with_scrolling_captions(segments, duration, params, False, self.stream_id)
+
+        for seg in segments:
+            antix = seg["antix"]
+            for entry in antix["wrapped_text"]:
+                self._emit({
+                    "type": "caption",
+                    "stream_id": self.stream_id,
+                    "text": entry["text"],
+                    "start": round(offset + entry["start"], 3),
+                    "end": round(offset + entry["end"], 3),
+                    "filtered": antix["filtered"]
+                })
+
+
+ingest_sessions: Dict[str, StreamIngestSession] = {}
+ingest_sessions_lock = threading.Lock()
+
+
+# ----------------------------------------------------------------------
+# Long-form: split at VAD silences → transcribe shards in parallel → stitch
+# ----------------------------------------------------------------------
+SHARD_PAD_SECONDS = 0.2  # audio kept around each shard's speech so word edges aren't clipped
+
+
+def plan_shards(vad_result: VadResult, total_seconds: float, max_seconds: float) -> List[tuple]:
+    """
+    Groups VAD speech regions into (start_sec, end_sec) shards of at most `max_seconds`.
+    Shards are cut in the middle of silence gaps; a single speech run longer than
+    `max_seconds` is hard-split. Pure silence between shards is not transcribed.
+    """
+    # Room for the padding on both sides, so a padded shard still fits max_seconds
+    limit = max(max_seconds - 2 * SHARD_PAD_SECONDS, SHARD_PAD_SECONDS)
+
+    regions: List[List[float]] = []
+    for start, end in vad_result.speech_regions():
+        while end - start > limit:
+            regions.append([start, start + limit])
+            start += limit
+        regions.append([start, end])
+
+    groups: List[List[float]] = []
+    for start, end in regions:
+        if groups and end - groups[-1][0] <= limit:
+            groups[-1][1] = end
+        else:
+            groups.append([start, end])
+
+    shards: List[tuple] = []
+    for i, (start, end) in enumerate(groups):
+        lo = 0.0 if i == 0 else (groups[i - 1][1] + start) / 2.0
+        hi = total_seconds if i == len(groups) - 1 else (end + groups[i + 1][0]) / 2.0
+        start = max(lo, start - SHARD_PAD_SECONDS)
+        end = min(hi, end + SHARD_PAD_SECONDS)
+        shards.append((round(start, 3), round(end, 3)))
+    return shards
+
+
+def _shard_parallelism(parameters: Dict, background: bool) -> int:
+    """
+    Shards in flight at once: one per inference worker / model replica, times the
+    batch size when short chunks are micro-batched (so shards fill whole batches).
+    """
+    if inference_workers is not None:
+        return inference_workers.num_workers
+    n = max(int(parameters["model_replicas"]), 1)
+    if parameters["enable_batching"] and not background:
+        n *= max(int(parameters["batch_max_size"]), 1)
+    return n
+
+
+def transcribe_long_form(
+    audio: np.ndarray,
+    vad_result: VadResult,
+    options: Dict,
+    parameters: Dict,
+    background: bool = False,
+    progress=None
+) -> Dict:
+    """
+    Long uploads: instead of Whisper's sequential 30 s sliding window, transcribe
+    independent VAD-split shards concurrently (across replicas / workers, or batched)
+    and stitch the segments back with start/end shifted to file time.
+    Each shard takes a replica only for its own decode, so jobs yield between shards.
+    `progress(done, total)` is called as shards finish.
+    Returns (result, info) like run_whisper_budgeted (totals over the shards).
+    """
+    total_seconds = get_audio_duration_seconds(audio)
+    shards = plan_shards(vad_result, total_seconds, float(parameters["shard_max_seconds"]))
+    info = {"fallback_attempts": 0, "fallback_exhausted": False, "decode_temperature": options["temperature"]}
+    if not shards:
+        return {"text": "", "segments": [], "language": None}, info
+
+    def run_shard(shard: tuple):
+        start, end = shard
+        chunk = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        return run_whisper_budgeted(parameters["model"], chunk, options, parameters, background=background)
+
+    results: List[Optional[Dict]] = [None] * len(shards)
+    workers = min(_shard_parallelism(parameters, background), len(shards))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_shard, shard): i for i, shard in enumerate(shards)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]], shard_info = future.result()
+            # Fallback budget applies per shard; report the totals
+            info["fallback_attempts"] += shard_info["fallback_attempts"]
+            info["fallback_exhausted"] = info["fallback_exhausted"] or shard_info["fallback_exhausted"]
+            info["decode_temperature"] = max(info["decode_temperature"], shard_info["decode_temperature"])
+            if progress is not None:
+                progress(done, len(shards))
+
+    segments: List[Dict] = []
+    language = None
+    for (offset, _), result in zip(shards, results):
+        language = language or result.get("language")
+        for seg in result.get("segments", []):
+            seg = dict(seg)
+            seg["id"] = len(segments)
+            seg["seek"] = int(round(offset * SAMPLE_RATE / whisper.audio.HOP_LENGTH))
+            seg["start"] = round(offset + float(seg["start"]), 3)
+            seg["end"] = round(offset + float(seg["end"]), 3)
+            segments.append(seg)
+
+    return {
+        "text": "".join(seg["text"] for seg in segments),
+        "segments": segments,
+        "language": language
+    }, info
+
+
+class AudioAnalysis:
+    """
+    CPU-side facts about one decoded chunk, worked out before inference:
+    duration, the VAD timeline and the long-form / VAD-silence decisions.
+    """
+
+    def __init__(self, audio: np.ndarray, parameters: Dict) -> None:
+        self.audio = audio
+
+        # Duration for silence rules (and the long-form decision)
+        self.duration = get_audio_duration_seconds(audio)
+        self.long_form = parameters["long_form"] and self.duration > parameters["shard_max_seconds"]
+
+        # VAD (frame-level timeline kept for per-segment decisions and shard planning)
+        self.vad_result: Optional[VadResult] = None
+        if parameters["enable_vad"] or self.long_form:
+            with timed_stage("vad"):
+                self.vad_result = run_vad(
+                    audio,
+                    parameters["vad_aggressiveness"],
+                    engine=parameters["vad_engine"]
+                )
+        self.is_vad_silence = (
+            parameters["enable_vad"]
+            and not self.vad_result.voice_ratio() > parameters["vad_voice_ratio_threshold"]
+        )
+
+
+def infer_audio(
+    analysis: AudioAnalysis,
+    parameters: Dict,
+    stream_id: Optional[str] = None,
+    background: bool = False,
+    progress=None,
+    started: Optional[float] = None
+):
+    """
+    Inference stage: Whisper (batched with other requests' chunks when enabled),
+    or the VAD short-circuit for silent chunks. Returns (result, details).
+    A stream with a locked language skips Whisper's language detection.
+    `started` (perf_counter at request arrival) anchors the fallback deadline.
+    """
+    audio_duration = analysis.duration
+    vad_skipped = analysis.is_vad_silence and parameters["skip_vad_silence"]
+    options = {"temperature": parameters["temperature"]}
+    language = locked_language(stream_id, parameters)
+    if language is not None:
+        options["language"] = language
+    if vad_skipped:
+        # No decode, no model slot taken
+        result = {"text": "", "segments": [], "language": None}
+        fallback = {"fallback_attempts": 0, "fallback_exhausted": False, "decode_temperature": options["temperature"]}
+    else:
+        t0 = time.perf_counter()
+        with timed_stage("inference"):
+            if analysis.long_form:
+                result, fallback = transcribe_long_form(
+                    analysis.audio, analysis.vad_result, options, parameters, background, progress
+                )
+            else:
+                result, fallback = run_whisper_budgeted(
+                    parameters["model"], analysis.audio, options, parameters, background=background, started=started
+                )
+        if audio_duration > 0:
+            metrics.observe(
+                "aics_real_time_factor",
+                (time.perf_counter() - t0) / audio_duration,
+                (("model", parameters["model"]),),
+                RTF_BUCKETS
+            )
+    metrics.inc("aics_audio_seconds_total", (("model", parameters["model"]),), audio_duration)
+
+    details = {"vad_skipped": vad_skipped, "long_form": analysis.long_form}
+    details.update(fallback)
+    details.update(update_stream_language(stream_id, parameters, result, language))
+    return result, details
+
+
+def layout_captions(result: Dict, analysis: AudioAnalysis, parameters: Dict, stream_id: str) -> None:
+    """
+    Caption stage: scrolling captions + antix fields (stitched shards arrive in file order).
+    """
+    segments = result.get("segments", [])
+    with timed_stage("captions"):
+        process_segments_with_scrolling_captions(
+            segments=segments,
+            audio_duration=analysis.duration,
+            parameters=parameters,
+            is_vad_silence=analysis.is_vad_silence,
+            stream_id=stream_id,
+            segment_voice_ratios=(
+                analysis.vad_result.segment_voice_ratios(segments) if parameters["enable_vad"] else None
+            )
+        )
+
+
+def transcribe_audio(
+    audio: np.ndarray,
+    parameters: Dict,
+    stream_id: str,
+    background: bool = False,
+    progress=None
+):
+    """
+    Core of /transcribe, shared with async jobs:
+    VAD → Whisper (or VAD short-circuit) → duration → scrolling captions.
+    Returns (result, details); details holds per-request facts for antix.
+    `background` requests yield model replicas to live caption traffic.
+    With `long_form`, audio longer than one shard is split at VAD silences
+    (`progress(done, total)` reports finished shards).
+    /transcribe runs the same three stages, spread over the pipeline pools.
+    """
+    analysis = AudioAnalysis(audio, parameters)
+    result, details = infer_audio(analysis, parameters, stream_id, background, progress)
+    layout_captions(result, analysis, parameters, stream_id)
+    return result, details
+
+
+# ----------------------------------------------------------------------
+# Request pipeline: capped CPU stages, inference in between
+# ----------------------------------------------------------------------
+class StageLimiter:
+    """
+    Caps how many server threads run one CPU stage of /transcribe at a time.
+    The work runs on the calling thread (a WSGI thread has to wait for its response
+    anyway, so a hand-off to a pool would only add a hop). Overlap comes from the
+    server threads themselves: while one request holds a model replica, the
+    requests behind it decode and VAD-scan in their own threads, at most
+    `num_workers` at once so torch keeps the remaining cores.
+    A streamed response body is produced after the handler returns; stream()
+    keeps that work under the same cap.
+    """
+
+    def __init__(self, name: str, num_workers: int) -> None:
+        self.name = name
+        self.num_workers = max(int(num_workers), 1)
+        self._slots = threading.BoundedSemaphore(self.num_workers)
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> None:
+        with self._lock:
+            self._waiting += 1
+        try:
+            self._slots.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def run(self, fn, *args):
+        self._acquire()
+        try:
+            return fn(*args)
+        finally:
+            self._slots.release()
+
+    def stream(self, chunks):
+        """
+        Yields from `chunks` holding a slot: taken when the server starts reading
+        the body, released when it is exhausted or closed (client gone).
+        """
+        self._acquire()
+        try:
+            yield from chunks
+        finally:
+            self._slots.release()
+
+    def depth(self) -> int:
+        return self._waiting
+
+
+def _pipeline_workers(configured: int) -> int:
+    return configured if configured > 0 else max(1, (os.cpu_count() or 1) // 2)
+
+
+# Upload decode + VAD, and caption layout + serialization, for /transcribe
+cpu_stage = StageLimiter("cpu", _pipeline_workers(BASE_CONFIG["pipeline_cpu_workers"]))
+post_stage = StageLimiter("post", _pipeline_workers(BASE_CONFIG["pipeline_post_workers"]))
+
+
+def build_antix_meta(parameters: Dict, response_time: float, details: Dict) -> Dict:
+    """
+    antix block shared by /transcribe and async jobs (ids are added by the caller).
+    """
+    antix_meta = {
+        "api_ver": APP_VERSION,
+        "whisper_ver": whisper.version.__version__,
+        "model": parameters["model"],
+        "profile": parameters.get("profile"),
+        "device": device,
+        "response_time": round(response_time, 3),
+
+        # FULL PARAMETER VISIBILITY
+        "enable_filtering": parameters["enable_filtering"],
+        "enable_caps": parameters["enable_caps"],
+        "enable_vad": parameters["enable_vad"],
+        "skip_vad_silence": parameters["skip_vad_silence"],
+        "vad_skipped": details["vad_skipped"],
+        "long_form": details["long_form"],
+        "language": details["language"],
+        "language_lock": parameters["language_lock"],
+        "language_locked": details["language_locked"],
+        # Modes actually used: a streamed response is never pretty-printed
+        "pretty_json": parameters["pretty_json"] and not parameters["stream_response"],
+        "stream_response": parameters["stream_response"],
+        "exclude": parameters["exclude"],
+
+        "silence_threshold": parameters["silence_threshold"],
+        "wrap_length": parameters["wrap_length"],
+        "max_caption_lines": parameters["max_caption_lines"],
+
+        # Whisper decoding params
+        "temperature": parameters["temperature"],
+        "decode_temperature": details["decode_temperature"],
+        "max_fallbacks": parameters["max_fallbacks"],
+        "fallback_deadline_ms": parameters["fallback_deadline_ms"],
+        "fallback_attempts": details["fallback_attempts"],
+        "fallback_exhausted": details["fallback_exhausted"],
+        "avg_logprob_threshold": parameters["avg_logprob_threshold"],
+        "compression_ratio_threshold": parameters["compression_ratio_threshold"],
+        "no_speech_prob_threshold": parameters["no_speech_prob_threshold"],
+        "vad_aggressiveness": parameters["vad_aggressiveness"],
+        "vad_voice_ratio_threshold": parameters["vad_voice_ratio_threshold"],
+        "vad_engine": parameters["vad_engine"],
+        "min_text_length": parameters["min_text_length"]
+    }
+    return antix_meta
+
+
+# ----------------------------------------------------------------------
+# Async jobs: submit → poll → fetch (results persisted on disk with a TTL)
+# ----------------------------------------------------------------------
+JOBS_DIR = programdata_path("jobs")
+JOB_DEFAULT_PRIORITY = 10
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class TranscriptionJob:
+    def __init__(
+        self,
+        upload_path: str,
+        filename: str,
+        mimetype: str,
+        parameters: Dict,
+        stream_id: Optional[str],
+        audio_id: Optional[str],
+        priority: int
+    ) -> None:
+        self.job_id: str = uuid.uuid4().hex
+        self.upload_path = upload_path          # spooled upload, deleted once decoded
+        self.filename = filename
+        self.mimetype = mimetype
+        self.parameters = parameters
+        # Without a stream_id the job gets its own caption state
+        self.stream_id: str = stream_id or f"job:{self.job_id}"
+        self.audio_id: str = audio_id or self.job_id
+        self.priority = priority
+        self.status = "queued"                  # queued → running → done | failed
+        self.stage = "queued"
+        self.progress = 0.0
+        self.error: Optional[str] = None
+        self.created: float = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def to_status(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "priority": self.priority,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+
 
-    for idx, seg in enumerate(segments):
-        text = seg.get("text", "").strip()
-        seg_start = float(seg.get("start", 0.0))
-        seg_end = float(seg.get("end", 0.0))
-        seg_duration = max(seg_end - seg_start, 0.0)
+class JobQueue:
+    """
+    Bounded priority queue + worker threads behind /jobs.
+    Lower priority values run first, equal priorities run FIFO.
+    Job inference is "background": it never takes a model replica while a live
+    /transcribe request is waiting, and leaves `job_live_reserve` replicas free.
+    Jobs always run long-form, so a job holds a replica for one shard at a time
+    and live requests get in between shards even when there is only one replica.
+    Uploads wait on disk (uploads/ under result_dir), not in memory.
+    """
 
-        # Determine filtering reason
-        reason = 0
-        if enable_filtering:
-            if is_vad_silence:
-                reason |= VAD_FILTER
-            if seg.get("avg_logprob", -1.0) < parameters["avg_logprob_threshold"]:
-                reason |= LOGPROB_FILTER
-            if seg.get("compression_ratio", 2.4) > parameters["compression_ratio_threshold"]:
-                reason |= COMP_RATIO_FILTER
-            if seg.get("no_speech_prob", 0.6) > parameters["no_speech_prob_threshold"]:
-                reason |= NO_SPEECH_FILTER
-            if len(text.strip()) < parameters["min_text_length"]:
-                reason |= MIN_TEXT_FILTER
+    def __init__(self, num_workers: int, max_size: int, result_dir: str, ttl_seconds: float) -> None:
+        self.num_workers = max(int(num_workers), 1)
+        self.result_dir = result_dir
+        self.ttl_seconds = ttl_seconds
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue(maxsize=max(int(max_size), 1))
+        self._jobs: Dict[str, TranscriptionJob] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._started = False
+
+    def submit(self, job: TranscriptionJob) -> bool:
+        with self._lock:
+            if not self._started:
+                for _ in range(self.num_workers):
+                    threading.Thread(target=self._run, daemon=True).start()
+                self._started = True
+            try:
+                self._queue.put_nowait((job.priority, next(self._seq), job))
+            except queue.Full:
+                return False
+            self._jobs[job.job_id] = job
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def get(self, job_id: str) -> Optional[TranscriptionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.result_dir, job_id + ".json")
+
+    @property
+    def upload_dir(self) -> str:
+        return os.path.join(self.result_dir, "uploads")
+
+    def spool_upload(self, file) -> str:
+        """
+        Saves an uploaded FileStorage under upload_dir and returns the path.
+        """
+        os.makedirs(self.upload_dir, exist_ok=True)
+        path = os.path.join(self.upload_dir, uuid.uuid4().hex + ".upload")
+        file.save(path)
+        return path
+
+    def _run(self) -> None:
+        while True:
+            _, _, job = self._queue.get()
+            self._execute(job)
+
+    def _execute(self, job: TranscriptionJob) -> None:
+        job.status = "running"
+        job.started = time.time()
+        try:
+            job.stage = "decoding"
+            job.progress = 0.05
+            with open(job.upload_path, "rb") as f:
+                data = f.read()
+            _remove_quietly(job.upload_path)
+            audio = decode_audio_bytes(data, job.filename, job.mimetype)
+            del data
+
+            job.stage = "transcribing"
+            job.progress = 0.1
+            # Shard even when the request left long_form off: a single unsharded decode
+            # would keep the only replica away from live traffic for the whole file
+            job.parameters["long_form"] = True
+            result, details = transcribe_audio(
+                audio,
+                job.parameters,
+                job.stream_id,
+                background=True,
+                progress=lambda done, total: setattr(job, "progress", 0.1 + 0.85 * done / total)
+            )
+
+            job.stage = "saving"
+            job.progress = 0.95
+            antix_meta = build_antix_meta(job.parameters, time.time() - job.created, details)
+            antix_meta["job_id"] = job.job_id
+            antix_meta["stream_id"] = job.stream_id
+            antix_meta["audio_id"] = job.audio_id
+            self._persist(job.job_id, {"antix": antix_meta, "result": result})
+
+            job.status = "done"
+            job.stage = "done"
+            job.progress = 1.0
+        except Exception as e:
+            job.status = "failed"
+            job.stage = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            _remove_quietly(job.upload_path)
+        finally:
+            job.finished = time.time()
+
+    def _persist(self, job_id: str, response_obj: Dict) -> None:
+        os.makedirs(self.result_dir, exist_ok=True)
+        path = self.result_path(job_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(response_obj, f)
+        os.replace(tmp_path, path)  # readers never see a half-written result
+
+    def cleanup(self, now: float) -> None:
+        """
+        Forgets finished jobs and deletes result files older than the TTL.
+        """
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished is not None and now - job.finished > self.ttl_seconds
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            pending_uploads = {job.upload_path for job in self._jobs.values()}
+
+        # Uploads no job refers to (left over from a previous run)
+        if os.path.isdir(self.upload_dir):
+            for name in os.listdir(self.upload_dir):
+                path = os.path.join(self.upload_dir, name)
+                if path not in pending_uploads:
+                    _remove_quietly(path)
+
+        if not os.path.isdir(self.result_dir):
+            return
+        for name in os.listdir(self.result_dir):
+            path = os.path.join(self.result_dir, name)
+            if not os.path.isfile(path):
+                continue
+            try:
+                if now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+            except OSError:
+                pass
 
-        # Nothing to display for this segment timing-wise
-        if not text or seg_duration <= 0:
-            seg["antix"] = {
-                "filtered": reason,
-                "filtered_bin": f"0b{reason:05b}",
-                "wrapped_text": []
-            }
-            prev_seg_end = seg_end
-            continue
 
-        if enable_caps:
-            text = text.upper()
+job_queue = JobQueue(
+    BASE_CONFIG["job_workers"],
+    BASE_CONFIG["job_queue_size"],
+    JOBS_DIR,
+    float(BASE_CONFIG["job_result_ttl_seconds"])
+)
 
-        # Internal gap-based silence detection:
-        # If there's a gap >= threshold from previous segment, the FIRST line of this segment is single-line.
-        if idx > 0 and prev_seg_end is not None:
-            gap = seg_start - prev_seg_end
-            if gap >= silence_threshold:
-                next_segment_force_single_line = True
 
-        segment_force_single_line = next_segment_force_single_line
+# ----------------------------------------------------------------------
+# Flask app + endpoints
+# ----------------------------------------------------------------------
+app = Flask(__name__)
+app.config["UPLOAD_FOLDER"] = tempfile.gettempdir()
 
-        # Split into single lines respecting wrap_length
-        lines = split_text_to_lines(text, max_chars=wrap_length)
 
-        # Proportionally distribute segment time across lines by character count (excluding spaces)
-        char_counts = [len(line.replace(" ", "")) for line in lines]
-        total_chars = sum(char_counts) or 1
-        current_time = seg_start
+@app.before_request
+def start_request_timer():
+    g.request_t0 = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    if endpoint != "metrics_endpoint":
+        # Set by the handlers once the parameters parse; reading request.form here
+        # would parse the multipart body of requests rejected before that
+        model = getattr(g, "metrics_model", "unknown")
+        if model != "unknown" and model not in available_models:
+            # Client-supplied text never becomes a label value (unbounded series)
+            model = "invalid"
+        metrics.inc(
+            "aics_requests_total",
+            (("endpoint", endpoint), ("model", model), ("status", str(response.status_code)))
+        )
+        t0 = getattr(g, "request_t0", None)
+        if t0 is not None:
+            metrics.observe("aics_request_seconds", time.perf_counter() - t0, (("endpoint", endpoint),))
+    return response
 
-        wrapped_entries: List[Dict] = []
-        first_line_in_segment = True
 
-        for line, chars in zip(lines, char_counts):
-            if not line:
-                continue
+# Per-segment keys kept when the raw Whisper result is excluded
+CAPTION_SEGMENT_KEYS = ("id", "start", "end", "antix")
 
-            duration = seg_duration * (chars / total_chars)
-            line_start = current_time
-            line_end = current_time + duration
-            current_time = line_end
 
-            # Decide whether this line should be single-line or N-line scrolling
-            if first_line_in_segment and segment_force_single_line:
-                # Single-line mode (bottom-aligned)
-                block_text = "\n" + line
-                segment_force_single_line = False
-                if not chunk_state_silent:
-                    active_state.is_first_caption = False
-            else:
-                # N-line scrolling: include up to max_caption_lines-1 previous lines + current line
-                if max_caption_lines > 1 and active_state.last_lines:
-                    history = active_state.last_lines[-(max_caption_lines - 1):]
-                    lines_to_show = history + [line]
-                    block_text = "\n".join(lines_to_show)
-                else:
-                    block_text = "\n" + line
+def select_response_fields(result: Dict, exclude: str) -> Dict:
+    """
+    Drops the fields named in `exclude` from a transcription result (in place):
+    tokens / words per segment, or with 'result' everything but the caption
+    fields (id, start, end, antix.wrapped_text...) and the language.
+    """
+    if not exclude:
+        return result
+    names = set(exclude.split(","))
+    if "result" in names:
+        result.pop("text", None)
+        result["segments"] = [
+            {key: seg[key] for key in CAPTION_SEGMENT_KEYS if key in seg}
+            for seg in result.get("segments", [])
+        ]
+        return result
+    for seg in result.get("segments", []):
+        if "tokens" in names:
+            seg.pop("tokens", None)
+        if "words" in names:
+            seg.pop("words", None)
+    return result
+
+
+def json_bytes(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def stream_json_response(response_obj: Dict):
+    """
+    Yields {"antix": ..., "result": {..., "segments": [...]}} piece by piece,
+    one segment per chunk, so the full document never exists as one string.
+    """
+    with timed_stage("serialize"):
+        result = response_obj["result"]
+        yield b'{"antix":' + json_bytes(response_obj["antix"]) + b',"result":{'
+        for key, value in result.items():
+            if key != "segments":
+                yield json_bytes(key) + b":" + json_bytes(value) + b","
+        yield b'"segments":['
+        for i, seg in enumerate(result.get("segments", [])):
+            yield (b"," if i else b"") + json_bytes(seg)
+        yield b"]}}"
 
-                if not chunk_state_silent:
-                    active_state.is_first_caption = False
 
-            wrapped_entries.append({
-                "text": block_text,
-                "start": line_start,
-                "end": line_end
-            })
+# ----------------------------------------------------------------------
+# Compact caption responses for inserters (negotiated, schema-versioned)
+# ----------------------------------------------------------------------
+CAPTIONS_SCHEMA_VERSION = 1
+CAPTIONS_BINARY_MIMETYPE = "application/vnd.antix.captions"
+CAPTIONS_MSGPACK_MIMETYPE = "application/vnd.antix.captions+msgpack"
+CAPTIONS_BINARY_MAGIC = b"AXC"
+MSGPACK_MIMETYPES = (CAPTIONS_MSGPACK_MIMETYPE, "application/msgpack", "application/x-msgpack")
 
-            # Update scrolling state only if this is not a VAD-silence chunk
-            if not chunk_state_silent:
-                if max_caption_lines > 1:
-                    active_state.last_lines.append(line)
-                    if len(active_state.last_lines) > (max_caption_lines - 1):
-                        active_state.last_lines = active_state.last_lines[-(max_caption_lines - 1):]
-                    active_state.last_line = active_state.last_lines[-1]
-                else:
-                    # max_caption_lines == 1 → only keep the most recent line
-                    active_state.last_lines = []
-                    active_state.last_line = line
+RESPONSE_FORMATS = ("json", "msgpack", "binary")
 
-            first_line_in_segment = False
 
-        # After first segment in the chunk is processed, subsequent segments
-        # will only use internal-gap silence rules (set at the top of loop)
-        next_segment_force_single_line = False
+def negotiate_response_format(form, accept) -> str:
+    """
+    'format' form field wins; otherwise the Accept header picks among the formats
+    this build can produce (msgpack only when the package is installed). Default json.
+    """
+    requested = form.get("format")
+    if requested:
+        if requested not in RESPONSE_FORMATS:
+            raise ValueError(f"Invalid value for format (must be one of {', '.join(RESPONSE_FORMATS)})")
+        if requested == "msgpack" and msgpack is None:
+            raise ValueError("format 'msgpack' is not available (msgpack package not installed)")
+        return requested
+
+    offered = ["application/json", CAPTIONS_BINARY_MIMETYPE]
+    if msgpack is not None:
+        offered += list(MSGPACK_MIMETYPES)
+    best = accept.best_match(offered, default="application/json")
+    if best == CAPTIONS_BINARY_MIMETYPE:
+        return "binary"
+    if best in MSGPACK_MIMETYPES:
+        return "msgpack"
+    return "json"
+
+
+def caption_entries(result: Dict):
+    """
+    (text, start_ms, end_ms, filtered) for every wrapped_text entry, in order.
+    """
+    for seg in result.get("segments", []):
+        antix = seg.get("antix") or {}
+        filtered = int(antix.get("filtered", 0))
+        for entry in antix.get("wrapped_text", []):
+            yield (
+                entry["text"],
+                max(int(round(entry["start"] * 1000)), 0),
+                max(int(round(entry["end"] * 1000)), 0),
+                filtered
+            )
+
+
+def encode_captions_msgpack(result: Dict, stream_id: str, audio_id: str) -> bytes:
+    return msgpack.packb({
+        "v": CAPTIONS_SCHEMA_VERSION,
+        "stream_id": stream_id,
+        "audio_id": audio_id,
+        "captions": [list(entry) for entry in caption_entries(result)]
+    })
 
-        seg["antix"] = {
-            "filtered": reason,
-            "filtered_bin": f"0b{reason:05b}",
-            "wrapped_text": wrapped_entries
-        }
 
-        prev_seg_end = seg_end
+def _utf8_prefix(text: str, max_bytes: int = 0xFFFF) -> bytes:
+    # Cut on a character boundary: a split multi-byte sequence would not decode
+    return text.encode("utf-8")[:max_bytes].decode("utf-8", "ignore").encode("utf-8")
 
-    # Propagate state changes:
-    if chunk_state_silent:
-        # Do NOT propagate last_lines / is_first_caption from this chunk,
-        # but let next chunk know that we ended with silence.
-        state.prev_chunk_ended_with_silence = True
-        state.last_lines = []
-        state.last_line = ""
-    else:
-        # active_state is 'state' itself in this branch, so we just update trailing_silence.
-        state.prev_chunk_ended_with_silence = trailing_silence
 
-    if not chunk_state_silent:
-        state.last_lines = list(active_state.last_lines)
-        state.last_line = active_state.last_line
-        state.is_first_caption = active_state.is_first_caption
+def encode_captions_binary(result: Dict, stream_id: str, audio_id: str) -> bytes:
+    """
+    Length-prefixed little-endian layout, schema v1:
+      "AXC" u8 version
+      u16 len + stream_id (utf-8), u16 len + audio_id (utf-8)
+      u32 entry count, then per entry:
+        u32 start_ms, u32 end_ms, u8 filtered bits, u16 len + text (utf-8)
+    Strings longer than 65535 bytes are cut at the last whole character.
+    """
+    parts = [CAPTIONS_BINARY_MAGIC, struct.pack("<B", CAPTIONS_SCHEMA_VERSION)]
+    for ident in (stream_id, audio_id):
+        raw = _utf8_prefix(ident)
+        parts.append(struct.pack("<H", len(raw)) + raw)
 
+    entries = []
+    for text, start_ms, end_ms, filtered in caption_entries(result):
+        raw = _utf8_prefix(text)
+        entries.append(struct.pack("<IIBH", start_ms, end_ms, filtered & 0xFF, len(raw)) + raw)
+    parts.append(struct.pack("<I", len(entries)))
+    parts.extend(entries)
+    return b"".join(parts)
 
-# ----------------------------------------------------------------------
-# Flask app + endpoints
-# ----------------------------------------------------------------------
-app = Flask(__name__)
-app.config["UPLOAD_FOLDER"] = tempfile.gettempdir()
+
+def receive_upload(file, in_memory: bool):
+    """
+    Upload stage (server thread): in-memory mode reads request.files["audio"].stream
+    directly and returns the bytes; otherwise the legacy temp-file path is used
+    and its path is returned.
+    """
+    if in_memory:
+        with timed_stage("upload"):
+            data = file.stream.read()
+        metrics.inc("aics_audio_bytes_total", value=len(data))
+        return data
+
+    temp_file_path = os.path.join(
+        app.config["UPLOAD_FOLDER"],
+        next(tempfile._get_candidate_names()) + ".wav"
+    )
+    with timed_stage("upload"):
+        file.save(temp_file_path)
+    metrics.inc("aics_audio_bytes_total", value=os.path.getsize(temp_file_path))
+    return temp_file_path
+
+
+def decode_upload(upload, filename: str = "", mimetype: str = "") -> np.ndarray:
+    """
+    Decode stage: receive_upload() output → the shared 16 kHz buffer.
+    A temp file is always removed.
+    """
+    with timed_stage("decode"):
+        if isinstance(upload, bytes):
+            return decode_audio_bytes(upload, filename, mimetype)
+        try:
+            return decode_audio(upload)
+        finally:
+            os.remove(upload)
+
+
+def read_upload(file, in_memory: bool) -> np.ndarray:
+    """
+    Turns the uploaded FileStorage into the shared 16 kHz buffer, on the calling thread.
+    """
+    return decode_upload(receive_upload(file, in_memory), file.filename, file.mimetype)
+
+
+def prepare_upload(upload, filename: str, mimetype: str, parameters: Dict) -> AudioAnalysis:
+    """
+    cpu_stage work for /transcribe: decode + duration + VAD.
+    """
+    return AudioAnalysis(decode_upload(upload, filename, mimetype), parameters)
 
 
 @app.route("/version", methods=["GET"])
@@ -504,6 +3614,53 @@ def get_model_name():
     return jsonify({"model": last_used_model, "device": device})
 
 
+@app.route("/model_pool", methods=["GET"])
+def get_model_pool():
+    """
+    In worker mode the models live in the inference processes, so the front end's
+    own pool is empty; the per-worker status is reported under "inference_workers".
+    """
+    status = model_pool.status()
+    status["inference_workers"] = inference_workers.status() if inference_workers is not None else None
+    return jsonify(status)
+
+
+@app.route("/result_cache", methods=["GET"])
+def get_result_cache():
+    return jsonify(result_cache.status())
+
+
+@app.route("/reload_config", methods=["POST"])
+def reload_config_endpoint():
+    report = reload_config()
+    return jsonify(report), (200 if report["reloaded"] else 400)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    pool = model_pool.status()
+    active_streams = len(stream_states)
+    with ingest_sessions_lock:
+        open_sessions = len(ingest_sessions)
+
+    gauges = [
+        ("aics_active_streams", (), active_streams),
+        ("aics_ingest_sessions", (), open_sessions),
+        ("aics_model_pool_budget_bytes", (), pool["budget_bytes"]),
+        ("aics_job_queue_depth", (), job_queue.depth()),
+        ("aics_pipeline_queue_depth", (("stage", cpu_stage.name),), cpu_stage.depth()),
+        ("aics_pipeline_queue_depth", (("stage", post_stage.name),), post_stage.depth()),
+    ]
+    for m in pool["models"]:
+        gauges.append(("aics_model_resident_bytes", (("model", m["name"]),), m["bytes"]))
+        gauges.append(("aics_model_replicas_busy", (("model", m["name"]),), m["busy"]))
+
+    return app.response_class(
+        response=metrics.render(gauges),
+        mimetype="text/plain; version=0.0.4"
+    )
+
+
 @app.route("/transcribe", methods=["POST"])
 def transcribe():
     start = time.time()
@@ -514,76 +3671,19 @@ def transcribe():
     if file.filename == "":
         return jsonify({"error": "No selected file"}), 400
 
-    temp_file_path = os.path.join(
-        app.config["UPLOAD_FOLDER"],
-        next(tempfile._get_candidate_names()) + ".wav"
-    )
-    file.save(temp_file_path)
-
-    # Start with global BASE_CONFIG for this request
-    parameters: Dict = BASE_CONFIG.copy()
-
     try:
-        # --------------------------
-        # MODEL NAME
-        # --------------------------
-        if "model" in request.form:
-            parameters["model"] = request.form.get("model", parameters["model"])
-        model_name = parameters["model"]
+        # Start from the base config or this stream's profile, then the sent fields
+        parameters: Dict = request_base_parameters(
+            request.form,
+            request.form.get("stream_id") or request.form.get("id") or request.form.get("request_id")
+        )
+        apply_request_parameters(parameters, request.form)
+        model_name = g.metrics_model = parameters["model"]
         global last_used_model
         last_used_model = model_name
-        model = get_model(model_name)
-
-        # --------------------------
-        # NUMERIC PARAMETERS
-        # --------------------------
-        if "avg_logprob_threshold" in request.form:
-            parameters["avg_logprob_threshold"] = float(request.form["avg_logprob_threshold"])
-
-        if "compression_ratio_threshold" in request.form:
-            parameters["compression_ratio_threshold"] = float(request.form["compression_ratio_threshold"])
-
-        if "no_speech_prob_threshold" in request.form:
-            parameters["no_speech_prob_threshold"] = float(request.form["no_speech_prob_threshold"])
-
-        if "temperature" in request.form:
-            parameters["temperature"] = float(request.form["temperature"])
-
-        if "vad_aggressiveness" in request.form:
-            parameters["vad_aggressiveness"] = int(request.form["vad_aggressiveness"])
-
-        if "vad_voice_ratio_threshold" in request.form:
-            parameters["vad_voice_ratio_threshold"] = float(request.form["vad_voice_ratio_threshold"])
-
-        if "min_text_length" in request.form:
-            parameters["min_text_length"] = int(request.form["min_text_length"])
-
-        if "wrap_length" in request.form:
-            parameters["wrap_length"] = int(request.form["wrap_length"])
-
-        if "silence_threshold" in request.form:
-            parameters["silence_threshold"] = float(request.form["silence_threshold"])
-
-        if "max_caption_lines" in request.form:
-            parameters["max_caption_lines"] = int(request.form["max_caption_lines"])
-
-        # --------------------------
-        # BOOLEAN PARAMETERS
-        # --------------------------
-        if "enable_filtering" in request.form:
-            parameters["enable_filtering"] = parse_bool(request.form["enable_filtering"], "enable_filtering")
-
-        if "enable_caps" in request.form:
-            parameters["enable_caps"] = parse_bool(request.form["enable_caps"], "enable_caps")
-
-        if "enable_vad" in request.form:
-            parameters["enable_vad"] = parse_bool(request.form["enable_vad"], "enable_vad")
-
-        if "pretty_json" in request.form:
-            parameters["pretty_json"] = parse_bool(request.form["pretty_json"], "pretty_json")
-
+        ensure_model(model_name)
+        response_format = negotiate_response_format(request.form, request.accept_mimetypes)
     except ValueError as e:
-        os.remove(temp_file_path)
         return jsonify({"error": f"Invalid parameter value: {e}"}), 400
 
     # ------------------------------------------------------------------
@@ -605,7 +3705,6 @@ def transcribe():
 
     # Validate new mode
     if not use_legacy and (not stream_id or not audio_id):
-        os.remove(temp_file_path)
         return jsonify({
             "error": "Missing identifiers. Send 'id' (legacy) OR both 'stream_id' and 'audio_id'."
         }), 400
@@ -614,88 +3713,103 @@ def transcribe():
 
     t0 = time.time()
 
-    # VAD check (chunk-level)
-    is_vad_silence = parameters["enable_vad"] and not is_voice_present(
-        temp_file_path,
-        parameters["vad_aggressiveness"],
-        parameters["vad_voice_ratio_threshold"]
-    )
-
-    # Transcription
-    with model_lock:
-        result = model.transcribe(temp_file_path, temperature=parameters["temperature"])
-
-    # Duration for silence rules
-    audio_duration = get_audio_duration_seconds(temp_file_path)
-
-    # Apply scrolling captions logic + antix fields
-    segments = result.get("segments", [])
-    process_segments_with_scrolling_captions(
-        segments=segments,
-        audio_duration=audio_duration,
-        parameters=parameters,
-        is_vad_silence=is_vad_silence,
-        stream_id=stream_id
-    )
-
-    end = time.time()
+    # Single decode stage: one 16 kHz mono buffer shared by VAD, Whisper and duration.
+    # Decode + VAD take a cpu_stage slot, overlapping other requests' inference.
+    upload = receive_upload(file, parameters["in_memory_ingest"])
+    try:
+        analysis = cpu_stage.run(prepare_upload, upload, file.filename, file.mimetype, parameters)
+    except RuntimeError as e:
+        return jsonify({"error": f"Could not decode audio: {e}"}), 400
 
-    # Build antix metadata (this is also what we log)
-    antix_meta = {
-        "api_ver": APP_VERSION,
-        "whisper_ver": whisper.version.__version__,
-        "model": model_name,
-        "device": device,
-        "response_time": round(end - start, 3),
+    # Inference on this thread: it waits for a replica / batch slot either way
+    result, details = infer_audio(analysis, parameters, stream_id, started=g.request_t0)
+    analysis.audio = None  # the PCM is not needed past inference
 
-        # FULL PARAMETER VISIBILITY
-        "enable_filtering": parameters["enable_filtering"],
-        "enable_caps": parameters["enable_caps"],
-        "enable_vad": parameters["enable_vad"],
-        "pretty_json": parameters["pretty_json"],
+    def finish():
+        # post_stage work: caption layout, metadata, logging and serialization
+        layout_captions(result, analysis, parameters, stream_id)
 
-        "silence_threshold": parameters["silence_threshold"],
-        "wrap_length": parameters["wrap_length"],
-        "max_caption_lines": parameters["max_caption_lines"],
+        end = time.time()
 
-        # Whisper decoding params
-        "temperature": parameters["temperature"],
-        "avg_logprob_threshold": parameters["avg_logprob_threshold"],
-        "compression_ratio_threshold": parameters["compression_ratio_threshold"],
-        "no_speech_prob_threshold": parameters["no_speech_prob_threshold"],
-        "vad_aggressiveness": parameters["vad_aggressiveness"],
-        "vad_voice_ratio_threshold": parameters["vad_voice_ratio_threshold"],
-        "min_text_length": parameters["min_text_length"]
-    }
+        # Build antix metadata (this is also what we log)
+        antix_meta = build_antix_meta(parameters, end - start, details)
 
-    if use_legacy:
-        antix_meta["id"] = transcription_id
-    else:
-        antix_meta["stream_id"] = stream_id
-        antix_meta["audio_id"] = audio_id
+        if use_legacy:
+            antix_meta["id"] = transcription_id
+        else:
+            antix_meta["stream_id"] = stream_id
+            antix_meta["audio_id"] = audio_id
+
+        # Logging: show IDs exactly as they appear in JSON (via antix_meta).
+        # Queued for the log writer thread; the request never waits on console / file I/O.
+        logger.info("transcribe", extra={"fields": {
+            "antix": antix_meta,
+            "transcribe_time": round(end - t0, 3),
+            "response_time": round(end - start, 3)
+        }})
+
+        # Compact caption formats: wrapped_text entries only
+        if response_format != "json":
+            with timed_stage("serialize"):
+                if response_format == "msgpack":
+                    body = encode_captions_msgpack(result, stream_id, audio_id)
+                    mimetype = CAPTIONS_MSGPACK_MIMETYPE
+                else:
+                    body = encode_captions_binary(result, stream_id, audio_id)
+                    mimetype = CAPTIONS_BINARY_MIMETYPE
+                response = app.response_class(response=body, mimetype=mimetype)
+                response.headers["X-Antix-Schema"] = str(CAPTIONS_SCHEMA_VERSION)
+                response.headers["Vary"] = "Accept"
+                return response
+
+        # Build response
+        response_obj = {
+            "antix": antix_meta,
+            "result": select_response_fields(result, parameters["exclude"])
+        }
 
-    # Logging: show IDs exactly as they appear in JSON (via antix_meta)
-    print("ANTIX META:", antix_meta)
-    print("Whisper Transcribe time:", end - t0)
-    print("Total Response time:", end - start)
+        # stream_response wins over pretty_json (often on in config.json for debugging)
+        if parameters["stream_response"]:
+            # The body is generated after finish() returns its slot; take one again for it
+            return app.response_class(post_stage.stream(stream_json_response(response_obj)), mimetype="application/json")
 
-    os.remove(temp_file_path)
+        with timed_stage("serialize"):
+            if parameters["pretty_json"]:
+                return app.response_class(
+                    response=json.dumps(response_obj, indent=2),
+                    mimetype="application/json"
+                )
+            else:
+                return app.json.response(response_obj)  # jsonify() without needing the app context
 
-    # Build response
-    response_obj = {
-        "antix": antix_meta,
-        "result": result
-    }
+    return post_stage.run(finish)
 
-    pretty = parameters.get("pretty_json", False)
 
-    if pretty:
-        return app.response_class(
-            response=json.dumps(response_obj, indent=2),
-            mimetype="application/json"
-        )
-    else:
-        return jsonify(response_obj)
+@app.route("/vad", methods=["POST"])
+def vad_compare():
+    """
+    Runs BOTH VAD engines on an uploaded file and returns per-engine ratio and
+    speech regions plus frame-level agreement, so "energy" can be checked
+    against the webrtcvad reference on real material.
+    """
+    if "audio" not in request.files:
+        return jsonify({"error": "No audio file part in the request"}), 400
+    try:
+        aggressiveness = int(request.form.get("vad_aggressiveness", BASE_CONFIG["vad_aggressiveness"]))
+        audio = read_upload(request.files["audio"], BASE_CONFIG["in_memory_ingest"])
+    except (ValueError, RuntimeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    results = {engine: run_vad(audio, aggressiveness, engine=engine) for engine in VAD_ENGINES}
+    reference = results["webrtc"].voiced
+    response = {}
+    for engine, res in results.items():
+        response[engine] = {
+            "voice_ratio": round(res.voice_ratio(), 4),
+            "speech_regions": res.speech_regions(),
+            "agreement": round(float(np.mean(res.voiced == reference)) if len(reference) else 1.0, 4)
+        }
+    return jsonify(response)
 
 
 @app.route("/health", methods=["GET"])
@@ -709,16 +3823,163 @@ def reset_stream():
     if not sid:
         return jsonify({"error": "stream_id required"}), 400
 
-    with stream_states_lock:
-        if sid in stream_states:
-            del stream_states[sid]
-            return jsonify({"status": "reset", "stream_id": sid})
-        else:
-            return jsonify({"status": "not_found", "stream_id": sid})
+    if stream_states.pop(sid, None) is not None:
+        return jsonify({"status": "reset", "stream_id": sid})
+    else:
+        return jsonify({"status": "not_found", "stream_id": sid})
 
 
-STREAM_TTL_SECONDS = 300   # Auto-delete after 5 minutes inactivity
-MAX_STREAMS = 100          # Keep only last 100 active streams
+@app.route("/stream/<stream_id>/audio", methods=["POST"])
+def stream_audio(stream_id):
+    """
+    Appends raw 16 kHz mono s16le PCM (request body, no multipart) to the stream.
+    Query args accept the same parameters as /transcribe; they are read when the
+    session is opened by the first push.
+    """
+    with ingest_sessions_lock:
+        session = ingest_sessions.get(stream_id)
+
+    if session is None or session.closed:
+        try:
+            parameters: Dict = request_base_parameters(request.args, stream_id)
+            apply_request_parameters(parameters, request.args)
+            g.metrics_model = parameters["model"]
+            ensure_model(parameters["model"])
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter value: {e}"}), 400
+
+        with ingest_sessions_lock:
+            session = ingest_sessions.get(stream_id)
+            if session is None or session.closed:
+                session = StreamIngestSession(stream_id, parameters)
+                ingest_sessions[stream_id] = session
+
+    session.push(request.get_data(cache=False))
+    return jsonify({
+        "status": "ok",
+        "stream_id": stream_id,
+        "stream_time": round(session.buffer_start + len(session.buffer) / 2.0 / SAMPLE_RATE, 3)
+    })
+
+
+@app.route("/stream/<stream_id>/captions", methods=["GET"])
+def stream_captions(stream_id):
+    """
+    Chunked NDJSON feed of caption blocks for the stream, pushed as they are produced.
+    """
+    with ingest_sessions_lock:
+        session = ingest_sessions.get(stream_id)
+    if session is None:
+        return jsonify({"error": "unknown stream_id", "stream_id": stream_id}), 404
+
+    keepalive = float(request.args.get("keepalive", 15))
+
+    def generate():
+        while True:
+            try:
+                event = session.events.get(timeout=keepalive)
+            except queue.Empty:
+                if session.closed and session.segments.empty():
+                    return
+                yield json.dumps({"type": "keepalive"}) + "\n"
+                continue
+            yield json.dumps(event) + "\n"
+            if event["type"] == "end":
+                with ingest_sessions_lock:
+                    if ingest_sessions.get(stream_id) is session:
+                        del ingest_sessions[stream_id]
+                return
+
+    return app.response_class(generate(), mimetype="application/x-ndjson")
+
+
+@app.route("/stream/<stream_id>/close", methods=["POST"])
+def stream_close(stream_id):
+    with ingest_sessions_lock:
+        session = ingest_sessions.get(stream_id)
+    if session is None:
+        return jsonify({"status": "not_found", "stream_id": stream_id})
+    # Flushes the tail; the session is dropped once its /captions feed sees "end"
+    session.close()
+    return jsonify({"status": "closed", "stream_id": stream_id})
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Async variant of /transcribe for long files: returns a job id right away.
+    Accepts the same form fields, plus optional 'priority' (lower runs first).
+    """
+    if "audio" not in request.files:
+        return jsonify({"error": "No audio file part in the request"}), 400
+    file = request.files["audio"]
+    if file.filename == "":
+        return jsonify({"error": "No selected file"}), 400
+
+    try:
+        parameters: Dict = request_base_parameters(request.form, request.form.get("stream_id"))
+        apply_request_parameters(parameters, request.form)
+        g.metrics_model = parameters["model"]
+        ensure_model(parameters["model"])
+        priority = int(request.form.get("priority", JOB_DEFAULT_PRIORITY))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter value: {e}"}), 400
+
+    job = TranscriptionJob(
+        upload_path=job_queue.spool_upload(file),
+        filename=file.filename,
+        mimetype=file.mimetype,
+        parameters=parameters,
+        stream_id=request.form.get("stream_id"),
+        audio_id=request.form.get("audio_id") or request.form.get("id"),
+        priority=priority
+    )
+    if not job_queue.submit(job):
+        _remove_quietly(job.upload_path)
+        return jsonify({"error": "Job queue is full, retry later"}), 503
+
+    return jsonify({
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.job_id}",
+        "result_url": f"/jobs/{job.job_id}/result"
+    }), 202
+
+
+def _valid_job_id(job_id: str) -> bool:
+    return len(job_id) == 32 and all(c in "0123456789abcdef" for c in job_id)
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    if not _valid_job_id(job_id):
+        return jsonify({"error": "invalid job id"}), 400
+
+    job = job_queue.get(job_id)
+    if job is not None:
+        return jsonify(job.to_status())
+    # Finished before a restart: only the persisted result is left
+    if os.path.isfile(job_queue.result_path(job_id)):
+        return jsonify({"job_id": job_id, "status": "done", "stage": "done", "progress": 1.0})
+    return jsonify({"error": "unknown or expired job", "job_id": job_id}), 404
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    if not _valid_job_id(job_id):
+        return jsonify({"error": "invalid job id"}), 400
+
+    path = job_queue.result_path(job_id)
+    if os.path.isfile(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return app.response_class(response=f.read(), mimetype="application/json")
+
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job", "job_id": job_id}), 404
+    if job.status == "failed":
+        return jsonify(job.to_status()), 500
+    return jsonify(job.to_status()), 202
 
 
 # --------------------------------------------------------------
@@ -727,24 +3988,24 @@ MAX_STREAMS = 100          # Keep only last 100 active streams
 def cleanup_stream_states():
     while True:
         now = time.time()
-        with stream_states_lock:
-            # A) Remove expired streams
-            expired = [
-                sid for sid, st in stream_states.items()
-                if now - st.last_update > STREAM_TTL_SECONDS
+        # A) Remove expired streams (B, the max_streams cap, is enforced on insert)
+        stream_states.expire(now)
+
+        # C) Close / drop /stream ingest sessions nobody is pushing to anymore
+        with ingest_sessions_lock:
+            idle = [
+                sid for sid, sess in ingest_sessions.items()
+                if now - sess.last_activity > STREAM_TTL_SECONDS
             ]
-            for sid in expired:
-                del stream_states[sid]
-
-            # B) Enforce limit on number of streams
-            if len(stream_states) > MAX_STREAMS:
-                ordered = sorted(
-                    stream_states.items(),
-                    key=lambda x: x[1].last_update
-                )
-                excess = len(stream_states) - MAX_STREAMS
-                for sid, _ in ordered[:excess]:
-                    del stream_states[sid]
+            idle_sessions = [ingest_sessions.pop(sid) for sid in idle]
+        for sess in idle_sessions:
+            sess.close()
+
+        # D) Expire async job results
+        job_queue.cleanup(now)
+
+        # E) Bound the on-disk result cache
+        result_cache.prune_disk()
 
         time.sleep(10)  # run every 10 seconds
 
@@ -754,26 +4015,30 @@ threading.Thread(target=cleanup_stream_states, daemon=True).start()
 
 
 def warm_up(model):
-    import numpy as np
-    from scipy.io.wavfile import write
-    dummy_path = os.path.join(tempfile.gettempdir(), "dummy.wav")
-    sample_rate = 16000
-    samples = np.zeros(sample_rate, dtype=np.int16)
-    write(dummy_path, sample_rate, samples)
-    model.transcribe(dummy_path)
-    os.remove(dummy_path)
+    # One second of silence straight from memory: no dummy.wav, so several
+    # worker processes can warm up at the same time without sharing a file
+    model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
 
 
 if __name__ == "__main__":
-    print("Preloading Whisper model...")
-    model_cache["large-v3-turbo"] = whisper.load_model(
-        "large-v3-turbo",
-        device=device,
-        download_root=model_cache_dir
-    )
-    warm_up(model_cache["large-v3-turbo"])
-    print("Model is Ready to Use")
+    multiprocessing.freeze_support()  # worker processes in the PyInstaller EXE
+
+    if BASE_CONFIG["stream_state_snapshot_seconds"] > 0:
+        # Before warm-up: the first chunk after a restart must already see its stream's state
+        restored = stream_state_journal.restore()
+        logger.info("stream states restored", extra={"fields": {"streams": restored}})
+        stream_state_journal.start(float(BASE_CONFIG["stream_state_snapshot_seconds"]))
+
+    if BASE_CONFIG["inference_workers"] > 0:
+        logger.info("starting inference workers", extra={"fields": {"workers": BASE_CONFIG["inference_workers"]}})
+        inference_workers = InferenceWorkerPool(BASE_CONFIG["inference_workers"], BASE_CONFIG["model"])
+        inference_workers.start()
+    else:
+        logger.info("preloading whisper model", extra={"fields": {"model": BASE_CONFIG["model"]}})
+        for replica in model_pool.all_replicas(BASE_CONFIG["model"]):
+            warm_up(replica)
+    logger.info("Model is Ready to Use")
 
     from waitress import serve
 
-    serve(app, host="0.0.0.0", port=8001)
+    serve(app, host="0.0.0.0", port=8001, threads=max(int(BASE_CONFIG["server_threads"]), 1))
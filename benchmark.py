@@ -0,0 +1,357 @@
+"""
+Benchmark harness for the /transcribe pipeline.
+
+Drives an app.<version>.py Flask app in-process (Flask test client, no waitress,
+no network) with synthetic or recorded chunks at a configurable concurrency.
+Whisper is replaced by a stub model before the app is imported, so it runs on
+CPU with no model downloads; the stub "costs" --stub-rtf seconds per second of
+audio, so the numbers measure the service around the model, not the model.
+
+Reports p50/p95/p99 latency and throughput, plus per-stage timings
+(upload, decode, vad, inference, captions, serialize) for apps that expose
+the timed_stage hooks (1.6.2+). Older versions report end-to-end numbers only.
+
+run_benchmark works on the imported app module in place: it sets
+BASE_CONFIG["model"], replaces module.result_cache with an empty ResultCache
+(unless --result-cache) and adds a stage observer for the duration of the run.
+load_app also patches whisper.load_model for the whole process. Give each run
+a freshly loaded module rather than one that serves anything else.
+
+Examples:
+    python benchmark.py --app app.1.6.2.py --requests 200 --concurrency 4
+    python benchmark.py --app app.1.6.2.py --audio recordings/ --save-baseline
+    python benchmark.py --app app.1.6.2.py --compare 1.5.0
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import whisper
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(BASE_DIR, "benchmark_baselines")
+SAMPLE_RATE = 16000
+STUB_WORDS = ("the", "news", "at", "six", "weather", "tonight", "traffic", "update", "sports", "and")
+
+
+# ----------------------------------------------------------------------
+# Stub Whisper model
+# ----------------------------------------------------------------------
+class StubWhisperModel(torch.nn.Module):
+    """
+    Stands in for a loaded Whisper model: same transcribe() signature and result
+    shape (one segment per ~3 s of audio), deterministic text, no weights.
+    Accepts a float32 array (1.6.x) or a WAV path (1.4.x / 1.5.x).
+    """
+
+    def __init__(self, name: str, rtf: float) -> None:
+        super().__init__()
+        self.name = name
+        self.rtf = rtf
+        self.is_multilingual = not name.endswith(".en")
+
+    @property
+    def device(self):
+        return torch.device("cpu")
+
+    def transcribe(self, audio, **options) -> Dict:
+        if isinstance(audio, str):
+            with wave.open(audio, "rb") as wf:
+                duration = wf.getnframes() / float(wf.getframerate())
+        else:
+            duration = len(audio) / float(SAMPLE_RATE)
+
+        time.sleep(duration * self.rtf)
+
+        segments = []
+        start = 0.0
+        while start < duration:
+            end = min(start + 3.0, duration)
+            words = [STUB_WORDS[(len(segments) + i) % len(STUB_WORDS)] for i in range(8)]
+            segments.append({
+                "id": len(segments),
+                "seek": 0,
+                "start": round(start, 3),
+                "end": round(end, 3),
+                "text": " " + " ".join(words),
+                "tokens": list(range(8)),
+                "temperature": options.get("temperature", 0.0),
+                "avg_logprob": -0.3,
+                "compression_ratio": 1.2,
+                "no_speech_prob": 0.05
+            })
+            start = end
+        return {
+            "text": "".join(s["text"] for s in segments),
+            "segments": segments,
+            "language": "en"
+        }
+
+
+def load_app(app_path: str, rtf: float):
+    """
+    Imports the app module with whisper.load_model patched to the stub.
+    """
+    os.environ.setdefault("PROGRAMDATA", tempfile.mkdtemp(prefix="aics-bench-"))
+    whisper.load_model = lambda name, *args, **kwargs: StubWhisperModel(name, rtf)
+
+    spec = importlib.util.spec_from_file_location("bench_app", app_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ----------------------------------------------------------------------
+# Audio chunks
+# ----------------------------------------------------------------------
+def wav_bytes(pcm: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(pcm.astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+def synthetic_chunks(count: int, seconds: float, seed: int) -> List[bytes]:
+    """
+    Speech-like chunks: voiced harmonic bursts separated by short pauses,
+    plus low noise, so VAD sees both speech and silence.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    chunks = []
+    for _ in range(count):
+        f0 = rng.uniform(100, 220)
+        voiced = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+        envelope = (np.sin(2 * np.pi * rng.uniform(0.3, 0.8) * t + rng.uniform(0, np.pi)) > -0.2)
+        signal = 0.3 * voiced * envelope + 0.01 * rng.standard_normal(n)
+        chunks.append(wav_bytes(np.clip(signal, -1, 1) * 32767))
+    return chunks
+
+
+def recorded_chunks(path: str) -> List[bytes]:
+    files = [path]
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith((".wav", ".mp3", ".flac", ".ogg", ".m4a"))
+        )
+    chunks = []
+    for file_path in files:
+        with open(file_path, "rb") as f:
+            chunks.append(f.read())
+    if not chunks:
+        raise SystemExit(f"No audio files found in {path}")
+    return chunks
+
+
+# ----------------------------------------------------------------------
+# Run + report
+# ----------------------------------------------------------------------
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def summarize(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "mean_ms": round(float(np.mean(values)) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3)
+    }
+
+
+def run_benchmark(module, chunks: List[bytes], args) -> Dict:
+    stage_samples: Dict[str, List[float]] = {}
+    samples_lock = threading.Lock()
+
+    def observe(stage: str, seconds: float) -> None:
+        with samples_lock:
+            stage_samples.setdefault(stage, []).append(seconds)
+
+    has_stages = hasattr(module, "stage_observers")
+    if has_stages:
+        module.stage_observers.append(observe)
+    if hasattr(module, "BASE_CONFIG"):
+        module.BASE_CONFIG["model"] = args.model
+    if hasattr(module, "result_cache") and not args.result_cache:
+        # Chunks repeat across requests; measure real inference, not cache hits
+        module.result_cache = module.ResultCache(0)
+
+    local = threading.local()
+
+    def post(index: int) -> float:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = module.app.test_client()
+        data = {
+            "model": args.model,
+            "id": f"bench-{index}",
+            "audio": (io.BytesIO(chunks[index % len(chunks)]), f"chunk{index}.wav")
+        }
+        t0 = time.perf_counter()
+        response = client.post("/transcribe", data=data, content_type="multipart/form-data")
+        response.get_data()
+        elapsed = time.perf_counter() - t0
+        if response.status_code != 200:
+            raise RuntimeError(f"/transcribe returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return elapsed
+
+    # The app logs every request; keep the cost, drop the console output
+    devnull = open(os.devnull, "w")
+    for handler in getattr(getattr(module, "log_listener", None), "handlers", ()):
+        if type(handler) is logging.StreamHandler:
+            handler.setStream(devnull)
+
+    with devnull, contextlib.redirect_stdout(devnull):
+        # Warm-up: model load, first-call allocations; not measured
+        for i in range(min(args.warmup, len(chunks))):
+            post(i)
+        with samples_lock:
+            stage_samples.clear()
+
+        t_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            latencies = list(executor.map(post, range(args.requests)))
+        wall = time.perf_counter() - t_start
+
+    if has_stages:
+        module.stage_observers.remove(observe)
+
+    stage_order = getattr(module, "PIPELINE_STAGES", ())
+    return {
+        "version": getattr(module, "APP_VERSION", "unknown"),
+        "settings": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "chunk_seconds": args.chunk_seconds if not args.audio else None,
+            "audio": os.path.basename(os.path.normpath(args.audio)) if args.audio else "synthetic",
+            "stub_rtf": args.stub_rtf,
+            "model": args.model,
+            "result_cache": args.result_cache
+        },
+        "latency": summarize(latencies),
+        "throughput_rps": round(args.requests / wall, 3),
+        "wall_seconds": round(wall, 3),
+        "stages": {
+            stage: summarize(stage_samples[stage])
+            for stage in list(stage_order) + sorted(set(stage_samples) - set(stage_order))
+            if stage in stage_samples
+        }
+    }
+
+
+def print_report(report: Dict) -> None:
+    lat = report["latency"]
+    print(f"AICS /transcribe benchmark — app {report['version']}")
+    print(f"  settings: {json.dumps(report['settings'])}")
+    print(f"  latency ms: p50 {lat['p50_ms']}  p95 {lat['p95_ms']}  p99 {lat['p99_ms']}  mean {lat['mean_ms']}")
+    print(f"  throughput: {report['throughput_rps']} req/s  ({report['wall_seconds']} s wall)")
+    if report["stages"]:
+        print(f"  {'stage':<10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+        for stage, s in report["stages"].items():
+            print(f"  {stage:<10} {s['count']:>6} {s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9} {s['mean_ms']:>9}")
+    else:
+        print("  (no stage hooks in this app version; end-to-end numbers only)")
+
+
+def baseline_path(version: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{version}.json")
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> bool:
+    """
+    Prints deltas against a stored baseline; returns False on a regression
+    (p95 latency up or throughput down by more than `tolerance` percent).
+    """
+    def delta(new: float, old: float) -> float:
+        return (new - old) / old * 100.0 if old else 0.0
+
+    print(f"Compared with baseline {baseline['version']} ({json.dumps(baseline['settings'])}):")
+    if baseline["settings"] != report["settings"]:
+        print("  warning: settings differ from the baseline run")
+
+    ok = True
+    for key in ("p50_ms", "p95_ms", "p99_ms"):
+        d = delta(report["latency"][key], baseline["latency"][key])
+        print(f"  latency {key:<7} {baseline['latency'][key]:>9} → {report['latency'][key]:>9}  ({d:+.1f}%)")
+        if key == "p95_ms" and d > tolerance:
+            ok = False
+    d = delta(report["throughput_rps"], baseline["throughput_rps"])
+    print(f"  throughput      {baseline['throughput_rps']:>9} → {report['throughput_rps']:>9}  ({d:+.1f}%)")
+    if d < -tolerance:
+        ok = False
+
+    for stage, s in report["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if old:
+            print(f"  stage {stage:<10} p95 {old['p95_ms']:>9} → {s['p95_ms']:>9}  ({delta(s['p95_ms'], old['p95_ms']):+.1f}%)")
+
+    print("  result:", "OK" if ok else f"REGRESSION (> {tolerance}% worse)")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the /transcribe pipeline with a stub Whisper model.")
+    parser.add_argument("--app", default=os.path.join(BASE_DIR, "app.1.6.2.py"), help="app.<version>.py to benchmark")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--chunk-seconds", type=float, default=5.0, help="length of synthetic chunks")
+    parser.add_argument("--chunks", type=int, default=16, help="number of distinct synthetic chunks")
+    parser.add_argument("--audio", help="recorded chunk file or directory (used instead of synthetic chunks)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default="large-v3-turbo", help="model name sent with each request (stubbed)")
+    parser.add_argument("--stub-rtf", type=float, default=0.01, help="stub inference seconds per audio second")
+    parser.add_argument("--result-cache", action="store_true", help="keep the app's result cache on (1.6.2+)")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--save-baseline", action="store_true", help=f"store the report as {BASELINE_DIR}/<version>.json")
+    parser.add_argument("--compare", metavar="VERSION", help="compare against a stored baseline (e.g. 1.5.0)")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="allowed regression in percent for --compare")
+    args = parser.parse_args(argv)
+
+    chunks = recorded_chunks(args.audio) if args.audio else synthetic_chunks(args.chunks, args.chunk_seconds, args.seed)
+    module = load_app(args.app, args.stub_rtf)
+    report = run_benchmark(module, chunks, args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path(report["version"]), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print("Baseline saved:", baseline_path(report["version"]))
+
+    if args.compare:
+        path = baseline_path(args.compare)
+        if not os.path.exists(path):
+            print("No baseline stored for", args.compare)
+            return 2
+        with open(path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        return 0 if compare(report, baseline, args.tolerance) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Regenerates test_captions_golden.json for CaptionLayoutGoldenTest.
+
+The expected outputs must come from the ORIGINAL word-by-word caption layout,
+not from the current single-pass engine, so the reference module is passed in
+explicitly. Check out the app as it was before the layout rework (the parent
+of the commit titled "Rework caption layout into a single-pass wrap/timing
+engine"):
+
+    git show "$(git log -1 --format=%H --grep='Rework caption layout into a single-pass')^:app.1.6.2.py" > app_reference.py
+    python gen_captions_golden.py app_reference.py test_captions_golden.json
+
+Inputs are drawn from a fixed seed, so the same reference always gives the
+same file. The case count is kept small on purpose: every wrap length, line
+count and filter/caps/VAD combination still shows up, and the file stays
+reviewable.
+"""
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+
+# Importing the app creates its cache directories under %PROGRAMDATA%
+os.environ.setdefault("PROGRAMDATA", tempfile.mkdtemp(prefix="aics-golden-"))
+
+SEED = 1234
+NUM_CASES = 12
+
+# Accents, ligatures, dashes, numbers and words longer than any wrap length
+VOCAB = [
+    "the", "a", "news", "weather", "tonight", "straße", "café", "über", "I", "ok",
+    "internationalization", "antidisestablishmentarianism", "x", "we're", "3.5", "—", "ﬁne"
+]
+
+
+def make_text(rng: random.Random) -> str:
+    words = [rng.choice(VOCAB) for _ in range(rng.choice([0, 1, 2, 5, 9, 15, 30]))]
+    separator = rng.choice([" ", "  ", " \t", "\n "])
+    return rng.choice(["", " "]) + separator.join(words) + rng.choice(["", " ", "  "])
+
+
+def make_chunk(rng: random.Random) -> Dict:
+    duration = rng.choice([0.5, 1.0, 2.0, 3.0, 5.0, 10.0])
+    count = rng.choice([0, 1, 1, 2, 3, 6])
+    segments = []
+    t = rng.choice([0.0, 0.2, 1.0, 1.5])
+    for i in range(count):
+        length = rng.choice([0.0, 0.3, 0.8, 1.7, 2.5])
+        gap = rng.choice([0.0, 0.1, 1.0, 1.2])
+        segments.append({
+            "id": i,
+            "start": round(t, 3),
+            "end": round(t + length, 3),
+            "text": make_text(rng),
+            "avg_logprob": rng.choice([-0.2, -1.5]),
+            "compression_ratio": rng.choice([1.2, 3.0]),
+            "no_speech_prob": rng.choice([0.1, 0.9])
+        })
+        t += length + gap
+    ratios = [rng.choice([0.0, 0.05, 0.5, 1.0]) for _ in segments] if rng.random() < 0.5 else None
+    return {
+        "segments": segments,
+        "audio_duration": max(duration, t),
+        "is_vad_silence": rng.random() < 0.2,
+        "segment_voice_ratios": ratios
+    }
+
+
+def make_cases() -> List[Dict]:
+    rng = random.Random(SEED)
+    cases = []
+    for c in range(NUM_CASES):
+        parameters = {
+            "avg_logprob_threshold": -1.0,
+            "compression_ratio_threshold": 2.4,
+            "no_speech_prob_threshold": 0.6,
+            "min_text_length": 5,
+            "vad_voice_ratio_threshold": 0.1,
+            "wrap_length": rng.choice([5, 10, 16, 32, 42]),
+            "max_caption_lines": rng.choice([1, 2, 3, 4]),
+            "enable_caps": rng.random() < 0.6,
+            "enable_filtering": rng.random() < 0.5,
+            "silence_threshold": rng.choice([0.5, 1.0, 2.0])
+        }
+        chunks = []
+        for _ in range(rng.choice([1, 2, 4])):
+            chunk = make_chunk(rng)
+            # Now and then N changes between requests on the same stream
+            if rng.random() < 0.15:
+                chunk["max_caption_lines"] = rng.choice([1, 2, 5])
+            chunks.append(chunk)
+        cases.append({"name": f"case_{c:02d}", "parameters": parameters, "chunks": chunks})
+    return cases
+
+
+def run_case(module, case: Dict) -> Dict:
+    """
+    Same driver as CaptionLayoutGoldenTest.run_case, against `module`.
+    """
+    stream_id = "golden:" + case["name"]
+    module.stream_states.pop(stream_id, None)
+
+    outputs = []
+    for chunk in case["chunks"]:
+        parameters = dict(case["parameters"])
+        if "max_caption_lines" in chunk:
+            parameters["max_caption_lines"] = chunk["max_caption_lines"]
+        segments = json.loads(json.dumps(chunk["segments"]))
+        ratios = chunk["segment_voice_ratios"]
+        module.process_segments_with_scrolling_captions(
+            segments,
+            chunk["audio_duration"],
+            parameters,
+            chunk["is_vad_silence"],
+            stream_id,
+            None if ratios is None else np.array(ratios, dtype=np.float64)
+        )
+        outputs.append([seg.get("antix") for seg in segments])
+
+    state = module.stream_states.pop(stream_id)
+    return {
+        "outputs": outputs,
+        "state": {
+            "last_lines": list(state.last_lines),
+            "last_line": state.last_line,
+            "is_first_caption": state.is_first_caption,
+            "prev_chunk_ended_with_silence": state.prev_chunk_ended_with_silence
+        }
+    }
+
+
+def load_module(path: str):
+    spec = importlib.util.spec_from_file_location("aics_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) != 3:
+        print(__doc__)
+        return 2
+    reference = load_module(argv[1])
+    cases = make_cases()
+    for case in cases:
+        case["expected"] = run_case(reference, case)
+    with open(argv[2], "w", encoding="utf-8") as f:
+        json.dump(cases, f, ensure_ascii=False, indent=1)
+        f.write("\n")
+    print(f"wrote {len(cases)} cases to {argv[2]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -9,8 +9,89 @@ import threading
 import ctypes
 import shutil
 import winreg
+import json
 
-LOG_FILE = "logs.txt"
+# Folder of the GUI exe (or this script); the service lives under models/app
+BASE_DIR = os.path.dirname(os.path.abspath(sys.executable if getattr(sys, 'frozen', False) else __file__))
+
+LOG_READ_CHUNK = 256 * 1024  # max bytes read per poll, keeps the Tk loop responsive
+
+
+def service_data_path(*parts):
+    """
+    Path under %PROGRAMDATA%\\Antix Digital\\AICS Service, same layout as the service.
+    """
+    return os.path.join(os.environ.get("PROGRAMDATA", ""), "Antix Digital", "AICS Service", *parts)
+
+
+# Service config, in the service's own lookup order: next to app.exe, then ProgramData
+SERVICE_CONFIG_PATHS = (os.path.join(BASE_DIR, "models", "app", "config.json"), service_data_path("config.json"))
+# Written by the API service (JSON lines, rotated by size: aics.log, aics.log.1, ...)
+DEFAULT_SERVICE_LOG_FILE = service_data_path("logs", "aics.log")
+
+
+# (config mtimes, resolved log file): the log viewer asks every second
+_service_log_file_cache = [None, None]
+
+
+def _config_mtimes():
+    mtimes = []
+    for path in SERVICE_CONFIG_PATHS:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def service_log_file():
+    """
+    The log file the service writes: its config.json "log_file" key, or the default.
+    config.json is only parsed again when one of the candidate files changes.
+    """
+    mtimes = _config_mtimes()
+    if _service_log_file_cache[0] != mtimes:
+        _service_log_file_cache[:] = [mtimes, _read_service_log_file()]
+    return _service_log_file_cache[1]
+
+
+def _read_service_log_file():
+    for path in SERVICE_CONFIG_PATHS:
+        if not os.path.isfile(path):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if isinstance(data, dict):
+            log_file = data.get("log_file")
+            return log_file if isinstance(log_file, str) and log_file else DEFAULT_SERVICE_LOG_FILE
+    return DEFAULT_SERVICE_LOG_FILE
+
+
+def format_log_line(line):
+    """
+    Turns one JSON log record into a readable line; anything else is shown as-is.
+    """
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return line + "\n"
+    if not isinstance(entry, dict):
+        return line + "\n"
+
+    text = f"[{entry.get('time', '')}] {entry.get('level', '')} {entry.get('msg', '')}"
+    antix = entry.get("antix")
+    if isinstance(antix, dict):
+        ids = antix.get("id") or f"{antix.get('stream_id')}/{antix.get('audio_id')}"
+        text += f" id={ids} model={antix.get('model')}"
+    for key, value in entry.items():
+        if key not in ("ts", "time", "level", "msg", "antix") and not isinstance(value, (dict, list)):
+            text += f" {key}={value}"
+    if entry.get("exc"):
+        text += "\n" + entry["exc"]
+    return text + "\n"
 
 class LogViewerApp:
 
@@ -22,28 +103,12 @@ class LogViewerApp:
 
 
     def __init__(self, root):
-        os.chdir(os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__))
+        os.chdir(BASE_DIR)
         # marker = os.path.join(os.path.dirname(__file__), "post_install_done.flag")
         # if not os.path.exists(marker):
         #     self.run_post_install()
         #     with open(marker, "w") as f:
         #         f.write("done")
-        # Reset log file on start
-        if os.path.exists(LOG_FILE):
-            try:
-                os.remove(LOG_FILE)
-                #self.log_gui("🧹 Previous log file deleted.\n")
-            except Exception as e:
-                print(f"❌ Failed to delete old log file: {e}\n")
-        # Create new empty log file
-        try:
-            with open(LOG_FILE, "w", encoding="utf-8") as f:
-                f.write("")  # Create empty file
-            #self.log_gui("📄 New log file created.\n")
-        except Exception as e:
-            #self.log_gui(f"❌ Failed to create new log file: {e}\n")
-            print(f"❌ Failed to create new log file: {e}\n")
-       
         self.install_ffmpeg()
 
 
@@ -266,23 +331,64 @@ class LogViewerApp:
         self.install_requirements(python_path)
 
     def update_logs(self):
-        if not hasattr(self, 'last_log_pos'):
-            self.last_log_pos = 0
+        log_file = service_log_file()
+        if not hasattr(self, 'last_log_pos') or log_file != self.log_file:
+            self.log_file = log_file   # re-resolved every poll: log_file may change in config.json
+            self.last_log_pos = None   # None = not positioned yet (start near the end)
+            self.last_log_id = None
 
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, "r", encoding="utf-8") as f:
-                f.seek(self.last_log_pos)
-                new_lines = f.read()
-                self.last_log_pos = f.tell()
+        try:
+            st = os.stat(log_file)
+        except OSError:
+            st = None
+
+        if st is not None:
+            log_id = (st.st_dev, st.st_ino)
+            if self.last_log_pos is None:
+                # First poll: show only the tail of a possibly large log, from a line start
+                self.last_log_pos = max(st.st_size - LOG_READ_CHUNK, 0)
+                self.last_log_id = log_id
+                if self.last_log_pos:
+                    with open(log_file, "rb") as f:
+                        f.seek(self.last_log_pos)
+                        self.last_log_pos += len(f.readline())
+            elif log_id != self.last_log_id or st.st_size < self.last_log_pos:
+                # Rotated: finish the old file (now .1), then follow the new one from the start
+                rotated = log_file + ".1"
+                try:
+                    if (os.stat(rotated).st_dev, os.stat(rotated).st_ino) == self.last_log_id:
+                        self.read_log_chunk(rotated, self.last_log_pos)
+                except OSError:
+                    pass
+                self.last_log_pos = 0
+                self.last_log_id = log_id
 
-                if new_lines:
-                    self.log_area.config(state='normal')
-                    self.log_area.insert(tk.END, new_lines)
-                    self.log_area.yview(tk.END)
-                    self.log_area.config(state='disabled')
+            if st.st_size > self.last_log_pos:
+                self.last_log_pos = self.read_log_chunk(log_file, self.last_log_pos)
 
         self.root.after(1000, self.update_logs)
 
+    def read_log_chunk(self, path, pos):
+        """
+        Reads complete lines from `pos` (at most LOG_READ_CHUNK bytes) into the log
+        area and returns the new position; a partly written last line waits for the next poll.
+        """
+        with open(path, "rb") as f:
+            f.seek(pos)
+            data = f.read(LOG_READ_CHUNK)
+        end = data.rfind(b"\n") + 1
+        if end == 0 and len(data) == LOG_READ_CHUNK:
+            end = len(data)  # a single line longer than the chunk: show it in pieces
+        if end:
+            lines = data[:end].decode("utf-8", errors="replace").splitlines()
+            text = "".join(format_log_line(line) for line in lines if line.strip())
+            if text:
+                self.log_area.config(state='normal')
+                self.log_area.insert(tk.END, text)
+                self.log_area.yview(tk.END)
+                self.log_area.config(state='disabled')
+        return pos + end
+
     def log_gui(self, text):
         self.log_area.config(state='normal')
         self.log_area.insert(tk.END, text)
@@ -0,0 +1,1323 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import wave
+from multiprocessing import shared_memory
+from typing import Dict
+from unittest import mock
+
+import numpy as np
+import torch
+import whisper
+
+# The service stores its caches under %PROGRAMDATA%; keep tests out of the real one
+os.environ.setdefault("PROGRAMDATA", tempfile.mkdtemp(prefix="aics-test-"))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(BASE_DIR, "app.1.6.2.py")
+CAPTIONS_GOLDEN_PATH = os.path.join(BASE_DIR, "test_captions_golden.json")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("aics_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app_module = load_app()
+
+
+class CaptionLayoutGoldenTest(unittest.TestCase):
+    """
+    process_segments_with_scrolling_captions must stay byte-identical to the
+    original word-by-word implementation. test_captions_golden.json holds the
+    inputs (segments, chunk duration, VAD flags, per-segment voice ratios, several
+    chunks per stream) and the antix blocks + final stream state it produced.
+    Regenerate it with gen_captions_golden.py against the pre-rework app.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        with open(CAPTIONS_GOLDEN_PATH, "r", encoding="utf-8") as f:
+            cls.cases = json.load(f)
+
+    def run_case(self, case):
+        stream_id = "golden:" + case["name"]
+        app_module.stream_states.pop(stream_id, None)
+
+        outputs = []
+        for chunk in case["chunks"]:
+            parameters = dict(case["parameters"])
+            if "max_caption_lines" in chunk:
+                parameters["max_caption_lines"] = chunk["max_caption_lines"]
+            segments = json.loads(json.dumps(chunk["segments"]))
+            ratios = chunk["segment_voice_ratios"]
+            app_module.process_segments_with_scrolling_captions(
+                segments,
+                chunk["audio_duration"],
+                parameters,
+                chunk["is_vad_silence"],
+                stream_id,
+                None if ratios is None else np.array(ratios, dtype=np.float64)
+            )
+            outputs.append([seg.get("antix") for seg in segments])
+
+        state = app_module.stream_states.pop(stream_id)
+        return {
+            "outputs": outputs,
+            "state": {
+                "last_lines": list(state.last_lines),
+                "last_line": state.last_line,
+                "is_first_caption": state.is_first_caption,
+                "prev_chunk_ended_with_silence": state.prev_chunk_ended_with_silence
+            }
+        }
+
+    def test_golden_outputs(self):
+        for case in self.cases:
+            with self.subTest(case=case["name"]):
+                actual = json.dumps(self.run_case(case), ensure_ascii=False)
+                expected = json.dumps(case["expected"], ensure_ascii=False)
+                self.assertEqual(actual, expected)
+
+
+class SplitTextToLinesTest(unittest.TestCase):
+    def test_wraps_at_last_space(self):
+        self.assertEqual(
+            app_module.split_text_to_lines("the quick brown fox jumps over", max_chars=10),
+            ["the quick", "brown fox", "jumps over"]
+        )
+
+    def test_long_word_gets_own_line(self):
+        self.assertEqual(
+            app_module.split_text_to_lines("a internationalization b", max_chars=5),
+            ["a", "internationalization", "b"]
+        )
+
+    def test_collapses_whitespace(self):
+        self.assertEqual(app_module.split_text_to_lines("  one \t two\n three  ", max_chars=32), ["one two three"])
+        self.assertEqual(app_module.split_text_to_lines("   ", max_chars=32), [])
+
+
+def wav_bytes(samples: np.ndarray, rate: int = 16000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(samples.astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+class DecodeAudioBytesTest(unittest.TestCase):
+    def setUp(self):
+        self.samples = (np.sin(np.arange(1600) / 10.0) * 8000).astype("<i2")
+
+    def test_wav_is_parsed_without_ffmpeg(self):
+        with mock.patch.object(app_module, "_decode_with_ffmpeg_pipe") as ffmpeg:
+            audio = app_module.decode_audio_bytes(wav_bytes(self.samples), "a.wav", "application/octet-stream")
+        ffmpeg.assert_not_called()
+        np.testing.assert_allclose(audio, self.samples / 32768.0, atol=1e-6)
+
+    def test_raw_pcm_needs_explicit_name_or_l16(self):
+        raw = self.samples.tobytes()
+        with mock.patch.object(app_module, "_decode_with_ffmpeg_pipe") as ffmpeg:
+            self.assertEqual(len(app_module.decode_audio_bytes(raw, "chunk.pcm")), len(self.samples))
+            self.assertEqual(len(app_module.decode_audio_bytes(raw, "blob", "audio/L16; rate=16000")), len(self.samples))
+        ffmpeg.assert_not_called()
+
+    def test_transcribe_decodes_l16_upload_once(self):
+        seen = []
+        fallback = {"fallback_attempts": 0, "fallback_exhausted": False, "decode_temperature": 0.0}
+
+        def fake_infer(model_name, audio, options, parameters, background=False, started=None):
+            seen.append(audio.copy())
+            return {"text": "", "segments": [], "language": "en"}, fallback
+
+        data = {
+            "audio": (io.BytesIO(self.samples.tobytes()), "blob", "audio/L16; rate=16000"),
+            "stream_id": "decode-once", "audio_id": "1", "enable_vad": "true"
+        }
+        with mock.patch.object(app_module, "ensure_model"), \
+                mock.patch.object(app_module, "run_whisper_budgeted", side_effect=fake_infer), \
+                mock.patch.object(app_module, "decode_audio_bytes", wraps=app_module.decode_audio_bytes) as decode, \
+                mock.patch.object(app_module, "decode_audio") as decode_file, \
+                mock.patch.object(app_module, "_decode_with_ffmpeg_pipe") as ffmpeg, \
+                mock.patch.dict(app_module.BASE_CONFIG, in_memory_ingest=True, skip_vad_silence=False):
+            response = app_module.app.test_client().post("/transcribe", data=data)
+        app_module.stream_states.pop("decode-once", None)
+
+        self.assertEqual(response.status_code, 200)
+        decode.assert_called_once()
+        decode_file.assert_not_called()
+        ffmpeg.assert_not_called()
+        # The one buffer VAD and Whisper share holds exactly the uploaded samples
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(seen[0].dtype, np.float32)
+        np.testing.assert_allclose(seen[0], self.samples / 32768.0, atol=1e-6)
+
+    def test_octet_stream_mp3_goes_to_ffmpeg(self):
+        mp3 = b"ID3\x03\x00\x00\x00\x00\x00\x00" + bytes(4000)
+        with mock.patch.object(app_module, "_decode_with_ffmpeg_pipe", return_value=np.zeros(10, np.float32)) as ffmpeg:
+            app_module.decode_audio_bytes(mp3, "clip.mp3", "application/octet-stream")
+        ffmpeg.assert_called_once_with(mp3)
+
+    def test_missing_ffmpeg_is_a_decode_error(self):
+        with mock.patch.object(app_module.subprocess, "run", side_effect=FileNotFoundError("ffmpeg")):
+            with self.assertRaisesRegex(RuntimeError, "ffmpeg not found"):
+                app_module.decode_audio_bytes(b"not audio", "clip.mp3")
+
+
+class TranscribeBatchTest(unittest.TestCase):
+    """
+    The micro-batching path must produce exactly what model.transcribe() would for each chunk.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from whisper.model import ModelDimensions, Whisper
+
+        torch.manual_seed(0)
+        dims = ModelDimensions(
+            n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+            n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1
+        )
+        cls.model = Whisper(dims).eval()
+        # Whisper leaves the decoder's positional embedding as torch.empty (it's always loaded from a
+        # checkpoint), so without this the "random" model changes with whatever memory it got
+        torch.nn.init.normal_(cls.model.decoder.positional_embedding, std=0.02)
+        cls.tokenizer = whisper.tokenizer.get_tokenizer(False)
+
+    def decoding(self, tokens):
+        return whisper.decoding.DecodingResult(
+            audio_features=None, language="en", tokens=tokens,
+            avg_logprob=-0.2, no_speech_prob=0.1, temperature=0.0, compression_ratio=1.0
+        )
+
+    def test_matches_transcribe_per_chunk(self):
+        # Random weights leave near-ties in the greedy argmax; other tests (ModelPool) change the
+        # global thread count, and a different matmul split could flip one
+        threads = torch.get_num_threads()
+        self.addCleanup(torch.set_num_threads, threads)
+        torch.set_num_threads(1)
+        torch.manual_seed(0)
+        rng = np.random.default_rng(0)
+        audios = [(rng.standard_normal(int(16000 * seconds)) * 0.1).astype(np.float32) for seconds in (1.0, 3.5)]
+        expected = [self.model.transcribe(audio, temperature=0.0) for audio in audios]
+        with mock.patch.object(self.model, "transcribe", side_effect=AssertionError("fell back")):
+            actual = app_module.transcribe_batch(self.model, audios, {"temperature": 0.0})
+
+        # Same keys, tokens, text and timings; decoder scores only up to float noise of the batched matmuls
+        scores = ("avg_logprob", "compression_ratio", "no_speech_prob")
+        for got, want in zip(actual, expected):
+            self.assertEqual(
+                json.dumps({**got, "segments": [{**seg, **{k: 0 for k in scores}} for seg in got["segments"]]}),
+                json.dumps({**want, "segments": [{**seg, **{k: 0 for k in scores}} for seg in want["segments"]]})
+            )
+            for got_seg, want_seg in zip(got["segments"], want["segments"]):
+                # random weights can give NaN scores; assert_allclose treats NaN == NaN
+                np.testing.assert_allclose(
+                    [got_seg[key] for key in scores], [want_seg[key] for key in scores], rtol=0, atol=1e-4
+                )
+
+    def test_splits_on_timestamps_and_clears_empty_segments(self):
+        tb = self.tokenizer.timestamp_begin
+        hello, world = self.tokenizer.encode(" hello"), self.tokenizer.encode(" world")
+        tokens = [tb, *hello, tb + 50, tb + 50, tb + 75, tb + 75, *world, tb + 100]
+        segments = app_module._segments_from_decoding(self.decoding(tokens), self.tokenizer, 300)
+
+        # Every consecutive timestamp pair is a boundary, so two instantaneous segments sit in the middle
+        self.assertEqual([s["id"] for s in segments], [0, 1, 2, 3])
+        self.assertEqual([(s["start"], s["end"]) for s in segments], [(0.0, 1.0), (1.0, 1.0), (1.5, 1.5), (1.5, 2.0)])
+        self.assertEqual([s["text"] for s in segments], [" hello", "", "", " world"])
+        self.assertEqual((segments[1]["tokens"], segments[1]["words"]), ([], []))
+        self.assertNotIn("words", segments[0])
+
+    def test_unfinished_window_falls_back(self):
+        tb = self.tokenizer.timestamp_begin
+        tokens = [tb, *self.tokenizer.encode(" hello"), tb + 50, tb + 50, *self.tokenizer.encode(" world")]
+        self.assertIsNone(app_module._segments_from_decoding(self.decoding(tokens), self.tokenizer, 300))
+
+
+class JobQueueTest(unittest.TestCase):
+    def test_single_replica_goes_to_live_request_between_shards(self):
+        slot = app_module._ModelSlot([torch.nn.Linear(2, 2)], live_reserve=1)
+        self.assertEqual(slot.live_reserve, 0)
+        order = []
+
+        def take(kind, background):
+            replica = slot.checkout(background)
+            order.append(kind)
+            slot.checkin(replica)
+
+        replica = slot.checkout(background=True)    # job decoding its first shard
+        live = threading.Thread(target=take, args=("live", False))
+        live.start()
+        while not slot.live_waiting:
+            time.sleep(0.001)
+        job = threading.Thread(target=take, args=("next shard", True))
+        job.start()
+        slot.checkin(replica)
+        live.join(5)
+        job.join(5)
+        self.assertEqual(order, ["live", "next shard"])
+
+    def test_upload_is_spooled_and_job_runs_long_form(self):
+        from werkzeug.datastructures import FileStorage
+
+        jobs = app_module.JobQueue(1, 4, tempfile.mkdtemp(), 3600)
+        upload = FileStorage(io.BytesIO(wav_bytes(np.zeros(1600, np.float32))), "a.wav", content_type="audio/wav")
+        path = jobs.spool_upload(upload)
+        job = app_module.TranscriptionJob(path, "a.wav", "audio/wav", dict(app_module.BASE_CONFIG), None, None, 10)
+        orphan = jobs.spool_upload(FileStorage(io.BytesIO(b"x"), "b.wav"))
+        with mock.patch.object(jobs, "_jobs", {job.job_id: job}):
+            jobs.cleanup(time.time())
+        self.assertTrue(os.path.isfile(path))
+        self.assertFalse(os.path.exists(orphan))
+
+        seen = []
+
+        def fake_transcribe(audio, parameters, stream_id, background=False, progress=None):
+            seen.append((len(audio), parameters["long_form"], background))
+            raise RuntimeError("stop")
+
+        with mock.patch.object(app_module, "transcribe_audio", side_effect=fake_transcribe):
+            jobs._execute(job)
+        self.assertEqual(seen, [(1600, True, True)])
+        self.assertEqual(job.status, "failed")
+        self.assertFalse(os.path.exists(path))
+
+
+class InferenceWorkerTest(unittest.TestCase):
+    def test_worker_loads_one_replica_and_decodes_directly(self):
+        class FakeModel(torch.nn.Linear):
+            def transcribe(self, audio, **options):
+                return {"text": f"{len(audio)} samples", "options": options}
+
+        tasks, results = queue.Queue(), queue.Queue()
+        audio = np.ones(1600, dtype=np.float32)
+        shm = shared_memory.SharedMemory(create=True, size=audio.nbytes)
+        np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[:] = audio
+        parameters = dict(app_module.BASE_CONFIG, enable_batching=True)
+        tasks.put((7, shm.name, len(audio), "tiny", {"temperature": 0.0}, parameters))
+        tasks.put(None)
+        try:
+            with mock.patch.dict(app_module.BASE_CONFIG, model_replicas=3), \
+                    mock.patch.object(app_module, "model_pool", app_module.model_pool), \
+                    mock.patch.object(app_module.whisper, "load_model", side_effect=lambda *a, **k: FakeModel(2, 2)), \
+                    mock.patch.object(app_module.batch_scheduler, "submit", side_effect=AssertionError("batched")):
+                app_module._inference_worker_main(0, "tiny", 1, tasks, results)
+                pool = app_module.model_pool.status()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        self.assertEqual(results.get_nowait(), ("ready", None, None))
+        self.assertEqual(results.get_nowait(), ("ok", 7, {"text": "1600 samples", "options": {"temperature": 0.0}}))
+        self.assertEqual([m["replicas"] for m in pool["models"]], [1])
+
+    def test_model_pool_endpoint_reports_workers(self):
+        workers = mock.Mock()
+        workers.status.return_value = {"workers": 2, "processes": []}
+        client = app_module.app.test_client()
+        self.assertIsNone(client.get("/model_pool").get_json()["inference_workers"])
+        with mock.patch.object(app_module, "inference_workers", workers):
+            self.assertEqual(client.get("/model_pool").get_json()["inference_workers"], {"workers": 2, "processes": []})
+
+
+class RequestMetricsTest(unittest.TestCase):
+    def test_unknown_model_is_labelled_invalid(self):
+        client = app_module.app.test_client()
+        audio = lambda: (io.BytesIO(b"x"), "chunk.wav")
+        client.post("/transcribe", data={"model": 'evil"} 1e9', "audio": audio()})
+        with mock.patch.object(app_module, "ensure_model", side_effect=ValueError("not loaded")):
+            client.post("/transcribe", data={"model": "tiny", "audio": audio()})
+        body = client.get("/metrics").get_data(as_text=True)
+        self.assertIn('aics_requests_total{endpoint="transcribe",model="invalid",status="400"}', body)
+        self.assertIn('aics_requests_total{endpoint="transcribe",model="tiny",status="400"}', body)
+        self.assertNotIn("evil", body)
+
+    def test_rejected_upload_is_counted_without_parsing_the_body(self):
+        from flask import Request
+
+        client = app_module.app.test_client()
+        with mock.patch.object(Request, "_load_form_data", autospec=True, side_effect=Request._load_form_data) as parse:
+            response = client.post("/result_cache", data={"model": "tiny", "audio": (io.BytesIO(b"x"), "chunk.wav")})
+        self.assertEqual(response.status_code, 405)
+        parse.assert_not_called()
+        body = client.get("/metrics").get_data(as_text=True)
+        self.assertIn('aics_requests_total{endpoint="unknown",model="unknown",status="405"}', body)
+
+    def test_pool_hit_counted_once_per_request(self):
+        pool = app_module.ModelPool(0)
+        with mock.patch.object(app_module.whisper, "load_model", side_effect=lambda *a, **k: torch.nn.Linear(2, 2)):
+            pool.get("tiny")                # warm-up load: a miss
+            pool.get("tiny")                # ensure_model of one request...
+            with pool.acquire("tiny"):      # ...and its decode
+                pass
+        self.assertEqual((pool.hits, pool.misses), (1, 1))
+
+
+class BatchSchedulerTest(unittest.TestCase):
+    def test_busy_model_does_not_block_other_models(self):
+        release = threading.Event()
+
+        class FakePool:
+            @contextlib.contextmanager
+            def acquire(self, name, background=False):
+                yield name
+
+        def fake_batch(model, audios, options):
+            if model == "tiny":
+                release.wait(5)
+            return [{"model": model} for _ in audios]
+
+        scheduler = app_module.BatchScheduler(0, 4, workers=1)
+        with mock.patch.object(app_module, "model_pool", FakePool()), \
+                mock.patch.object(app_module, "transcribe_batch", side_effect=fake_batch):
+            slow = scheduler.submit("tiny", np.zeros(10, np.float32), {})
+            fast = scheduler.submit("base", np.zeros(10, np.float32), {})
+            try:
+                self.assertEqual(fast.result(timeout=5), {"model": "base"})
+                self.assertFalse(slow.done())
+            finally:
+                release.set()
+            self.assertEqual(slow.result(timeout=5), {"model": "tiny"})
+
+
+class ModelPoolTest(unittest.TestCase):
+    """
+    whisper.load_model is replaced by a tiny module so the pool logic runs
+    without downloading weights; each fake model is 440 bytes.
+    """
+
+    def setUp(self):
+        self.loads = []
+        patcher = mock.patch.object(app_module.whisper, "load_model", side_effect=self.fake_load)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_load(self, name, device=None, download_root=None):
+        self.loads.append(name)
+        return torch.nn.Linear(10, 10)
+
+    def test_rejects_unknown_names(self):
+        pool = app_module.ModelPool(0)
+        with self.assertRaises(ValueError):
+            pool.get("../tiny")
+        self.assertEqual(self.loads, [])
+
+    def test_evicts_least_recently_used_over_budget(self):
+        pool = app_module.ModelPool(1000)
+        pool.get("tiny")
+        pool.get("base")
+        pool.get("tiny")            # base is now least recently used
+        pool.get("small")
+
+        status = pool.status()
+        self.assertEqual([m["name"] for m in status["models"]], ["small", "tiny"])
+        self.assertEqual(status["evictions"], 1)
+        self.assertEqual((status["hits"], status["misses"]), (1, 3))
+
+        pool.get("base")            # evicted models load again
+        self.assertEqual(self.loads, ["tiny", "base", "small", "base"])
+
+    def test_concurrent_first_requests_share_one_load(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_load(name, device=None, download_root=None):
+            self.loads.append(name)
+            started.set()
+            release.wait(5)
+            return torch.nn.Linear(10, 10)
+
+        pool = app_module.ModelPool(0, replicas=2)
+        results = []
+        with mock.patch.object(app_module.whisper, "load_model", side_effect=slow_load):
+            threads = [threading.Thread(target=lambda: results.append(pool.get("tiny"))) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            started.wait(5)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(self.loads, ["tiny"])
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(model is results[0] for model in results))
+        self.assertEqual(len(pool.all_replicas("tiny")), 2)
+
+    def test_replicas_are_checked_out_exclusively(self):
+        pool = app_module.ModelPool(0, replicas=2)
+        with pool.acquire("tiny") as first, pool.acquire("tiny") as second:
+            self.assertIsNot(first, second)
+            self.assertEqual(pool.status()["models"][0]["busy"], 2)
+        self.assertEqual(pool.status()["models"][0]["busy"], 0)
+
+
+class VadEngineTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        t = np.arange(16000) / 16000
+        self.quiet = (rng.standard_normal(16000) * 0.001).astype(np.float32)
+        self.tone = sum(a * np.sin(2 * np.pi * f * t) for a, f in ((0.3, 220), (0.2, 440), (0.1, 660))).astype(np.float32)
+        self.noise = (rng.standard_normal(16000) * 0.3).astype(np.float32)
+        # Trailing partial frame: counted in num_frames, never voiced
+        self.audio = np.concatenate([self.quiet, self.tone, self.noise, self.quiet[:1000]])
+
+    def test_webrtc_ratio_matches_frame_loop(self):
+        import webrtcvad
+
+        pcm = app_module.audio_to_pcm16(self.audio)
+        frame_size = 480 * 2
+        frames = [pcm[i:i + frame_size] for i in range(0, len(pcm), frame_size)]
+        for aggressiveness in range(4):
+            vad = webrtcvad.Vad(aggressiveness)
+            voiced = sum(1 for f in frames if len(f) == frame_size and vad.is_speech(f, 16000))
+            with self.subTest(aggressiveness=aggressiveness):
+                result = app_module.run_vad(self.audio, aggressiveness, engine="webrtc")
+                self.assertEqual(result.num_frames, len(frames))
+                self.assertEqual(result.voice_ratio(), voiced / len(frames))
+
+    def test_energy_engine_keeps_voiced_tone_only(self):
+        result = app_module.run_vad(self.audio, 2, engine="energy")
+        self.assertEqual(result.num_frames, 103)
+        self.assertEqual(len(result.voiced), 102)
+        self.assertFalse(result.voiced[:33].any())      # near-silence
+        self.assertTrue(result.voiced[34:66].all())     # harmonic tone
+        self.assertFalse(result.voiced[67:100].any())   # loud but flat white noise
+        self.assertEqual(result.speech_regions(), [(0.99, 2.01)])
+
+    def test_is_voice_present_uses_threshold(self):
+        # The energy engine's floor adapts to the chunk, so it needs some background to compare against
+        self.assertTrue(app_module.is_voice_present(np.concatenate([self.quiet, self.tone]), engine="energy"))
+        self.assertFalse(app_module.is_voice_present(self.quiet, engine="energy"))
+        self.assertFalse(app_module.is_voice_present(np.zeros(0, dtype=np.float32)))
+
+    def test_silent_chunk_with_skip_never_reaches_the_model(self):
+        data = {
+            "audio": (io.BytesIO(bytes(32000)), "blob", "audio/L16; rate=16000"),
+            "stream_id": "vad-skip", "audio_id": "1", "enable_vad": "true", "skip_vad_silence": "true"
+        }
+        with mock.patch.object(app_module, "ensure_model"), \
+                mock.patch.object(app_module, "run_whisper_budgeted") as budgeted, \
+                mock.patch.object(app_module, "run_whisper") as run_whisper, \
+                mock.patch.object(app_module, "transcribe_long_form") as long_form, \
+                mock.patch.object(app_module.model_pool, "acquire") as acquire:
+            response = app_module.app.test_client().post("/transcribe", data=data)
+        app_module.stream_states.pop("vad-skip", None)
+
+        self.assertEqual(response.status_code, 200)
+        for model_call in (budgeted, run_whisper, long_form, acquire):
+            model_call.assert_not_called()
+        body = response.get_json()
+        self.assertEqual((body["result"]["text"], body["result"]["segments"]), ("", []))
+        self.assertTrue(body["antix"]["vad_skipped"])
+
+
+class SegmentVoiceRatioTest(unittest.TestCase):
+    def test_matches_per_segment_frame_count(self):
+        rng = np.random.default_rng(1)
+        result = app_module.VadResult(rng.random(100) > 0.5, 101, 0.03)
+        segments = [
+            {"start": 0.0, "end": 0.3}, {"start": 0.31, "end": 1.17}, {"start": 2.9, "end": 3.5},
+            {"start": 1.0, "end": 1.0}, {"start": 4.0, "end": 5.0}
+        ]
+        expected = []
+        for seg in segments:
+            first = min(max(int(np.floor(seg["start"] / 0.03)), 0), 100)
+            last = min(max(int(np.ceil(seg["end"] / 0.03)), 0), 100)
+            expected.append(result.voiced[first:last].mean() if last > first else 0.0)
+        np.testing.assert_allclose(result.segment_voice_ratios(segments), expected)
+
+    def test_unvoiced_segment_is_filtered_on_its_own(self):
+        stream_id = "voice-ratio-test"
+        app_module.stream_states.pop(stream_id, None)
+        parameters = dict(app_module.BASE_CONFIG, enable_filtering=True, min_text_length=0)
+        segments = [
+            {"start": 0.0, "end": 1.0, "text": " breathing", "avg_logprob": -0.2},
+            {"start": 1.2, "end": 2.0, "text": " hello there", "avg_logprob": -0.2}
+        ]
+        app_module.process_segments_with_scrolling_captions(
+            segments, 2.0, parameters, False, stream_id, np.array([0.05, 0.8])
+        )
+        app_module.stream_states.pop(stream_id, None)
+
+        self.assertEqual([seg["antix"]["voice_ratio"] for seg in segments], [0.05, 0.8])
+        self.assertTrue(segments[0]["antix"]["filtered"] & app_module.VAD_FILTER)
+        self.assertFalse(segments[1]["antix"]["filtered"] & app_module.VAD_FILTER)
+
+
+class PlanShardsTest(unittest.TestCase):
+    def vad(self, spans, total_seconds, frame_duration=0.1):
+        voiced = np.zeros(int(round(total_seconds / frame_duration)), dtype=bool)
+        for start, end in spans:
+            voiced[int(round(start / frame_duration)):int(round(end / frame_duration))] = True
+        return app_module.VadResult(voiced, len(voiced), frame_duration)
+
+    def test_groups_regions_and_cuts_in_the_silence(self):
+        shards = app_module.plan_shards(self.vad([(1, 3), (5, 7), (20, 25)], 30), 30, 10)
+        # Padded by SHARD_PAD_SECONDS, never past the midpoint of the gap (13.5) or the file
+        self.assertEqual(shards, [(0.8, 7.2), (19.8, 25.2)])
+
+    def test_hard_splits_a_run_longer_than_one_shard(self):
+        shards = app_module.plan_shards(self.vad([(0, 25)], 25), 25, 10)
+        self.assertEqual(shards, [(0.0, 9.6), (9.6, 19.2), (19.2, 25.0)])
+
+    def test_shards_fit_cover_speech_and_do_not_overlap(self):
+        rng = np.random.default_rng(3)
+        voiced = rng.random(3000) > 0.3
+        vad = app_module.VadResult(voiced, len(voiced), 0.03)
+        shards = app_module.plan_shards(vad, 90, 8)
+        for start, end in shards:
+            self.assertLessEqual(end - start, 8 + 1e-6)
+        for (_, prev_end), (next_start, _) in zip(shards, shards[1:]):
+            self.assertLessEqual(prev_end, next_start)
+        for start, end in vad.speech_regions():
+            self.assertTrue(any(lo <= start and end <= hi for lo, hi in shards) or end - start > 8 - 2 * app_module.SHARD_PAD_SECONDS)
+
+    def test_silence_gives_no_shards(self):
+        self.assertEqual(app_module.plan_shards(self.vad([], 40), 40, 10), [])
+
+
+def decode_captions_binary(data: bytes) -> Dict:
+    """
+    Reference reader for the schema v1 layout documented on encode_captions_binary.
+    """
+    assert data[:3] == app_module.CAPTIONS_BINARY_MAGIC
+    pos = 4
+    idents = []
+    for _ in range(2):
+        (size,) = struct.unpack_from("<H", data, pos)
+        idents.append(data[pos + 2:pos + 2 + size].decode("utf-8"))
+        pos += 2 + size
+    (count,) = struct.unpack_from("<I", data, pos)
+    pos += 4
+    captions = []
+    for _ in range(count):
+        start_ms, end_ms, filtered, size = struct.unpack_from("<IIBH", data, pos)
+        pos += 11
+        captions.append([data[pos:pos + size].decode("utf-8"), start_ms, end_ms, filtered])
+        pos += size
+    assert pos == len(data)
+    return {"v": data[3], "stream_id": idents[0], "audio_id": idents[1], "captions": captions}
+
+
+class CaptionEncodingTest(unittest.TestCase):
+    RESULT = {"segments": [
+        {"antix": {"filtered": 0, "wrapped_text": [
+            {"text": "GRÜSSE AUS KÖLN", "start": 0.0, "end": 1.2345},
+            {"text": "日本語のテキスト", "start": 1.2345, "end": 2.5}
+        ]}},
+        {"antix": {"filtered": 5, "wrapped_text": [{"text": "", "start": 2.5, "end": 2.5}]}},
+        {"id": 3}
+    ]}
+    EXPECTED = [
+        ["GRÜSSE AUS KÖLN", 0, 1234, 0],
+        ["日本語のテキスト", 1234, 2500, 0],
+        ["", 2500, 2500, 5]
+    ]
+
+    def test_binary_round_trip(self):
+        decoded = decode_captions_binary(app_module.encode_captions_binary(self.RESULT, "stüdio-1", "42"))
+        self.assertEqual(decoded, {"v": 1, "stream_id": "stüdio-1", "audio_id": "42", "captions": self.EXPECTED})
+
+    def test_binary_truncates_on_a_character_boundary(self):
+        # 3-byte characters: 65535 is a multiple of 3, so shift by one ASCII byte to force a split
+        text = "a" + "語" * 30000
+        result = {"segments": [{"antix": {"wrapped_text": [{"text": text, "start": 0, "end": 1}]}}]}
+        decoded = decode_captions_binary(app_module.encode_captions_binary(result, "s" * 70000, "a"))
+        caption = decoded["captions"][0][0]
+        self.assertEqual(caption, "a" + "語" * 21844)
+        self.assertEqual(len(decoded["stream_id"]), 0xFFFF)
+
+    @unittest.skipIf(app_module.msgpack is None, "msgpack not installed")
+    def test_msgpack_round_trip(self):
+        body = app_module.encode_captions_msgpack(self.RESULT, "stüdio-1", "42")
+        self.assertEqual(
+            app_module.msgpack.unpackb(body),
+            {"v": 1, "stream_id": "stüdio-1", "audio_id": "42", "captions": self.EXPECTED}
+        )
+
+
+class StreamResponseTest(unittest.TestCase):
+    RESULT = {
+        "text": ' Grüße — "quoted"',
+        "language": "de",
+        "segments": [
+            {"id": 0, "start": 0.0, "end": 0.5, "text": " Grüße", "tokens": [1, 2], "avg_logprob": -0.25},
+            {"id": 1, "start": 0.5, "end": 1.0, "text": ' — "quoted"', "tokens": [3], "avg_logprob": -0.5}
+        ]
+    }
+
+    def post(self, **form):
+        app_module.stream_states.pop("stream-response-test", None)
+        fallback = {"fallback_attempts": 0, "fallback_exhausted": False, "decode_temperature": 0.0}
+        data = {
+            "audio": (io.BytesIO(wav_bytes(np.zeros(16000, np.float32))), "a.wav"),
+            "stream_id": "stream-response-test",
+            "audio_id": "1",
+            "enable_vad": "false",
+            "pretty_json": "true"
+        }
+        data.update(form)
+        with mock.patch.object(app_module, "ensure_model"), \
+                mock.patch.object(app_module, "run_whisper_budgeted",
+                                  side_effect=lambda *a, **k: (json.loads(json.dumps(self.RESULT)), fallback)):
+            response = app_module.app.test_client().post("/transcribe", data=data)
+            raw = response.get_data()
+        app_module.stream_states.pop("stream-response-test", None)
+        self.assertEqual(response.status_code, 200)
+        return raw, json.loads(raw)
+
+    def test_stream_response_wins_over_pretty_json(self):
+        buffered, expected = self.post(stream_response="false")
+        streamed, actual = self.post(stream_response="true")
+
+        self.assertTrue(buffered.startswith(b'{\n  "antix"'))
+        self.assertTrue(streamed.startswith(b'{"antix":'))
+        self.assertEqual((expected["antix"]["pretty_json"], expected["antix"]["stream_response"]), (True, False))
+        self.assertEqual((actual["antix"]["pretty_json"], actual["antix"]["stream_response"]), (False, True))
+        for body in (expected, actual):
+            for key in ("pretty_json", "stream_response", "response_time"):
+                del body["antix"][key]
+        self.assertEqual(actual, expected)
+
+    def test_stream_json_response_round_trips(self):
+        response_obj = {"antix": {"id": "x", "ratio": 0.5, "flags": [1, None]}, "result": self.RESULT}
+        streamed = b"".join(app_module.stream_json_response(response_obj))
+        self.assertEqual(json.loads(streamed), response_obj)
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_key_covers_audio_model_and_options(self):
+        make_key = app_module.ResultCache.make_key
+        audio = np.linspace(-1, 1, 1600, dtype=np.float32)
+        key = make_key("tiny", audio, {"temperature": 0.0, "language": "en"})
+        self.assertEqual(key, make_key("tiny", audio.astype(np.float64), {"language": "en", "temperature": 0.0}))
+        self.assertNotEqual(key, make_key("base", audio, {"temperature": 0.0, "language": "en"}))
+        self.assertNotEqual(key, make_key("tiny", audio, {"temperature": 0.2, "language": "en"}))
+        changed = audio.copy()
+        changed[800] += 1e-3
+        self.assertNotEqual(key, make_key("tiny", changed, {"temperature": 0.0, "language": "en"}))
+
+    def test_memory_tier_is_an_lru_of_copies(self):
+        cache = app_module.ResultCache(2)
+        cache.put("a", {"segments": [{"text": "a"}]})
+        cache.put("b", {"segments": []})
+        cache.get("a")["segments"][0]["text"] = "changed by captions"
+        cache.put("c", {"segments": []})        # b is least recently used
+
+        self.assertEqual(cache.get("a"), {"segments": [{"text": "a"}]})
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_hits_and_misses_are_counters(self):
+        def totals():
+            counters = app_module.metrics.snapshot().counters
+            return tuple(counters.get((name, ()), 0.0) for name in (
+                "aics_result_cache_hits_total", "aics_result_cache_misses_total"
+            ))
+
+        before = totals()
+        cache = app_module.ResultCache(2)
+        cache.put("a", {"segments": []})
+        cache.get("a")
+        cache.get("a")
+        cache.get("b")
+        # A fresh cache (benchmark, restart) keeps adding to the same counters
+        app_module.ResultCache(2).get("a")
+        self.assertEqual(tuple(b - a for a, b in zip(before, totals())), (2.0, 2.0))
+
+    def test_disk_tier_survives_a_restart_and_is_pruned(self):
+        disk_dir = tempfile.mkdtemp()
+        cache = app_module.ResultCache(0, disk_dir, disk_max_entries=2)
+        for i, key in enumerate(("old", "mid", "new")):
+            cache.put(key, {"text": key})
+            os.utime(os.path.join(disk_dir, key + ".json"), (1000 + i, 1000 + i))
+        cache.prune_disk()
+        self.assertEqual(sorted(os.listdir(disk_dir)), ["mid.json", "new.json"])
+
+        restarted = app_module.ResultCache(4, disk_dir, disk_max_entries=2)
+        self.assertEqual(restarted.get("new"), {"text": "new"})
+        self.assertIsNone(restarted.get("old"))
+        self.assertEqual(restarted.status()["entries"], 1)   # disk hit promoted to memory
+
+
+class ConfigReloadTest(unittest.TestCase):
+    def setUp(self):
+        config_dir = tempfile.mkdtemp()
+        self.path = os.path.join(config_dir, "config.json")
+        for name, value in (
+            ("CONFIG_PATH_PRIMARY", self.path),
+            ("CONFIG_PATH_FALLBACK", os.path.join(config_dir, "missing.json")),
+            ("BASE_CONFIG", app_module.BASE_CONFIG),
+            ("PROFILE_CONFIGS", app_module.PROFILE_CONFIGS),
+            ("active_config", app_module.active_config)
+        ):
+            patcher = mock.patch.object(app_module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write(self, **values):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(dict(app_module.BASE_CONFIG, **values), f)
+
+    def test_type_errors(self):
+        self.assertEqual(app_module.config_type_errors(dict(app_module.DEFAULT_CONFIG)), [])
+        # Any number is fine for a numeric key, but bools are not numbers here
+        config = dict(app_module.DEFAULT_CONFIG, wrap_length=32.5, enable_vad=1, temperature=True, model=3)
+        self.assertCountEqual(app_module.config_type_errors(config), [
+            "model must be str, got 3",
+            "temperature must be float, got true",
+            "enable_vad must be bool, got 1"
+        ])
+
+    def test_startup_load_replaces_mistyped_values_with_defaults(self):
+        self.write(wrap_length="wide", max_caption_lines=3)
+        config = app_module.load_config()
+        self.assertEqual(config["wrap_length"], app_module.DEFAULT_CONFIG["wrap_length"])
+        self.assertEqual(config["max_caption_lines"], 3)
+
+    def test_reload_applies_live_keys_and_keeps_startup_only_keys(self):
+        replicas = app_module.BASE_CONFIG["model_replicas"]
+        self.write(max_caption_lines=4, model_replicas=replicas + 2)
+        report = app_module.reload_config()
+
+        self.assertEqual(
+            report, {"reloaded": True, "applied": ["max_caption_lines"], "restart_required": ["model_replicas"]}
+        )
+        self.assertEqual(app_module.BASE_CONFIG["max_caption_lines"], 4)
+        self.assertEqual(app_module.BASE_CONFIG["model_replicas"], replicas)
+        self.assertIs(app_module.active_config[0], app_module.BASE_CONFIG)
+
+    def test_invalid_file_is_rejected_as_a_whole(self):
+        before = app_module.BASE_CONFIG
+        self.write(max_caption_lines=4, enable_vad="yes")
+        report = app_module.reload_config()
+        self.assertFalse(report["reloaded"])
+        self.assertIn("enable_vad must be bool", report["error"])
+        self.assertIs(app_module.BASE_CONFIG, before)
+
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("{not json")
+        self.assertFalse(app_module.reload_config()["reloaded"])
+        self.assertIs(app_module.BASE_CONFIG, before)
+
+
+class StreamStateStoreTest(unittest.TestCase):
+    def test_lru_eviction_and_ttl_expiry(self):
+        store = app_module.StreamStateStore(ttl_seconds=60, max_streams=3, stripes=1)
+        for sid in ("a", "b", "c"):
+            store.get_or_create(sid)
+        store.get_or_create("a")      # "b" is now least recently used
+        store.get_or_create("d")
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(len(store), 3)
+
+        store.get("a").last_update -= 120
+        store.get_or_create("a")      # touching refreshes the TTL
+        store.get("c").last_update -= 120
+        self.assertEqual(store.expire(app_module.time.time()), 1)
+        self.assertIsNone(store.pop("c", None))
+        self.assertEqual(sorted(sid for sid, _ in store.items()), ["a", "d"])
+
+    def test_cap_is_global_across_many_stripes(self):
+        # 64 stripes, 1000 streams: an even per-stripe share would be 16, and hash skew
+        # puts far more than 16 on some stripes; all 1000 must still be held
+        store = app_module.StreamStateStore(ttl_seconds=60, max_streams=1000, stripes=64)
+        sids = [f"stream-{i}" for i in range(1000)]
+        for sid in sids:
+            store.get_or_create(sid)
+        self.assertEqual(len(store), 1000)
+        self.assertGreater(max(len(stripe.states) for stripe in store._stripes), 16)
+
+        # At the cap each new stream replaces the least recently used one of its stripe
+        for i in range(200):
+            store.get_or_create(f"late-{i}")
+        self.assertEqual(len(store), 1000)
+        self.assertTrue(all(store.get(f"late-{i}") is not None for i in range(200)))
+
+    def test_cap_comes_from_config(self):
+        self.assertEqual(app_module.stream_states.max_streams, app_module.BASE_CONFIG["max_streams"])
+
+
+class StreamStateJournalTest(unittest.TestCase):
+    def test_restore_replays_appended_snapshots(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="aics-journal-"), "stream_states.jsonl")
+        store = app_module.StreamStateStore(ttl_seconds=60, max_streams=100)
+        journal = app_module.StreamStateJournal(path, store, max_bytes=0)
+
+        live = store.get_or_create("live")
+        live.last_lines = ["first line"]
+        live.is_first_caption = False
+        store.mark_dirty("live")
+        store.get_or_create("stale").last_update -= 120
+        store.mark_dirty("stale")
+        store.get_or_create("reset")
+        store.mark_dirty("reset")
+        self.assertEqual(journal.flush(), 3)
+
+        live.last_lines = ["first line", "second line"]
+        store.mark_dirty("live")
+        store.pop("reset")
+        self.assertEqual(journal.flush(), 2)
+        with open(path, "rb") as f:
+            self.assertEqual(len(f.readlines()), 5)  # appended, never rewritten
+
+        restored_store = app_module.StreamStateStore(ttl_seconds=60, max_streams=100)
+        restored = app_module.StreamStateJournal(path, restored_store, max_bytes=0)
+        self.assertEqual(restored.restore(), 1)
+        state = restored_store.get("live")
+        self.assertEqual(state.last_lines, ["first line", "second line"])
+        self.assertFalse(state.is_first_caption)
+        self.assertIsNone(restored_store.get("stale"))
+        self.assertIsNone(restored_store.get("reset"))
+        with open(path, "rb") as f:
+            self.assertEqual(len(f.readlines()), 1)  # compacted after restore
+
+    def test_evicted_and_expired_streams_stay_gone_after_replay(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="aics-journal-"), "stream_states.jsonl")
+        store = app_module.StreamStateStore(ttl_seconds=60, max_streams=2, stripes=1)
+        journal = app_module.StreamStateJournal(path, store, max_bytes=0)
+        for sid in ("expired", "evicted"):
+            store.get_or_create(sid)
+            store.mark_dirty(sid)
+        self.assertEqual(journal.flush(), 2)
+
+        store.get("expired").last_update -= 120
+        self.assertEqual(store.expire(app_module.time.time()), 1)
+        for sid in ("kept", "newest"):     # "newest" reaches the cap and evicts "evicted"
+            store.get_or_create(sid)
+            store.mark_dirty(sid)
+        self.assertIsNone(store.get("evicted"))
+        self.assertEqual(journal.flush(), 4)
+
+        # A longer TTL on restart must not bring the expired stream back either
+        restored_store = app_module.StreamStateStore(ttl_seconds=3600, max_streams=100)
+        self.assertEqual(app_module.StreamStateJournal(path, restored_store, max_bytes=0).restore(), 2)
+        self.assertEqual(sorted(sid for sid, _ in restored_store.items()), ["kept", "newest"])
+
+    def test_damaged_records_are_skipped(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="aics-journal-"), "stream_states.jsonl")
+        now = time.time()
+        good = lambda sid: json.dumps({"id": sid, "t": now, "l": [sid], "gv": 1})
+        lines = [
+            good("first"),
+            json.dumps({"id": "bad-time", "t": "yesterday"}),           # ValueError
+            json.dumps({"id": "no-time"}),                              # KeyError
+            json.dumps({"id": "bad-votes", "t": now, "gv": None}),       # TypeError
+            json.dumps({"id": "huge-votes", "t": now, "gv": 1e400}),     # OverflowError (inf)
+            json.dumps(["not", "an", "object"]),
+            good("middle"),
+            good("last")[:20],                                          # torn by a crash
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+        store = app_module.StreamStateStore(ttl_seconds=60, max_streams=100)
+        with self.assertLogs(app_module.logger, "WARNING") as logs:
+            self.assertEqual(app_module.StreamStateJournal(path, store, max_bytes=0).restore(), 2)
+        self.assertEqual(sorted(sid for sid, _ in store.items()), ["first", "middle"])
+        self.assertEqual(store.get("middle").last_lines, ["middle"])
+        self.assertEqual(len(logs.records), 6)
+
+
+class LanguageLockTest(unittest.TestCase):
+    def setUp(self):
+        self.stream_id = "language-lock"
+        app_module.stream_states.pop(self.stream_id, None)
+        self.parameters = dict(app_module.BASE_CONFIG, model="tiny", language_lock=True, language_lock_chunks=3)
+
+    def tearDown(self):
+        app_module.stream_states.pop(self.stream_id, None)
+
+    def chunk(self, language, avg_logprob=-0.3):
+        forced = app_module.locked_language(self.stream_id, self.parameters)
+        result = {"language": forced or language, "segments": [{"avg_logprob": avg_logprob}]}
+        return forced, app_module.update_stream_language(self.stream_id, self.parameters, result, forced)
+
+    def test_locks_after_stable_detections_and_unlocks_on_low_confidence(self):
+        self.chunk("de")
+        self.chunk("en")
+        self.chunk("en", avg_logprob=-2.0)  # not confident: no vote
+        self.chunk("en")
+        self.assertEqual(self.chunk("en"), (None, {"language": "en", "language_locked": False}))
+        self.assertEqual(self.chunk("fr"), ("en", {"language": "en", "language_locked": True}))
+
+        self.chunk("en", avg_logprob=-2.0)
+        self.chunk("en", avg_logprob=-2.0)
+        self.assertEqual(self.chunk("fr")[0], None)
+
+    def test_lock_expires(self):
+        for _ in range(3):
+            self.chunk("en")
+        app_module.stream_states.get(self.stream_id).language_locked_at -= self.parameters["language_lock_seconds"] + 1
+        self.assertEqual(self.chunk("en")[0], None)   # re-detected once...
+        self.assertEqual(self.chunk("de")[0], "en")   # ...and locked again
+
+    def test_every_lock_change_is_journaled(self):
+        for _ in range(3):
+            self.chunk("en")
+        state = app_module.stream_states.get(self.stream_id)
+        state.language_locked_at -= self.parameters["language_lock_seconds"] + 1
+        app_module.stream_states.drain_dirty()
+
+        self.assertIsNone(app_module.locked_language(self.stream_id, self.parameters))
+        records = [r for r in app_module.stream_states.drain_dirty() if r["id"] == self.stream_id]
+        self.assertEqual([(r["g"], r["gt"]) for r in records], [("en", 0.0)])
+
+    def test_updates_wait_for_the_stream_lock(self):
+        for _ in range(2):
+            self.chunk("en")
+        done = threading.Event()
+        updater = threading.Thread(target=lambda: (self.chunk("en"), done.set()))
+        with app_module.stream_states.lock_for(self.stream_id):
+            updater.start()
+            self.assertFalse(done.wait(0.1))
+            self.assertEqual(app_module.stream_states.get(self.stream_id).language_votes, 2)
+        updater.join(5)
+        self.assertTrue(done.is_set())
+        self.assertTrue(app_module.stream_states.get(self.stream_id).language_locked_at)
+
+    def test_off_by_default(self):
+        self.assertFalse(app_module.DEFAULT_CONFIG["language_lock"])
+
+
+class FallbackBudgetTest(unittest.TestCase):
+    def decode(self, avg_logprob, compression_ratio=1.5):
+        return {"text": "x", "language": "en", "segments": [
+            {"avg_logprob": avg_logprob, "compression_ratio": compression_ratio, "no_speech_prob": 0.1}
+        ]}
+
+    def run_budgeted(self, decodes, started=None, **overrides):
+        parameters = dict(app_module.BASE_CONFIG, model="tiny", **overrides)
+        with mock.patch.object(app_module, "run_whisper", side_effect=decodes) as run_whisper:
+            result, info = app_module.run_whisper_budgeted(
+                "tiny", None, {"temperature": 0.0}, parameters, started=started
+            )
+        temperatures = [call.args[2]["temperature"] for call in run_whisper.call_args_list]
+        return result, info, temperatures
+
+    def test_no_fallback_by_default(self):
+        _, info, temperatures = self.run_budgeted([self.decode(-2.0)])
+        self.assertEqual(temperatures, [0.0])
+        self.assertEqual(info, {"fallback_attempts": 0, "fallback_exhausted": False, "decode_temperature": 0.0})
+
+    def test_stops_at_first_passing_decode(self):
+        passing = self.decode(-0.4)
+        result, info, temperatures = self.run_budgeted([self.decode(-2.0), passing], max_fallbacks=3)
+        self.assertIs(result, passing)
+        self.assertEqual(temperatures, [0.0, 0.2])
+        self.assertEqual(info, {"fallback_attempts": 1, "fallback_exhausted": False, "decode_temperature": 0.2})
+
+    def test_budget_exhausted_returns_best_hypothesis(self):
+        best = self.decode(-1.2)
+        decodes = [self.decode(-2.0), best, self.decode(-0.5, compression_ratio=3.0)]
+        result, info, temperatures = self.run_budgeted(decodes, max_fallbacks=2)
+        self.assertIs(result, best)
+        self.assertEqual(temperatures, [0.0, 0.2, 0.4])
+        self.assertEqual(info, {"fallback_attempts": 2, "fallback_exhausted": True, "decode_temperature": 0.2})
+
+    def test_deadline_skips_attempts_that_would_not_fit(self):
+        def slow_decode(*args, **kwargs):
+            app_module.time.sleep(0.03)
+            return self.decode(-2.0)
+
+        _, info, temperatures = self.run_budgeted(slow_decode, max_fallbacks=5, fallback_deadline_ms=50)
+        self.assertEqual(temperatures, [0.0])
+        self.assertTrue(info["fallback_exhausted"])
+
+    def test_deadline_counts_from_request_arrival(self):
+        decodes = [self.decode(-2.0), self.decode(-0.4)]
+        _, info, temperatures = self.run_budgeted(list(decodes), max_fallbacks=5, fallback_deadline_ms=500)
+        self.assertEqual(temperatures, [0.0, 0.2])
+        # Same fast decodes, but upload + queueing already took longer than the deadline
+        started = app_module.time.perf_counter() - 1.0
+        _, info, temperatures = self.run_budgeted(list(decodes), started, max_fallbacks=5, fallback_deadline_ms=500)
+        self.assertEqual(temperatures, [0.0])
+        self.assertTrue(info["fallback_exhausted"])
+
+    def test_only_greedy_decodes_are_cached(self):
+        model = mock.Mock()
+        model.transcribe.side_effect = lambda audio, **options: self.decode(-0.4)
+        pool = mock.Mock()
+        pool.acquire.side_effect = lambda *args: contextlib.nullcontext(model)
+        parameters = dict(app_module.BASE_CONFIG, model="tiny", enable_batching=False)
+        audio = np.zeros(1600, np.float32)
+        with mock.patch.object(app_module, "result_cache", app_module.ResultCache(8)), \
+                mock.patch.object(app_module, "model_pool", pool), \
+                mock.patch.object(app_module, "inference_workers", None):
+            for temperature in (0.0, 0.0, 0.2, 0.2):
+                app_module.run_whisper("tiny", audio, {"temperature": temperature}, parameters)
+            entries = app_module.result_cache.status()["entries"]
+        self.assertEqual([call.kwargs["temperature"] for call in model.transcribe.call_args_list], [0.0, 0.2, 0.2])
+        self.assertEqual(entries, 1)
+
+
+class PipelineStageTest(unittest.TestCase):
+    def test_limiter_caps_concurrency_on_the_calling_thread(self):
+        limiter = app_module.StageLimiter("cpu", 2)
+        gate = threading.Event()
+        lock = threading.Lock()
+        running, peak, threads_seen = [0], [0], []
+
+        def work():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                threads_seen.append(threading.get_ident())
+            gate.wait(5)
+            with lock:
+                running[0] -= 1
+
+        callers = [threading.Thread(target=limiter.run, args=(work,)) for _ in range(4)]
+        for caller in callers:
+            caller.start()
+        deadline = time.time() + 5
+        while limiter.depth() < 2 and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertEqual((running[0], limiter.depth()), (2, 2))
+        gate.set()
+        for caller in callers:
+            caller.join(5)
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(sorted(threads_seen), sorted(caller.ident for caller in callers))
+
+    def test_decode_overlaps_another_requests_inference(self):
+        in_inference, release, decoded = threading.Event(), threading.Event(), threading.Event()
+        prepare_upload = app_module.prepare_upload
+        fallback = {"fallback_attempts": 0, "fallback_exhausted": False, "decode_temperature": 0.0}
+
+        def fake_infer(model_name, audio, options, parameters, background=False, started=None):
+            if not in_inference.is_set():
+                in_inference.set()
+                release.wait(5)        # first request holds the "replica"
+            return {"text": "", "segments": [], "language": "en"}, fallback
+
+        def tracking_prepare(upload, filename, mimetype, parameters):
+            analysis = prepare_upload(upload, filename, mimetype, parameters)
+            if in_inference.is_set():
+                decoded.set()
+            return analysis
+
+        def post(audio_id, responses):
+            data = {
+                "audio": (io.BytesIO(wav_bytes(np.zeros(16000, np.float32))), "a.wav"),
+                "stream_id": "overlap-" + audio_id, "audio_id": audio_id
+            }
+            responses.append(app_module.app.test_client().post("/transcribe", data=data).status_code)
+
+        responses = []
+        with mock.patch.object(app_module, "ensure_model"), \
+                mock.patch.object(app_module, "run_whisper_budgeted", side_effect=fake_infer), \
+                mock.patch.object(app_module, "prepare_upload", side_effect=tracking_prepare):
+            first = threading.Thread(target=post, args=("1", responses))
+            first.start()
+            self.assertTrue(in_inference.wait(5))
+            second = threading.Thread(target=post, args=("2", responses))
+            second.start()
+            try:
+                # The second upload is decoded + VAD-scanned while the first is still in inference
+                self.assertTrue(decoded.wait(5))
+                self.assertTrue(first.is_alive())
+            finally:
+                release.set()
+                first.join(5)
+                second.join(5)
+        for audio_id in ("1", "2"):
+            app_module.stream_states.pop("overlap-" + audio_id, None)
+        self.assertEqual(responses, [200, 200])
+
+    def test_streamed_body_stays_under_the_post_stage_cap(self):
+        fallback = {"fallback_attempts": 0, "fallback_exhausted": False, "decode_temperature": 0.0}
+        stream_json_response = app_module.stream_json_response
+        lock = threading.Lock()
+        running, peak = [0], [0]
+
+        def tracking_stream(response_obj):
+            # Runs while the test client reads the body, after the handler has returned
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            try:
+                for chunk in stream_json_response(response_obj):
+                    time.sleep(0.01)
+                    yield chunk
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        def post(audio_id, bodies):
+            data = {
+                "audio": (io.BytesIO(wav_bytes(np.zeros(16000, np.float32))), "a.wav"),
+                "stream_id": "stream-cap-" + audio_id, "audio_id": audio_id, "stream_response": "true"
+            }
+            bodies.append(json.loads(app_module.app.test_client().post("/transcribe", data=data).get_data()))
+
+        bodies = []
+        with mock.patch.object(app_module, "ensure_model"), \
+                mock.patch.object(app_module, "run_whisper_budgeted",
+                                  return_value=({"text": "", "segments": [], "language": "en"}, fallback)), \
+                mock.patch.object(app_module, "stream_json_response", side_effect=tracking_stream), \
+                mock.patch.object(app_module, "post_stage", app_module.StageLimiter("post", 1)):
+            callers = [threading.Thread(target=post, args=(str(i), bodies)) for i in range(4)]
+            for caller in callers:
+                caller.start()
+            for caller in callers:
+                caller.join(10)
+        for i in range(4):
+            app_module.stream_states.pop("stream-cap-" + str(i), None)
+
+        self.assertEqual(len(bodies), 4)
+        self.assertTrue(all(body["antix"]["stream_response"] for body in bodies))
+        self.assertEqual(peak[0], 1)
+
+
+class StreamIngestSessionTest(unittest.TestCase):
+    """
+    /stream segmentation: cut after speech + stream_silence_ms, carry the overlap
+    into the next segment and drop Whisper segments that end inside it.
+    """
+
+    class EnergyVad:
+        # Stand-in for webrtcvad: a frame is speech when it holds any non-zero sample
+        def is_speech(self, frame, rate):
+            return any(bytes(frame))
+
+    def setUp(self):
+        self.stream_id = "ingest-test"
+        app_module.stream_states.pop(self.stream_id, None)
+        self.parameters = dict(
+            app_module.BASE_CONFIG,
+            model="tiny", stream_silence_ms=300, silence_threshold=1.0,
+            stream_max_segment_seconds=10.0, stream_overlap_seconds=0.3, language_lock=False,
+            enable_caps=False
+        )
+        self.decoded_seconds = []
+
+    def tearDown(self):
+        app_module.stream_states.pop(self.stream_id, None)
+
+    def fake_whisper(self, model_name, audio, options, parameters, background=False):
+        self.decoded_seconds.append(round(len(audio) / 16000, 3))
+        return {"text": "", "language": "en", "segments": [
+            {"start": 0.1, "end": 0.2, "text": " early"},
+            {"start": 0.5, "end": 1.0, "text": " hello world"}
+        ]}
+
+    def test_segments_offsets_and_overlap(self):
+        frame = 480  # 30 ms
+        speech = np.full(33 * frame, 1000, dtype="<i2").tobytes()   # 0.99 s
+        silence = bytes(20 * frame * 2)                              # 0.6 s
+
+        with mock.patch.object(app_module, "run_whisper", side_effect=self.fake_whisper):
+            session = app_module.StreamIngestSession(self.stream_id, self.parameters)
+            session.vad = self.EnergyVad()
+            session.push(speech + silence)
+            session.push(speech + silence)
+            session.close()
+
+            events = []
+            while not events or events[-1]["type"] != "end":
+                events.append(session.events.get(timeout=10))
+
+        # Cut after speech + 0.3 s of silence; the second segment starts 0.3 s back
+        # (the overlap) and also holds the silence that was pushed after the first cut
+        self.assertEqual(self.decoded_seconds, [1.29, 1.89])
+        captions = [(e["start"], e["end"], e["text"].split("\n")[-1]) for e in events if e["type"] == "caption"]
+        self.assertEqual(captions, [
+            (0.1, 0.2, "early"),
+            (0.5, 1.0, "hello world"),
+            (1.49, 1.99, "hello world")   # offset 0.99 s; the segment ending inside the overlap is dropped
+        ])
+
+
+class BenchmarkSmokeTest(unittest.TestCase):
+    def test_main_runs_a_tiny_benchmark(self):
+        spec = importlib.util.spec_from_file_location("aics_benchmark", os.path.join(BASE_DIR, "benchmark.py"))
+        benchmark = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(benchmark)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            report_path = os.path.join(tmp, "report.json")
+            argv = [
+                "--requests", "3", "--concurrency", "2", "--warmup", "1", "--chunks", "2",
+                "--chunk-seconds", "1", "--stub-rtf", "0", "--json", report_path
+            ]
+            # load_app swaps in the stub model globally; put the real loader back afterwards
+            with mock.patch.object(whisper, "load_model", whisper.load_model), \
+                    contextlib.redirect_stdout(io.StringIO()) as out:
+                self.assertEqual(benchmark.main(argv), 0)
+            with open(report_path, "r", encoding="utf-8") as f:
+                report = json.load(f)
+
+        self.assertIn("throughput:", out.getvalue())
+        self.assertEqual(report["version"], app_module.APP_VERSION)
+        self.assertEqual(report["latency"]["count"], 3)
+        self.assertEqual(report["stages"]["inference"]["count"], 3)
+
+
+class LoggingTest(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.log_dir, "aics.log")
+        config = dict(
+            app_module.BASE_CONFIG, log_level="DEBUG", log_console=False, log_file=self.log_file,
+            log_max_bytes=600, log_backup_count=2, log_queue_size=1000
+        )
+        # setup_logging configures the shared "aics" logger: give it an empty handler
+        # list for the test (the service's own console/file output stays untouched)
+        self.addCleanup(app_module.logger.setLevel, app_module.logger.level)
+        handlers = mock.patch.object(app_module.logger, "handlers", [])
+        handlers.start()
+        self.addCleanup(handlers.stop)
+        with mock.patch.object(app_module.atexit, "register"):
+            self.log, self.listener = app_module.setup_logging(config)
+
+    def read_records(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if '"logging-test' in line]
+
+    def test_record_shape(self):
+        self.log.info("logging-test %s", "one", extra={"fields": {"model": "tiny", "antix": {"id": "s/1"}}})
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            self.log.exception("logging-test two")
+        self.listener.stop()
+
+        first, second = self.read_records(self.log_file)
+        self.assertEqual(list(first), ["ts", "time", "level", "msg", "model", "antix"])
+        self.assertEqual((first["level"], first["msg"], first["model"], first["antix"]), ("INFO", "logging-test one", "tiny", {"id": "s/1"}))
+        self.assertAlmostEqual(first["ts"], time.time(), delta=60)
+        self.assertRegex(first["time"], r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d$")
+        self.assertEqual((second["level"], second["msg"]), ("ERROR", "logging-test two"))
+        self.assertIn("RuntimeError: boom", second["exc"])
+
+    def test_file_rotates_by_size(self):
+        for i in range(40):
+            self.log.info("logging-test %02d", i)
+        self.listener.stop()
+
+        files = sorted(os.listdir(self.log_dir))
+        self.assertEqual(files, ["aics.log", "aics.log.1", "aics.log.2"])
+        for name in files:
+            self.assertLessEqual(os.path.getsize(os.path.join(self.log_dir, name)), 600)
+        # Newest records in the live file, older ones shifted to .1 then .2, nothing out of order
+        kept = [r["msg"] for name in reversed(files) for r in self.read_records(os.path.join(self.log_dir, name))]
+        self.assertEqual(kept, [f"logging-test {i:02d}" for i in range(40 - len(kept), 40)])
+
+
+if __name__ == "__main__":
+    unittest.main()